@@ -0,0 +1,280 @@
+"""時系列のバックテスト（ローリングオリジン評価）モジュール"""
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, r2_score, mean_absolute_percentage_error
+from global_model import fit_global_model
+from rolling_features import RECURSIVE_FORECAST, RollingFeaturizer, recursive_forecast, rolling_feature_names
+from utils.executor import limit_worker_threads
+from utils.model_storage import NativeModel
+
+# バックテスト設定（学習コマンド・train_store_models の学習時のみ、予測リクエストの学習では行わない）
+BACKTEST_ENABLED = os.getenv('BACKTEST_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+BACKTEST_FOLDS = int(os.getenv('BACKTEST_FOLDS', 4))  # 評価する予測起点の数
+BACKTEST_HORIZON = int(os.getenv('BACKTEST_HORIZON', 7))  # 1つの起点から予測する日数
+BACKTEST_MIN_TRAIN_ROWS = int(os.getenv('BACKTEST_MIN_TRAIN_ROWS', 60))  # 学習データがこれより少ない起点は評価しない
+BACKTEST_WORKERS = int(os.getenv('BACKTEST_WORKERS', 1))  # 1の場合はプロセスを使わずに実行
+
+def make_folds(
+    dates: pd.Series, n_folds: int = BACKTEST_FOLDS, horizon: int = BACKTEST_HORIZON,
+    min_train_rows: int = BACKTEST_MIN_TRAIN_ROWS
+) -> List[Dict]:
+    """
+    ローリングオリジンの分割を作成
+
+    最後の n_folds * horizon 日を horizon 日ずつの評価期間に分け、各評価期間より前の
+    すべての行で学習する（起点ごとに学習期間が伸びる）。
+
+    Args:
+        dates: 学習データの日付（行の並びは日付順）
+
+    Returns:
+        List[Dict]: {'train_idx', 'test_idx', 'test_start', 'test_end'}（行位置はNumPy配列）
+    """
+    values = pd.to_datetime(dates).to_numpy().astype('datetime64[D]')
+    if len(values) == 0:
+        return []
+    last = values.max()
+    folds = []
+    for k in range(n_folds, 0, -1):
+        test_start = last - np.timedelta64(horizon * k - 1, 'D')
+        test_end = test_start + np.timedelta64(horizon - 1, 'D')
+        train_idx = np.flatnonzero(values < test_start)
+        test_idx = np.flatnonzero((values >= test_start) & (values <= test_end))
+        if len(train_idx) < min_train_rows or len(test_idx) == 0:
+            continue
+        folds.append({
+            'train_idx': train_idx,
+            'test_idx': test_idx,
+            'test_start': str(test_start),
+            'test_end': str(test_end),
+        })
+    return folds
+
+def _metrics(y_true: np.ndarray, y_pred: np.ndarray) -> Dict[str, float]:
+    return {
+        'mae': float(mean_absolute_error(y_true, y_pred)),
+        'r2': float(r2_score(y_true, y_pred)) if len(y_true) > 1 else 0.0,
+        'mape': float(mean_absolute_percentage_error(y_true, y_pred)),
+    }
+
+# ワーカープロセスごとに読み込んだDataset（バイナリファイルのパス -> Dataset）
+_worker_datasets: Dict[str, lgb.Dataset] = {}
+
+def _fit_fold(
+    dataset: lgb.Dataset, params: Dict, num_boost_round: int, y: np.ndarray, train_idx: np.ndarray
+) -> lgb.Booster:
+    """ビン分割済みのDatasetから学習期間の行だけを取り出して学習"""
+    dataset.set_label(y)
+    return lgb.train(params, dataset.subset(train_idx).construct(), num_boost_round=num_boost_round)
+
+def _fit_fold_in_worker(
+    binary_path: str, params: Dict, num_boost_round: int, y: np.ndarray, train_idx: np.ndarray
+) -> str:
+    """ワーカープロセスで1つの起点のモデルを学習（Datasetはプロセスごとに1回だけ読み込む、モデルは文字列で返す）"""
+    dataset = _worker_datasets.get(binary_path)
+    if dataset is None:
+        dataset = lgb.Dataset(binary_path, params={'verbose': -1}).construct()
+        _worker_datasets.clear()
+        _worker_datasets[binary_path] = dataset
+    return _fit_fold(dataset, params, num_boost_round, y, train_idx).model_to_string()
+
+def _forecast_fold(
+    boosters: Dict[str, lgb.Booster], train_X: pd.DataFrame, fold: Dict, history: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """
+    評価期間を予測時（predictor._predict_future）と同じ方法で予測
+
+    評価期間の行のラグ・移動平均特徴量は実績値から作られているため、そのまま使うと
+    評価期間内の実績が漏れる。RECURSIVE_FORECAST の場合は学習期間の値でリングバッファを
+    初期化して予測値から1日ずつ作り直し、それ以外は予測時と同じく0にする。
+    """
+    X_test = train_X.iloc[fold['test_idx']]
+    if RECURSIVE_FORECAST:
+        featurizer = RollingFeaturizer({key: values[fold['train_idx']] for key, values in history.items()})
+        models = {key: NativeModel(booster) for key, booster in boosters.items()}
+        return recursive_forecast(models, X_test, featurizer)
+    rolling_columns = [
+        name for key in history for name in rolling_feature_names(key) if name in X_test.columns
+    ]
+    X_test = X_test.copy()
+    X_test[rolling_columns] = 0
+    return {key: booster.predict(X_test) for key, booster in boosters.items()}
+
+def run_backtest(
+    dataset: lgb.Dataset,
+    train_X: pd.DataFrame,
+    y_targets: Dict[str, pd.Series],
+    dates: pd.Series,
+    params: Dict,
+    num_boost_round: int,
+    workers: int = BACKTEST_WORKERS,
+    n_folds: int = BACKTEST_FOLDS,
+    horizon: int = BACKTEST_HORIZON,
+    history: Optional[Dict[str, pd.Series]] = None
+) -> Dict[str, Optional[Dict]]:
+    """
+    売上項目ごとにローリングオリジンのバックテストを実行し、予測期間外（out-of-sample）の指標を返す
+
+    特徴量のビン分割は店舗ごとに1回だけ行い（dataset）、各起点はその部分集合で学習する。
+    workers > 1 の場合はDatasetをバイナリファイルに書き出し、（売上項目, 起点）ごとの学習を
+    プロセスプールで並列に実行する。評価期間は起点ごとにすべての売上項目のモデルで
+    予測時と同じ方法（RECURSIVE_FORECAST の再帰予測）で予測する（_forecast_fold）。
+
+    Args:
+        dataset: train_X から作成済みのDataset（構築済み、free_raw_data=False）
+        train_X: 特徴量行列（評価期間の予測に使う）
+        y_targets: 売上項目ごとの目的変数
+        dates: train_X の各行の日付
+        params: lgb.train の学習パラメータ
+        num_boost_round: ブースティング回数
+        history: ラグ・移動平均特徴量を作る売上項目ごとの値（train_X と同じ行、Noneの場合は y_targets）
+
+    Returns:
+        Dict: 売上項目ごとの {'mae', 'r2', 'mape', 'n_folds', 'horizon_days', 'folds', 'seconds'}
+              （評価できる起点がない場合はNone）
+    """
+    folds = make_folds(dates, n_folds=n_folds, horizon=horizon)
+    if not folds:
+        return {sales_key: None for sales_key in y_targets}
+
+    started = time.perf_counter()
+    tasks = [
+        (sales_key, fold_no, np.asarray(y, dtype=float), fold)
+        for sales_key, y in y_targets.items()
+        for fold_no, fold in enumerate(folds)
+    ]
+    boosters: Dict[Tuple[str, int], lgb.Booster] = {}
+
+    if workers > 1 and len(tasks) > 1:
+        with tempfile.TemporaryDirectory(prefix='backtest_') as tmp_dir:
+            binary_path = os.path.join(tmp_dir, 'dataset.bin')
+            dataset.save_binary(binary_path)
+            workers = min(workers, len(tasks))
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # DB接続などを親から引き継がないようspawnで起動する
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=limit_worker_threads,
+                initargs=(threads,),
+            ) as pool:
+                futures = {
+                    (sales_key, fold_no): pool.submit(
+                        _fit_fold_in_worker, binary_path, params, num_boost_round, y, fold['train_idx'],
+                    )
+                    for sales_key, fold_no, y, fold in tasks
+                }
+                boosters = {key: lgb.Booster(model_str=future.result()) for key, future in futures.items()}
+    else:
+        for sales_key, fold_no, y, fold in tasks:
+            boosters[(sales_key, fold_no)] = _fit_fold(dataset, params, num_boost_round, y, fold['train_idx'])
+    
+    history = {
+        key: np.asarray(values, dtype=float)
+        for key, values in (history if history is not None else y_targets).items()
+    }
+    predictions: Dict[Tuple[str, int], np.ndarray] = {}
+    for fold_no, fold in enumerate(folds):
+        fold_predictions = _forecast_fold(
+            {sales_key: boosters[(sales_key, fold_no)] for sales_key in y_targets}, train_X, fold, history
+        )
+        for sales_key in y_targets:
+            predictions[(sales_key, fold_no)] = fold_predictions[sales_key]
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for sales_key, y in y_targets.items():
+        y = np.asarray(y, dtype=float)
+        fold_results = []
+        y_true_all = []
+        y_pred_all = []
+        for fold_no, fold in enumerate(folds):
+            y_true = y[fold['test_idx']]
+            y_pred = predictions[(sales_key, fold_no)]
+            y_true_all.append(y_true)
+            y_pred_all.append(y_pred)
+            fold_results.append({
+                'test_start': fold['test_start'],
+                'test_end': fold['test_end'],
+                'n_train': int(len(fold['train_idx'])),
+                'n_test': int(len(fold['test_idx'])),
+                **_metrics(y_true, y_pred),
+            })
+        results[sales_key] = {
+            **_metrics(np.concatenate(y_true_all), np.concatenate(y_pred_all)),
+            'n_folds': len(folds),
+            'horizon_days': horizon,
+            'rolling_features': 'recursive' if RECURSIVE_FORECAST else 'zero',
+            'folds': fold_results,
+            'seconds': elapsed / len(y_targets),
+        }
+    return results
+
+def run_global_backtest(
+    train_X: pd.DataFrame,
+    y: pd.Series,
+    dates: pd.Series,
+    sales_key: str,
+    params: Dict,
+    num_boost_round: int,
+    n_folds: int = BACKTEST_FOLDS,
+    horizon: int = BACKTEST_HORIZON
+) -> Optional[Dict]:
+    """
+    全店舗共通モデルのローリングオリジンのバックテスト
+
+    起点ごとに全店舗の学習期間の行で共通モデルを学習し、評価期間を店舗ごとに
+    予測時と同じ方法（その店舗の学習期間の値で初期化した再帰予測）で予測する。
+
+    Args:
+        train_X: 全店舗分を積み上げた特徴量行列（store_id 列を含む、店舗ごとに日付の昇順）
+        y: 目的変数
+        dates: train_X の各行の日付
+        sales_key: 売上項目（ラグ・移動平均特徴量の列名に使う）
+
+    Returns:
+        Dict: run_backtest の売上項目ごとの結果と同じ形式（評価できる起点がない場合はNone）
+    """
+    folds = make_folds(dates, n_folds=n_folds, horizon=horizon)
+    if not folds:
+        return None
+
+    started = time.perf_counter()
+    y = np.asarray(y, dtype=float)
+    stores = train_X['store_id'].to_numpy()
+    fold_results = []
+    y_true_all = []
+    y_pred_all = []
+    for fold in folds:
+        train_idx, test_idx = fold['train_idx'], fold['test_idx']
+        booster = fit_global_model(train_X.iloc[train_idx], pd.Series(y[train_idx]), params, num_boost_round)
+        y_pred = np.empty(len(test_idx))
+        for store_id in np.unique(stores[test_idx]):
+            in_store = stores[test_idx] == store_id
+            store_fold = {'train_idx': train_idx[stores[train_idx] == store_id], 'test_idx': test_idx[in_store]}
+            y_pred[in_store] = _forecast_fold({sales_key: booster}, train_X, store_fold, {sales_key: y})[sales_key]
+        y_true = y[test_idx]
+        y_true_all.append(y_true)
+        y_pred_all.append(y_pred)
+        fold_results.append({
+            'test_start': fold['test_start'],
+            'test_end': fold['test_end'],
+            'n_train': int(len(train_idx)),
+            'n_test': int(len(test_idx)),
+            **_metrics(y_true, y_pred),
+        })
+    return {
+        **_metrics(np.concatenate(y_true_all), np.concatenate(y_pred_all)),
+        'n_folds': len(folds),
+        'horizon_days': horizon,
+        'rolling_features': 'recursive' if RECURSIVE_FORECAST else 'zero',
+        'folds': fold_results,
+        'seconds': time.perf_counter() - started,
+    }
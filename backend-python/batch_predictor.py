@@ -0,0 +1,168 @@
+"""複数店舗の一括売上予測モジュール"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+import pandas as pd
+from data_loader import get_all_store_ids, get_store_locations, load_weather_bulk
+from predictor import run_sales_prediction
+from utils.database import db_connection
+from utils.executor import limit_worker_threads
+from utils.sales_fields import get_sales_fields_bulk
+
+# 一括予測の設定
+BATCH_PREDICTION_WORKERS = int(os.getenv('BATCH_PREDICTION_WORKERS', os.cpu_count() or 1))
+BATCH_MAX_STORES = int(os.getenv('BATCH_MAX_STORES', 500))  # 1回のリクエストで受け付ける店舗数の上限
+
+_batch_pool: Optional[ProcessPoolExecutor] = None
+_batch_pool_lock = threading.Lock()
+
+def get_batch_pool() -> ProcessPoolExecutor:
+    """一括予測用のプロセスプールを取得（初回呼び出し時に作成）"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            workers = max(1, BATCH_PREDICTION_WORKERS)
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # DB接続などを親から引き継がないようspawnで起動する
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=limit_worker_threads,
+                initargs=(threads,),
+            )
+        return _batch_pool
+
+def shutdown_batch_pool():
+    """一括予測用のプロセスプールを終了する"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is not None:
+            _batch_pool.shutdown(wait=False, cancel_futures=True)
+            _batch_pool = None
+
+def _discard_broken_pool(pool: ProcessPoolExecutor):
+    """ワーカーが異常終了したプールを破棄（次回のリクエストで作り直す）"""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is pool:
+            _batch_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _predict_store(
+    store_id: int,
+    predict_days: int,
+    start_date: date,
+    retrain: bool,
+    sales_fields_list: List[Dict],
+    future_weather: pd.DataFrame
+) -> Dict:
+    """ワーカープロセスで1店舗の予測を実行（例外は店舗ごとのエラーとして返す）"""
+    try:
+        result = run_sales_prediction(
+            store_id=store_id,
+            predict_days=predict_days,
+            start_date=start_date,
+            retrain=retrain,
+            sales_fields_list=sales_fields_list,
+            future_weather=future_weather,
+        )
+        return {
+            'store_id': store_id,
+            'success': True,
+            'predictions': result['predictions'],
+            'metrics': result['metrics'],
+        }
+    except Exception as e:
+        return {'store_id': store_id, 'success': False, 'error': str(e)}
+
+def run_batch_prediction(
+    store_ids: Optional[List[int]] = None,
+    predict_days: int = 7,
+    start_date: Optional[date] = None,
+    retrain: bool = False
+) -> Dict:
+    """
+    複数店舗の売上予測をまとめて実行
+
+    店舗の位置・売上項目・予測期間の天気は全店舗分を数回のクエリで先に取得し、
+    店舗ごとの学習・予測はプロセスプールに分散する。1店舗の失敗はほかの店舗に影響しない。
+
+    Args:
+        store_ids: 店舗IDのリスト（Noneの場合は売上データのある全店舗）
+        predict_days: 予測日数（デフォルト7日）
+        start_date: 予測開始日（Noneの場合は今日）
+        retrain: モデルを再学習するか
+
+    Returns:
+        Dict: {'results': 店舗ごとの予測結果, 'errors': 店舗ごとのエラー, 'elapsed_seconds': 所要時間}
+    """
+    started = time.perf_counter()
+    if start_date is None:
+        start_date = date.today()
+    end_date = start_date + timedelta(days=predict_days - 1)
+
+    with db_connection():
+        if store_ids is None:
+            store_ids = get_all_store_ids()
+        store_ids = list(dict.fromkeys(store_ids))
+        if len(store_ids) > BATCH_MAX_STORES:
+            raise ValueError(f"Too many stores in one batch ({len(store_ids)} > {BATCH_MAX_STORES})")
+
+        locations = get_store_locations(store_ids)
+        sales_fields = get_sales_fields_bulk(store_ids)
+        weather = load_weather_bulk(
+            [loc for loc in locations.values() if loc is not None], start_date, end_date
+        )
+
+    outcomes: Dict[int, Dict] = {}
+    tasks = []
+    for store_id in store_ids:
+        if store_id not in locations:
+            outcomes[store_id] = {'store_id': store_id, 'success': False, 'error': f"Store {store_id} not found"}
+        elif locations[store_id] is None:
+            outcomes[store_id] = {
+                'store_id': store_id, 'success': False,
+                'error': f"Store {store_id} does not have latitude/longitude",
+            }
+        else:
+            tasks.append((
+                store_id, predict_days, start_date, retrain,
+                sales_fields[store_id], weather[locations[store_id]],
+            ))
+
+    print(f"[一括予測] {len(tasks)}店舗を予測します（対象外: {len(outcomes)}店舗）")
+
+    if tasks:
+        pool = get_batch_pool()
+        futures = {pool.submit(_predict_store, *task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            store_id = futures[future]
+            try:
+                outcomes[store_id] = future.result()
+            except BrokenProcessPool as e:
+                _discard_broken_pool(pool)
+                outcomes[store_id] = {'store_id': store_id, 'success': False, 'error': f"Worker failed: {e}"}
+            except Exception as e:
+                outcomes[store_id] = {'store_id': store_id, 'success': False, 'error': str(e)}
+
+    results = []
+    errors = []
+    for store_id in store_ids:
+        outcome = outcomes[store_id]
+        if outcome.pop('success'):
+            results.append(outcome)
+        else:
+            errors.append(outcome)
+
+    elapsed = time.perf_counter() - started
+    print(f"[一括予測] 完了: 成功 {len(results)}店舗, 失敗 {len(errors)}店舗 ({elapsed:.1f}秒)")
+    return {
+        'results': results,
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+    }
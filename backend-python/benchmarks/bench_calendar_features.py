@@ -0,0 +1,72 @@
+"""
+カレンダー特徴量作成のベンチマーク
+
+従来の行ごとの .apply 版と calendar_features（ベクトル化版）を
+複数年の履歴で比較し、結果が一致することも確認する。
+
+使い方:
+    python benchmarks/bench_calendar_features.py [--years 1 3 5 10] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from calendar_features import calendar_features  # noqa: E402
+from predictor_improved import EVENTS  # noqa: E402
+
+def legacy_calendar_features(df: pd.DataFrame) -> pd.DataFrame:
+    """従来の make_features と同じ .apply ベースの実装（比較用）"""
+    features_df = pd.DataFrame({
+        'weekday': df['date'].apply(lambda d: d.weekday()),
+        'month': df['date'].apply(lambda d: d.month),
+        'day': df['date'].apply(lambda d: d.day),
+        'is_month_start': df['date'].apply(lambda d: 1 if d.day == 1 else 0),
+        'is_month_end': df['date'].apply(lambda d: 1 if d.day == pd.Timestamp(d).days_in_month else 0),
+        'dayofyear': df['date'].apply(lambda d: d.timetuple().tm_yday),
+        'week_of_month': df['date'].apply(lambda d: (d.day - 1) // 7 + 1),
+        'is_payday': df['date'].apply(lambda d: 1 if d.day == 25 or d.day == pd.Timestamp(d).days_in_month else 0),
+        'is_weekend': df['date'].apply(lambda d: 1 if d.weekday() >= 5 else 0),
+    })
+    for event_name, event_func in EVENTS.items():
+        features_df[f'is_{event_name}'] = df['date'].apply(lambda d: int(event_func(d)))
+    return features_df
+
+def make_history(years: int) -> pd.DataFrame:
+    """load_sales_data と同じく datetime.date の列を持つ履歴を作成"""
+    dates = pd.date_range(date(2025 - years, 1, 1), date(2024, 12, 31), freq='D')
+    return pd.DataFrame({'date': [d.date() for d in dates]})
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 3, 5, 10])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'years':>5} {'rows':>6} {'apply (ms)':>11} {'vectorized (ms)':>16} {'speedup':>8}")
+    for years in args.years:
+        df = make_history(years)
+        expected = legacy_calendar_features(df)
+        actual = calendar_features(df['date'], extended=True, events=True)
+        pd.testing.assert_frame_equal(actual[expected.columns], expected)
+
+        legacy_time = best_of(lambda: legacy_calendar_features(df), args.repeat)
+        vectorized_time = best_of(lambda: calendar_features(df['date'], extended=True, events=True), args.repeat)
+        print(f"{years:>5} {len(df):>6} {legacy_time * 1000:>11.1f} {vectorized_time * 1000:>16.2f} "
+              f"{legacy_time / vectorized_time:>7.0f}x")
+
+if __name__ == '__main__':
+    main()
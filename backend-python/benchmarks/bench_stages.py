@@ -0,0 +1,322 @@
+"""
+予測処理の段階別ベンチマーク
+
+合成した sales_data（daily_data に約45項目のJSONB）と weather_data を使い、
+load_sales_data / make_features / 特徴量行列の作成（get_dummies・align_features）/
+LightGBMの学習 / load_model / predict をそれぞれ計測して、結果をJSONに書き出す。
+
+データベースは次のどちらかを使う:
+    fake     : utils.database.execute_query の代わりにメモリ上のデータを返す（既定、DB不要）
+               SQL展開版の読み込み（SALES_LOADER_MODE=sql）は計測できないため python 版のみ
+    postgres : DB_HOST などの接続先に使い捨てのスキーマを作ってデータを投入し、終了時に削除する
+
+使い方:
+    python benchmarks/bench_stages.py [--stores 3] [--years 3] [--fields 45] [--repeat 3]
+    python benchmarks/bench_stages.py --backend postgres --output results.json
+"""
+import argparse
+import calendar
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+from lightgbm import LGBMRegressor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import data_loader  # noqa: E402
+from predictor import build_design_matrix, make_features  # noqa: E402
+from utils import model_storage, weather_cache  # noqa: E402
+from utils.weather_cache import WEATHER_COLUMNS  # noqa: E402
+
+SALES_KEYS = ['edwNetSales', 'ohbNetSales']
+WEATHER_KINDS = ['晴れ', '曇り', '雨', '雪', '']
+
+def generate_dataset(n_stores: int, years: int, n_fields: int, seed: int = 42) -> Dict[str, List[Dict]]:
+    """
+    店舗・売上（daily_data）・天気の合成データを作成
+
+    売上は曜日と季節で変動させ、daily_data には売上項目・客数・天気の値のほかに
+    合計 n_fields 項目になるまで数値項目を追加する。
+    """
+    rng = random.Random(seed)
+    end_year = date.today().year - 1
+    start_year = end_year - years + 1
+    locations = [(round(35.0 + i * 0.5, 4), round(135.0 + i * 0.5, 4)) for i in range(max(1, n_stores // 2))]
+
+    stores = []
+    sales = []
+    for store_id in range(1, n_stores + 1):
+        latitude, longitude = locations[(store_id - 1) % len(locations)]
+        stores.append({'id': store_id, 'latitude': latitude, 'longitude': longitude, 'address': f'store {store_id}'})
+        base = rng.uniform(60000, 140000)
+        for year in range(start_year, end_year + 1):
+            for month in range(1, 13):
+                daily_data = {}
+                for day in range(1, calendar.monthrange(year, month)[1] + 1):
+                    d = date(year, month, day)
+                    season = 1 + 0.2 * np.sin(2 * np.pi * d.timetuple().tm_yday / 365)
+                    weekend = 1.3 if d.weekday() >= 5 else 1.0
+                    record = {
+                        'edwNetSales': int(base * season * weekend * rng.uniform(0.8, 1.2)),
+                        'ohbNetSales': int(base * 0.1 * season * rng.uniform(0.5, 1.5)),
+                        'edwCustomers': rng.randint(100, 400),
+                        'ohbCustomers': rng.randint(5, 60),
+                        'temperature': round(rng.uniform(-5, 35), 1),
+                        'humidity': round(rng.uniform(20, 90), 1),
+                        'weather': rng.choice(WEATHER_KINDS),
+                        'isHoliday': False,
+                    }
+                    for k in range(max(0, n_fields - len(record))):
+                        record[f'field{k}'] = rng.choice([rng.randint(0, 1000), round(rng.random() * 10, 2), None])
+                    daily_data[str(day)] = record
+                sales.append({'store_id': store_id, 'year': year, 'month': month, 'daily_data': daily_data})
+
+    weather = []
+    d = date(start_year, 1, 1)
+    last = date.today() + timedelta(days=30)
+    while d <= last:
+        for latitude, longitude in locations:
+            weather.append({
+                'latitude': latitude, 'longitude': longitude, 'date': d,
+                'weather': rng.choice(WEATHER_KINDS),
+                'temperature': round(rng.uniform(-5, 35), 2), 'humidity': round(rng.uniform(20, 90), 2),
+                'precipitation': rng.choice([0, 0, 1.5, 10.0]), 'snow': 0, 'windspeed': round(rng.uniform(0, 10), 2),
+                'gust': rng.choice([None, 5.0]), 'pressure': 1013, 'feelslike': round(rng.uniform(-5, 35), 2),
+            })
+        d += timedelta(days=1)
+    return {'stores': stores, 'sales': sales, 'weather': weather}
+
+class FakeDatabase:
+    """
+    execute_query / fetch_frame の代わりにメモリ上の合成データを返す（data_loader の python 版が発行するクエリのみ対応）
+    """
+
+    def __init__(self, dataset: Dict[str, List[Dict]]):
+        self.stores = {s['id']: s for s in dataset['stores']}
+        self.sales: Dict[int, List[Dict]] = {}
+        for row in dataset['sales']:
+            self.sales.setdefault(row['store_id'], []).append(row)
+        self.weather: Dict[tuple, Dict[date, Dict]] = {}
+        for row in dataset['weather']:
+            self.weather.setdefault((row['latitude'], row['longitude']), {})[row['date']] = row
+        self.queries = 0
+
+    def execute_query(self, query: str, params: tuple = None) -> List[Dict]:
+        self.queries += 1
+        sql = re.sub(r'\s+', ' ', query).strip()
+        if 'FROM stores WHERE id = %s' in sql:
+            store = self.stores.get(params[0])
+            return [dict(store)] if store else []
+        if 'MIN(year' in sql:
+            rows = self.sales.get(params[0], [])
+            oldest = min((date(r['year'], r['month'], 1) for r in rows), default=None)
+            return [{'oldest_date': oldest}]
+        if sql.startswith('SELECT year, month, daily_data FROM sales_data'):
+            store_id, start_year, start_month, _, end_year, _, end_month = params
+            return [
+                {'year': r['year'], 'month': r['month'], 'daily_data': r['daily_data']}
+                for r in self.sales.get(store_id, [])
+                if (start_year, start_month) <= (r['year'], r['month']) <= (end_year, end_month)
+            ]
+        raise NotImplementedError(f"FakeDatabase does not support this query: {sql[:80]}")
+
+    def fetch_frame(self, query: str, params=None, dtypes=None, parse_dates=None) -> pd.DataFrame:
+        self.queries += 1
+        sql = re.sub(r'\s+', ' ', query).strip()
+        if 'FROM weather_data' in sql and 'date BETWEEN' in sql:
+            by_date = self.weather.get((params['latitude'], params['longitude']), {})
+            rows = [by_date[d] for d in sorted(by_date) if params['start_date'] <= d <= params['end_date']]
+            frame = pd.DataFrame({'date': pd.to_datetime([r['date'] for r in rows])})
+            for col in WEATHER_COLUMNS:
+                frame[col] = np.array([r[col] for r in rows], dtype=np.float64)
+            frame['weather'] = [r['weather'] for r in rows]
+            frame['updated_at'] = pd.NaT
+            return frame
+        raise NotImplementedError(f"FakeDatabase does not support this query: {sql[:80]}")
+
+class PostgresDatabase:
+    """DB_HOST などの接続先に使い捨てのスキーマを作り、合成データを投入する"""
+
+    def __init__(self, dataset: Dict[str, List[Dict]]):
+        from psycopg2.extras import execute_values
+        from utils import database
+
+        self.schema = f"bench_{os.getpid()}_{int(time.time())}"
+        # 以降の接続（コネクションプールを含む）は使い捨てのスキーマを参照する
+        os.environ['PGOPTIONS'] = f"-c search_path={self.schema}"
+        database.close_pool()
+        self._database = database
+
+        with database.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"CREATE SCHEMA {self.schema}")
+                cur.execute(f"""
+                    CREATE TABLE {self.schema}.stores (
+                        id INTEGER PRIMARY KEY, latitude DECIMAL(10, 8), longitude DECIMAL(11, 8),
+                        address TEXT, business_type_id UUID
+                    );
+                    CREATE TABLE {self.schema}.sales_data (
+                        id SERIAL PRIMARY KEY, store_id INTEGER NOT NULL, year INTEGER NOT NULL,
+                        month INTEGER NOT NULL, daily_data JSONB NOT NULL DEFAULT '{{}}',
+                        updated_at TIMESTAMPTZ DEFAULT NOW(), UNIQUE(store_id, year, month)
+                    );
+                    CREATE TABLE {self.schema}.weather_data (
+                        id SERIAL PRIMARY KEY, latitude DECIMAL(10, 8) NOT NULL, longitude DECIMAL(11, 8) NOT NULL,
+                        date DATE NOT NULL, weather VARCHAR(50), temperature DECIMAL(5, 2), humidity DECIMAL(5, 2),
+                        precipitation DECIMAL(8, 2), snow DECIMAL(8, 2), windspeed DECIMAL(8, 2), gust DECIMAL(8, 2),
+                        pressure DECIMAL(8, 2), feelslike DECIMAL(5, 2), updated_at TIMESTAMPTZ DEFAULT NOW(),
+                        UNIQUE(latitude, longitude, date)
+                    );
+                """)
+                execute_values(cur, f"INSERT INTO {self.schema}.stores (id, latitude, longitude, address) VALUES %s", [
+                    (s['id'], s['latitude'], s['longitude'], s['address']) for s in dataset['stores']
+                ])
+                execute_values(cur, f"INSERT INTO {self.schema}.sales_data (store_id, year, month, daily_data) VALUES %s", [
+                    (r['store_id'], r['year'], r['month'], json.dumps(r['daily_data'])) for r in dataset['sales']
+                ])
+                execute_values(cur, f"""
+                    INSERT INTO {self.schema}.weather_data (latitude, longitude, date, weather, temperature, humidity,
+                        precipitation, snow, windspeed, gust, pressure, feelslike) VALUES %s
+                """, [
+                    (w['latitude'], w['longitude'], w['date'], w['weather'], w['temperature'], w['humidity'],
+                     w['precipitation'], w['snow'], w['windspeed'], w['gust'], w['pressure'], w['feelslike'])
+                    for w in dataset['weather']
+                ])
+                cur.execute(f"ANALYZE {self.schema}.sales_data; ANALYZE {self.schema}.weather_data")
+
+    def close(self):
+        with self._database.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA {self.schema} CASCADE")
+        self._database.close_pool()
+        os.environ.pop('PGOPTIONS', None)
+
+def timed(timings: Dict[str, List[float]], stage: str, fn: Callable):
+    """関数を実行して所要時間を段階ごとに記録"""
+    started = time.perf_counter()
+    result = fn()
+    timings.setdefault(stage, []).append(time.perf_counter() - started)
+    return result
+
+def run_store(store_id: int, loader_modes: List[str], timings: Dict[str, List[float]], predict_days: int = 7):
+    """1店舗分の各段階を計測"""
+    df = None
+    for mode in loader_modes:
+        df = timed(timings, f'load_sales_data[{mode}]', lambda: data_loader.load_sales_data(store_id, mode=mode))
+
+    train_data = df[df['edwNetSales'].fillna(0) > 0]
+    future_data = df.tail(predict_days).copy()
+    for key in SALES_KEYS:
+        future_data[key] = 0
+
+    def _features():
+        return (
+            make_features(train_data, include_target=True, sales_fields=SALES_KEYS),
+            make_features(future_data, include_target=False, sales_fields=SALES_KEYS),
+        )
+    train_df, future_df = timed(timings, 'make_features', _features)
+    train_X, future_X = timed(
+        timings, 'design_matrix', lambda: build_design_matrix(train_df, future_df, SALES_KEYS)
+    )
+
+    for key in SALES_KEYS:
+        y = train_df[key].fillna(0)
+        model = timed(timings, 'lightgbm_fit', lambda: LGBMRegressor(random_state=42, verbose=-1).fit(train_X, y))
+        model_storage.save_model(store_id, key, model)
+        model_storage.invalidate_model_cache(store_id, key)
+        model = timed(timings, 'load_model[cold]', lambda: model_storage.load_model(store_id, key))
+        model = timed(timings, 'load_model[cached]', lambda: model_storage.load_model(store_id, key))
+        timed(timings, 'predict', lambda: model.predict(future_X))
+
+def summarize(timings: Dict[str, List[float]]) -> Dict[str, Dict]:
+    return {
+        stage: {
+            'calls': len(values),
+            'total_ms': sum(values) * 1000,
+            'mean_ms': statistics.mean(values) * 1000,
+            'median_ms': statistics.median(values) * 1000,
+            'min_ms': min(values) * 1000,
+            'max_ms': max(values) * 1000,
+        }
+        for stage, values in timings.items()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', choices=['fake', 'postgres'], default='fake')
+    parser.add_argument('--stores', type=int, default=3)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--fields', type=int, default=45, help='daily_data の1日あたりの項目数')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_stages.json', help='結果を書き出すJSONファイル')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    dataset = generate_dataset(args.stores, args.years, args.fields)
+    generate_seconds = time.perf_counter() - started
+
+    if args.backend == 'fake':
+        database = FakeDatabase(dataset)
+        data_loader.execute_query = database.execute_query
+        weather_cache.fetch_frame = database.fetch_frame
+        loader_modes = ['python']
+    else:
+        database = PostgresDatabase(dataset)
+        loader_modes = ['sql', 'python']
+
+    timings: Dict[str, List[float]] = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix='bench_models_') as models_dir:
+            model_storage.MODELS_DIR = Path(models_dir)
+            for _ in range(args.repeat):
+                for store in dataset['stores']:
+                    run_store(store['id'], loader_modes, timings)
+    finally:
+        if args.backend == 'postgres':
+            database.close()
+
+    stages = summarize(timings)
+    result = {
+        'benchmark': 'stages',
+        'created_at': datetime.now().isoformat(),
+        'config': {
+            'backend': args.backend,
+            'stores': args.stores,
+            'years': args.years,
+            'fields': args.fields,
+            'repeat': args.repeat,
+            'sales_months': len(dataset['sales']),
+            'weather_rows': len(dataset['weather']),
+            'generate_seconds': generate_seconds,
+        },
+        'versions': {
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'lightgbm': lgb.__version__,
+        },
+        'stages': stages,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    print(f"{'stage':<24} {'calls':>6} {'median (ms)':>12} {'min (ms)':>10} {'max (ms)':>10}")
+    for stage, s in stages.items():
+        print(f"{stage:<24} {s['calls']:>6} {s['median_ms']:>12.2f} {s['min_ms']:>10.2f} {s['max_ms']:>10.2f}")
+    print(f"結果を {args.output} に書き出しました")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""カレンダー特徴量の作成モジュール（ベクトル化版）"""
+from datetime import date, timedelta
+from typing import Dict
+import numpy as np
+import pandas as pd
+
+# イベント定義（売上に影響を与える特別な日）
+# month, day, weekday はスカラーでもNumPy配列でも評価できる（& で結合する）
+EVENT_RULES = {
+    "valentine": lambda m, d, wd: (m == 2) & (d == 14),
+    "white_day": lambda m, d, wd: (m == 3) & (d == 14),
+    "mother_day": lambda m, d, wd: (m == 5) & (wd == 6) & (d > 7) & (d <= 14),
+    "father_day": lambda m, d, wd: (m == 6) & (wd == 6) & (d > 14) & (d <= 21),
+    "obon": lambda m, d, wd: (m == 8) & (d >= 13) & (d <= 16),
+    "christmas_eve": lambda m, d, wd: (m == 12) & (d == 24),
+    "christmas": lambda m, d, wd: (m == 12) & (d == 25),
+    "new_year": lambda m, d, wd: (m == 1) & (d >= 1) & (d <= 3),
+    "year_end": lambda m, d, wd: (m == 12) & (d >= 28) & (d <= 31),
+    "golden_week": lambda m, d, wd: (m == 5) & (d >= 3) & (d <= 5),
+    "school_graduation": lambda m, d, wd: (m == 3) & (d >= 1) & (d <= 25),
+    "school_admission": lambda m, d, wd: (m == 4) & (d <= 10),
+}
+
+def to_datetime64(dates) -> np.ndarray:
+    """日付列（date / Timestamp / 文字列）を datetime64[D] 配列に変換"""
+    return pd.to_datetime(pd.Series(dates)).to_numpy().astype('datetime64[D]')
+
+# 祝日表を作成する期間（春分・秋分の日の近似式は2099年まで有効）
+HOLIDAY_START_YEAR = 2000
+HOLIDAY_END_YEAR = 2099
+
+def _nth_monday(year: int, month: int, n: int) -> date:
+    first = date(year, month, 1)
+    return first + timedelta(days=(7 - first.weekday()) % 7 + 7 * (n - 1))
+
+def _equinox_day(year: int, base: float) -> int:
+    """春分・秋分の日（1980〜2099年の近似式）"""
+    return int(base + 0.242194 * (year - 1980) - (year - 1980) // 4)
+
+def japanese_holidays(year: int) -> Dict[date, str]:
+    """
+    1年分の日本の祝日（2000年以降の祝日法）
+
+    ハッピーマンデー、春分・秋分の日、振替休日（2007年以降の規定）、国民の休日、
+    2019〜2021年の特例（即位関連・東京オリンピックに伴う移動）を含む。
+
+    Returns:
+        Dict: {日付: 祝日名}
+    """
+    holidays = {}
+
+    def add(d: date, name: str):
+        holidays[d] = name
+
+    add(date(year, 1, 1), '元日')
+    add(_nth_monday(year, 1, 2), '成人の日')
+    add(date(year, 2, 11), '建国記念の日')
+    if year >= 2020:
+        add(date(year, 2, 23), '天皇誕生日')
+    add(date(year, 3, _equinox_day(year, 20.8431)), '春分の日')
+    add(date(year, 4, 29), '昭和の日' if year >= 2007 else 'みどりの日')
+    add(date(year, 5, 3), '憲法記念日')
+    if year >= 2007:
+        add(date(year, 5, 4), 'みどりの日')
+    add(date(year, 5, 5), 'こどもの日')
+    if year == 2020:
+        add(date(year, 7, 23), '海の日')
+    elif year == 2021:
+        add(date(year, 7, 22), '海の日')
+    else:
+        add(_nth_monday(year, 7, 3) if year >= 2003 else date(year, 7, 20), '海の日')
+    if year == 2020:
+        add(date(year, 8, 10), '山の日')
+    elif year == 2021:
+        add(date(year, 8, 8), '山の日')
+    elif year >= 2016:
+        add(date(year, 8, 11), '山の日')
+    add(_nth_monday(year, 9, 3) if year >= 2003 else date(year, 9, 15), '敬老の日')
+    add(date(year, 9, _equinox_day(year, 23.2488)), '秋分の日')
+    sports_day = 'スポーツの日' if year >= 2020 else '体育の日'
+    if year == 2020:
+        add(date(year, 7, 24), sports_day)
+    elif year == 2021:
+        add(date(year, 7, 23), sports_day)
+    else:
+        add(_nth_monday(year, 10, 2), sports_day)
+    add(date(year, 11, 3), '文化の日')
+    add(date(year, 11, 23), '勤労感謝の日')
+    if year <= 2018:
+        add(date(year, 12, 23), '天皇誕生日')
+    if year == 2019:
+        add(date(year, 5, 1), '天皇の即位の日')
+        add(date(year, 10, 22), '即位礼正殿の儀の行われる日')
+
+    # 国民の休日: 前日と翌日が祝日の日（日曜日を除く）
+    for d in sorted(holidays):
+        between = d + timedelta(days=1)
+        if d + timedelta(days=2) in holidays and between not in holidays and between.weekday() != 6:
+            holidays[between] = '国民の休日'
+    # 振替休日: 日曜日の祝日の後の最初の祝日でない日
+    for d in sorted(holidays):
+        if d.weekday() == 6 and holidays[d] != '国民の休日':
+            substitute = d + timedelta(days=1)
+            while substitute in holidays:
+                substitute += timedelta(days=1)
+            holidays[substitute] = '振替休日'
+    return holidays
+
+def _build_holiday_table():
+    """祝日の日付配列（昇順）と、HOLIDAY_START_YEAR の元日からの日数で引くビットマップを作成"""
+    days = sorted(d for year in range(HOLIDAY_START_YEAR, HOLIDAY_END_YEAR + 1) for d in japanese_holidays(year))
+    holidays = np.array(days, dtype='datetime64[D]')
+    origin = np.datetime64(f'{HOLIDAY_START_YEAR}-01-01', 'D')
+    end = np.datetime64(f'{HOLIDAY_END_YEAR + 1}-01-01', 'D')
+    bitmap = np.zeros((end - origin).astype(np.int64), dtype=bool)
+    bitmap[(holidays - origin).astype(np.int64)] = True
+    return holidays, origin, bitmap
+
+# 祝日（datetime64[D]、昇順）と判定用のビットマップ（モジュール読み込み時に1回だけ作成）
+HOLIDAYS, _HOLIDAY_ORIGIN, _HOLIDAY_BITMAP = _build_holiday_table()
+
+def holiday_flags(dates) -> np.ndarray:
+    """
+    日付列の祝日判定をまとめて行う（ビットマップの参照1回）
+
+    祝日表の期間（HOLIDAY_START_YEAR〜HOLIDAY_END_YEAR）外の日付と欠損は祝日でないとする。
+
+    Returns:
+        np.ndarray: bool配列
+    """
+    offsets = (to_datetime64(dates) - _HOLIDAY_ORIGIN).astype(np.int64)
+    in_range = (offsets >= 0) & (offsets < len(_HOLIDAY_BITMAP))
+    flags = np.zeros(len(offsets), dtype=bool)
+    flags[in_range] = _HOLIDAY_BITMAP[offsets[in_range]]
+    return flags
+
+def is_holiday(d: date) -> bool:
+    """1日分の祝日判定"""
+    offset = int((np.datetime64(d, 'D') - _HOLIDAY_ORIGIN).astype(np.int64))
+    return 0 <= offset < len(_HOLIDAY_BITMAP) and bool(_HOLIDAY_BITMAP[offset])
+
+def calendar_features(dates: pd.Series, extended: bool = False, events: bool = False) -> pd.DataFrame:
+    """
+    カレンダー特徴量をまとめて作成
+
+    行ごとの .apply を使わず、datetime64 の算術とNumPyのマスクで計算する。
+    値と型（int64）は従来の apply 版と同じ。
+
+    Args:
+        dates: 日付の列（インデックスは結果にそのまま引き継ぐ）
+        extended: week_of_month, is_payday, is_weekend を含めるか
+        events: EVENT_RULES のイベントフラグ（is_<name>）を含めるか
+
+    Returns:
+        DataFrame: weekday, month, day, is_month_start, is_month_end, dayofyear（+ 追加列）
+    """
+    values = to_datetime64(dates)
+    months = values.astype('datetime64[M]')
+    years = values.astype('datetime64[Y]')
+
+    day = (values - months.astype('datetime64[D]')).astype(np.int64) + 1
+    month = months.astype(np.int64) % 12 + 1
+    dayofyear = (values - years.astype('datetime64[D]')).astype(np.int64) + 1
+    # 1970-01-01 は木曜日（weekday=3）
+    weekday = (values.astype(np.int64) + 3) % 7
+    days_in_month = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+
+    columns = {
+        'weekday': weekday,
+        'month': month,
+        'day': day,
+        'is_month_start': (day == 1).astype(np.int64),
+        'is_month_end': (day == days_in_month).astype(np.int64),
+        'dayofyear': dayofyear,
+    }
+
+    if extended:
+        columns['week_of_month'] = (day - 1) // 7 + 1
+        columns['is_payday'] = ((day == 25) | (day == days_in_month)).astype(np.int64)
+        columns['is_weekend'] = (weekday >= 5).astype(np.int64)
+
+    if events:
+        for event_name, rule in EVENT_RULES.items():
+            columns[f'is_{event_name}'] = np.asarray(rule(month, day, weekday)).astype(np.int64)
+
+    return pd.DataFrame(columns, index=dates.index)
@@ -1,48 +1,40 @@
 """データ取得・変換モジュール"""
+import hashlib
+import os
+import numpy as np
 import pandas as pd
 from datetime import date, timedelta
-from typing import List, Dict, Optional
-from utils.database import execute_query
+from typing import List, Dict, Optional, Tuple
+from calendar_features import holiday_flags, is_holiday
+from utils.database import execute_query, fetch_frame, read_snapshot
+from utils.dtypes import COMPACT_DTYPES, compact_frame
+from utils.frame_cache import (
+    FRAME_CACHE_ENABLED, load_frame, save_frame, get_store_lock,
+)
+from utils.tracing import span
+from utils.weather_cache import WEATHER_COLUMNS, weather_cache
 import json
 
-# 祝日判定用（簡易版、jpholidayライブラリの代わり）
 def is_holiday_jp(d: date) -> bool:
-    """日本の祝日を判定（簡易版）"""
-    # 固定祝日
-    fixed_holidays = [
-        (1, 1),   # 元日
-        (2, 11),  # 建国記念の日
-        (4, 29),  # 昭和の日
-        (5, 3),   # 憲法記念日
-        (5, 4),   # みどりの日
-        (5, 5),   # こどもの日
-        (8, 11),  # 山の日
-        (11, 3),  # 文化の日
-        (11, 23), # 勤労感謝の日
-        (12, 23), # 天皇誕生日（2024年まで）
-    ]
-    
-    if (d.month, d.day) in fixed_holidays:
-        return True
-    
-    # 春分の日・秋分の日（簡易計算、正確ではない）
-    # 実際のプロジェクトではjpholidayライブラリを使用推奨
-    
-    return False
+    """日本の祝日を判定（1日分、複数日は calendar_features.holiday_flags でまとめて判定する）"""
+    return is_holiday(d)
 
-def load_sales_data(store_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None) -> pd.DataFrame:
-    """
-    売上データと天気データを取得して、参考サイトのSalesDate形式に変換
-    
-    Args:
-        store_id: 店舗ID
-        start_date: 開始日（Noneの場合は全期間）
-        end_date: 終了日（Noneの場合は全期間）
-    
-    Returns:
-        DataFrame: 参考サイトのSalesDate形式のデータ
-    """
-    # 店舗情報を取得（緯度・経度を取得）
+# 1日1レコードの基本列（天気の数値項目 WEATHER_COLUMNS は sales_data.daily_data と weather_data の両方に存在）
+BASE_COLUMNS = ['date'] + WEATHER_COLUMNS + ['weather', 'is_holiday']
+# 後方互換性のために残している列 -> daily_data のキー
+LEGACY_COLUMNS = {
+    'edw_sales': 'edwNetSales',
+    'ohb_sales': 'ohbNetSales',
+    'edw_customers': 'edwCustomers',
+    'ohb_customers': 'ohbCustomers',
+}
+
+# daily_data の展開方法: 'sql'（DB側で jsonb_each により展開）、'python'（従来の1日ずつの展開）、
+# または 'table'（マイグレーション017の日次売上テーブル sales_daily から読み込む、JSONの展開なし）
+SALES_LOADER_MODE = os.getenv('SALES_LOADER_MODE', 'sql')
+
+def get_store_location(store_id: int) -> Tuple[float, float]:
+    """店舗の緯度・経度を取得（店舗がない・位置が未設定の場合はValueError）"""
     store_query = """
         SELECT id, latitude, longitude, address
         FROM stores
@@ -59,6 +51,89 @@ def load_sales_data(store_id: int, start_date: Optional[date] = None, end_date:
     if not latitude or not longitude:
         raise ValueError(f"Store {store_id} does not have latitude/longitude")
     
+    return latitude, longitude
+
+def get_all_store_ids() -> List[int]:
+    """売上データのある店舗IDをすべて取得"""
+    result = execute_query("SELECT DISTINCT store_id FROM sales_data ORDER BY store_id")
+    return [row['store_id'] for row in result]
+
+def get_store_locations(store_ids: List[int]) -> Dict[int, Optional[Tuple[float, float]]]:
+    """
+    複数店舗の緯度・経度を1回のクエリで取得
+
+    Returns:
+        Dict: 店舗IDごとの (緯度, 経度)（位置が未設定の場合はNone、存在しない店舗は含まない）
+    """
+    result = execute_query(
+        "SELECT id, latitude, longitude FROM stores WHERE id = ANY(%s)",
+        (list(store_ids),)
+    )
+    locations = {}
+    for row in result:
+        if row['latitude'] and row['longitude']:
+            locations[row['id']] = (float(row['latitude']), float(row['longitude']))
+        else:
+            locations[row['id']] = None
+    return locations
+
+def get_store_profiles(store_ids: List[int]) -> Dict[int, Dict]:
+    """
+    複数店舗の業態・緯度・経度を1回のクエリで取得（全店舗共通モデルの店舗の特徴量）
+
+    Returns:
+        Dict: 店舗IDごとの {'business_type_id', 'latitude', 'longitude'}（未設定の値はNone、存在しない店舗は含まない）
+    """
+    result = execute_query(
+        "SELECT id, business_type_id, latitude, longitude FROM stores WHERE id = ANY(%s)",
+        (list(store_ids),)
+    )
+    return {
+        row['id']: {
+            'business_type_id': row['business_type_id'],
+            'latitude': float(row['latitude']) if row['latitude'] is not None else None,
+            'longitude': float(row['longitude']) if row['longitude'] is not None else None,
+        }
+        for row in result
+    }
+
+def load_weather_bulk(
+    locations: List[Tuple[float, float]], start_date: date, end_date: date
+) -> Dict[Tuple[float, float], pd.DataFrame]:
+    """
+    複数地点の期間内の天気データを取得（天気キャッシュにない地点は1回のクエリでまとめて取得）
+
+    Args:
+        locations: (緯度, 経度) のリスト
+        start_date: 開始日
+        end_date: 終了日
+
+    Returns:
+        Dict: (緯度, 経度) ごとの天気データ（日付インデックス、weather_cache.get と同じ形式）
+    """
+    return weather_cache.get_many(locations, start_date, end_date)
+
+def load_sales_data(
+    store_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    mode: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    売上データと天気データを取得して、参考サイトのSalesDate形式に変換
+    
+    Args:
+        store_id: 店舗ID
+        start_date: 開始日（Noneの場合は全期間）
+        end_date: 終了日（Noneの場合は全期間）
+        mode: daily_dataの展開方法（'sql' / 'python' / 'table'、Noneの場合はSALES_LOADER_MODE）
+    
+    Returns:
+        DataFrame: 参考サイトのSalesDate形式のデータ
+    """
+    # 店舗情報を取得（緯度・経度を取得）
+    latitude, longitude = get_store_location(store_id)
+    
     # 期間を決定
     if not start_date:
         # 最も古いデータから開始
@@ -76,6 +151,212 @@ def load_sales_data(store_id: int, start_date: Optional[date] = None, end_date:
     if not end_date:
         end_date = date.today()
     
+    mode = mode or SALES_LOADER_MODE
+    if mode == 'python':
+        # 1日ずつの展開はクエリと交互に行うため、読み込み全体を展開のスパンとする
+        with span('expand_daily_data', mode='python'):
+            df = _load_sales_data_python(store_id, latitude, longitude, start_date, end_date)
+    elif mode == 'table':
+        df = _load_sales_data_table(store_id, latitude, longitude, start_date, end_date)
+    elif mode == 'sql':
+        df = _load_sales_data_sql(store_id, latitude, longitude, start_date, end_date)
+    else:
+        raise ValueError(f"Unknown sales loader mode: {mode}")
+    
+    # COMPACT_DTYPES の場合は売上・天気を float32、天気の種類を category にする
+    return compact_frame(df) if COMPACT_DTYPES and not df.empty else df
+
+# sales_data.daily_data を1日1行に展開するCTE
+# 日付はエラーにならないよう make_date(年, 月, 1) + (日 - 1) で作り、月が変わる日（2/30など）は除外する
+_DAYS_CTE = """
+    WITH days AS (
+        SELECT make_date(s.year, s.month, 1) + (dk.day_num - 1) AS date, d.value AS day
+        FROM sales_data s
+        CROSS JOIN LATERAL jsonb_each(
+            CASE WHEN jsonb_typeof(s.daily_data) = 'object' THEN s.daily_data ELSE '{}'::jsonb END
+        ) AS d
+        CROSS JOIN LATERAL (
+            SELECT CASE WHEN d.key ~ '^[1-9][0-9]?$' THEN d.key::int END AS day_num
+        ) AS dk
+        WHERE s.store_id = %(store_id)s
+        AND s.year BETWEEN %(start_year)s AND %(end_year)s
+        AND jsonb_typeof(d.value) = 'object'
+        AND dk.day_num BETWEEN 1 AND 31
+        AND EXTRACT(MONTH FROM make_date(s.year, s.month, 1) + (dk.day_num - 1)) = s.month
+    )
+"""
+
+def _json_number(expr: str) -> str:
+    """JSONの値が数値の場合のみfloat8に変換するSQL式"""
+    return f"CASE WHEN jsonb_typeof({expr}) = 'number' THEN ({expr} #>> '{{}}')::float8 END"
+
+def _numeric_columns(days: pd.DataFrame) -> Dict[str, pd.Series]:
+    """
+    1日1行に並べたdaily_dataから数値項目の列を取り出す（列単位の正規化）
+
+    従来の1日ずつの展開と同じく、数値（int/float/bool）の値だけを残し、
+    それ以外（null・文字列）は欠損として扱う。数値が1つもない項目は列にしない。
+    """
+    columns = {}
+    for key in days.columns:
+        if key in BASE_COLUMNS or key in LEGACY_COLUMNS:
+            continue
+        values = days[key]
+        if values.dtype == bool:
+            values = values.astype(np.int64)
+        elif values.dtype == object:
+            # 数値と文字列などが混在する項目のみ要素ごとに判定する
+            is_number = values.map(lambda v: isinstance(v, (int, float)))
+            values = pd.to_numeric(values.where(is_number), errors='coerce')
+        if values.notna().any():
+            columns[key] = values
+    return columns
+
+def _load_sales_data_sql(store_id: int, latitude, longitude, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    daily_dataをDB側で1日1行に展開して読み込む
+
+    日付の展開（jsonb_each）とweather_dataとの結合はDBで行い、結果は列ごとの配列と
+    日付順に並べた1日分オブジェクトのJSON配列として1行で受け取る。Python側では
+    JSONを1回パースしてDataFrameに変換し、数値項目を列単位で取り出す。
+    """
+    params = {
+        'store_id': store_id,
+        'start_year': start_date.year,
+        'end_year': end_date.year,
+        'start_date': start_date,
+        'end_date': end_date,
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+    }
+
+    # 天気はweather_dataを優先し、なければdaily_dataの値を使う
+    weather_exprs = []
+    for col in WEATHER_COLUMNS:
+        day_value = _json_number(f"days.day -> '{col}'")
+        weather_exprs.append(f"COALESCE(w.{col}::float8, {day_value}) AS {col}")
+    weather_select = ",\n                ".join(weather_exprs)
+    base_aggregates = ",\n            ".join(f"array_agg({col} ORDER BY date) AS {col}" for col in BASE_COLUMNS)
+
+    query = _DAYS_CTE + f"""
+        SELECT
+            {base_aggregates},
+            json_agg(day ORDER BY date)::text AS days
+        FROM (
+            SELECT days.date, days.day,
+                {weather_select},
+                COALESCE(NULLIF(w.weather, ''), days.day ->> 'weather', '') AS weather,
+                CASE WHEN jsonb_typeof(days.day -> 'isHoliday') = 'boolean'
+                     THEN (days.day ->> 'isHoliday')::boolean ELSE false END AS is_holiday
+            FROM days
+            LEFT JOIN weather_data w
+                ON w.latitude = %(latitude)s AND w.longitude = %(longitude)s AND w.date = days.date
+            WHERE days.date BETWEEN %(start_date)s AND %(end_date)s
+        ) AS per_day
+    """
+
+    result = execute_query(query, params)
+    if not result or not result[0]['date']:
+        return pd.DataFrame()
+    row = result[0]
+
+    columns = {'date': row['date']}
+    for col in WEATHER_COLUMNS:
+        columns[col] = np.array(row[col], dtype=np.float64)
+    columns['weather'] = row['weather']
+    # 祝日判定（daily_dataのisHolidayがない日は祝日カレンダーで判定）
+    columns['is_holiday'] = np.array(row['is_holiday'], dtype=bool) | holiday_flags(row['date'])
+
+    with span('expand_daily_data', mode='sql', days=len(row['date'])):
+        days = pd.DataFrame.from_records(json.loads(row['days']))
+        numeric = _numeric_columns(days)
+    columns.update({key: values.to_numpy() for key, values in numeric.items()})
+
+    # 後方互換性のため、既存のキーも保持
+    for legacy_col, key in LEGACY_COLUMNS.items():
+        columns[legacy_col] = numeric[key].fillna(0).to_numpy() if key in numeric else 0
+
+    return pd.DataFrame(columns)
+
+def _load_sales_data_table(store_id: int, latitude, longitude, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    日次売上テーブル（sales_daily）から (store_id, date) の範囲検索で読み込む
+
+    1日1行の基本列（天気はweather_dataとの結合）と、（日, 数値項目, 値）の縦持ちの行を
+    それぞれ1回のクエリで COPY により受け取る（fetch_frame）。値はDB側でfloat8になっているため、
+    JSONのパースや要素ごとの型判定をせずに（日数 x 項目数）の行列に書き込んで列にする。
+    2つのクエリは同じスナップショットで読む（間にトリガーで日が増減しても日の集合が一致する）。
+    """
+    params = {
+        'store_id': store_id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+    }
+
+    # 天気はweather_dataを優先し、なければdaily_dataの値を使う
+    weather_exprs = [
+        f"COALESCE(w.{col}::float8, d.field_values[array_position(d.field_keys, '{col}')]) AS {col}"
+        for col in WEATHER_COLUMNS
+    ]
+    weather_select = ",\n            ".join(weather_exprs)
+
+    base_query = f"""
+        SELECT d.date,
+            {weather_select},
+            COALESCE(NULLIF(w.weather, ''), d.weather, '') AS weather,
+            d.is_holiday
+        FROM sales_daily d
+        LEFT JOIN weather_data w
+            ON w.latitude = %(latitude)s AND w.longitude = %(longitude)s AND w.date = d.date
+        WHERE d.store_id = %(store_id)s AND d.date BETWEEN %(start_date)s AND %(end_date)s
+        ORDER BY d.date
+    """
+    fields_query = """
+        SELECT d.date - %(start_date)s::date AS day, f.key, f.value
+        FROM sales_daily d
+        CROSS JOIN LATERAL unnest(d.field_keys, d.field_values) AS f(key, value)
+        WHERE d.store_id = %(store_id)s AND d.date BETWEEN %(start_date)s AND %(end_date)s
+    """
+    with read_snapshot():
+        base = fetch_frame(
+            base_query, params,
+            dtypes={**{col: 'float64' for col in WEATHER_COLUMNS}, 'weather': 'object', 'is_holiday': 'bool'},
+            parse_dates=['date'],
+        )
+        if base.empty:
+            return pd.DataFrame()
+        cells = fetch_frame(fields_query, params, dtypes={'day': 'int64', 'key': 'category', 'value': 'float64'})
+
+    columns = {'date': base['date'].dt.date.to_numpy()}
+    for col in WEATHER_COLUMNS:
+        columns[col] = base[col].to_numpy()
+    columns['weather'] = base['weather'].fillna('').to_numpy()
+    # 祝日判定（daily_dataのisHolidayがない日は祝日カレンダーで判定）
+    columns['is_holiday'] = base['is_holiday'].to_numpy() | holiday_flags(base['date'])
+
+    # 数値項目を（日, 項目）の位置にまとめて書き込む（日は開始日からの日数、項目はカテゴリのコード）
+    # 日の行の位置は完全一致で求め、基本列にない日の値は書き込まない
+    days = (base['date'] - pd.Timestamp(start_date)).dt.days.to_numpy()
+    rows = pd.Index(days).get_indexer(cells['day'].to_numpy())
+    found = rows >= 0
+    matrix = np.full((len(days), len(cells['key'].cat.categories)), np.nan)
+    matrix[rows[found], cells['key'].cat.codes.to_numpy()[found]] = cells['value'].to_numpy()[found]
+    numeric = {
+        key: matrix[:, i] for i, key in enumerate(cells['key'].cat.categories)
+        if key not in BASE_COLUMNS and key not in LEGACY_COLUMNS
+    }
+    columns.update(numeric)
+
+    # 後方互換性のため、既存のキーも保持
+    for legacy_col, key in LEGACY_COLUMNS.items():
+        columns[legacy_col] = np.nan_to_num(numeric[key], nan=0.0) if key in numeric else 0
+
+    return pd.DataFrame(columns)
+
+def _load_sales_data_python(store_id: int, latitude, longitude, start_date: date, end_date: date) -> pd.DataFrame:
+    """daily_dataを1日ずつPythonで展開して読み込む（従来の実装）"""
     # sales_dataテーブルから期間内のデータを取得
     start_year = start_date.year
     start_month = start_date.month
@@ -117,10 +398,8 @@ def load_sales_data(store_id: int, start_date: Optional[date] = None, end_date:
                 if record_date < start_date or record_date > end_date:
                     continue
                 
-                # 祝日判定
+                # 祝日判定（daily_dataのisHolidayがない日は、DataFrameに変換した後に祝日カレンダーでまとめて判定）
                 is_holiday = day_data.get('isHoliday', False) or False
-                if not is_holiday:
-                    is_holiday = is_holiday_jp(record_date)
                 
                 # データを変換（すべてのフィールドを含める）
                 record = {
@@ -153,58 +432,195 @@ def load_sales_data(store_id: int, start_date: Optional[date] = None, end_date:
                 # 無効な日付やデータはスキップ
                 continue
     
-    # weather_dataテーブルから天気データを取得して統合
-    if sales_records:
-        date_list = [r['date'] for r in sales_records]
-        date_str_list = [d.isoformat() for d in date_list]
-        
-        weather_query = """
-            SELECT date, weather, temperature, humidity, precipitation, snow,
-                   windspeed, gust, pressure, feelslike
-            FROM weather_data
-            WHERE latitude = %s AND longitude = %s
-            AND date = ANY(%s::date[])
-        """
-        weather_results = execute_query(
-            weather_query,
-            (float(latitude), float(longitude), date_str_list)
-        )
-        
-        # 天気データを辞書に変換（日付をキーに）
-        weather_dict = {w['date']: w for w in weather_results}
-        
-        # 天気データで上書き（weather_dataの方が正確な場合）
-        for record in sales_records:
-            record_date = record['date']
-            if record_date in weather_dict:
-                weather_data = weather_dict[record_date]
-                if weather_data.get('temperature') is not None:
-                    record['temperature'] = float(weather_data['temperature'])
-                if weather_data.get('humidity') is not None:
-                    record['humidity'] = float(weather_data['humidity'])
-                if weather_data.get('precipitation') is not None:
-                    record['precipitation'] = float(weather_data['precipitation'])
-                if weather_data.get('snow') is not None:
-                    record['snow'] = float(weather_data['snow'])
-                if weather_data.get('windspeed') is not None:
-                    record['windspeed'] = float(weather_data['windspeed'])
-                if weather_data.get('gust') is not None:
-                    record['gust'] = float(weather_data['gust'])
-                if weather_data.get('pressure') is not None:
-                    record['pressure'] = float(weather_data['pressure'])
-                if weather_data.get('feelslike') is not None:
-                    record['feelslike'] = float(weather_data['feelslike'])
-                if weather_data.get('weather'):
-                    record['weather'] = weather_data['weather']
-    
     # DataFrameに変換
     if not sales_records:
         return pd.DataFrame()
     
     df = pd.DataFrame(sales_records)
+    df['is_holiday'] = df['is_holiday'].astype(bool) | holiday_flags(df['date'])
+    
+    # weather_dataテーブルの天気データで上書き（weather_dataの方が正確な場合）
+    weather = weather_cache.get(latitude, longitude, df['date'].min(), df['date'].max())
+    weather = weather.reindex(pd.to_datetime(df['date']))
+    for col in WEATHER_COLUMNS:
+        values = weather[col].to_numpy()
+        df[col] = np.where(np.isnan(values), pd.to_numeric(df[col], errors='coerce'), values)
+    weather_names = weather['weather'].fillna('').to_numpy()
+    df['weather'] = np.where(weather_names != '', weather_names, df['weather'].to_numpy())
     
     # 日付でソート
     df = df.sort_values('date').reset_index(drop=True)
     
     return df
 
+# キャッシュの形式が変わった場合に上げる（古いキャッシュは作り直す）
+FRAME_CACHE_VERSION = 2  # 2: 祝日判定に春分・秋分の日、ハッピーマンデー、振替休日を追加
+
+def _month_range(month_key: str, today: date) -> Tuple[date, date]:
+    """月キー（YYYY-MM）の初日と末日（今日より後は今日まで）"""
+    year, month = (int(v) for v in month_key.split('-'))
+    first = date(year, month, 1)
+    last = (date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1))
+    return first, min(last, today)
+
+def load_sales_data_incremental(store_id: int, watermark: Optional[Dict] = None) -> pd.DataFrame:
+    """
+    店舗の全期間の売上データを取得（ディスクキャッシュを差分更新して使う）
+
+    sales_data.updated_at（月ごと）と weather_data.updated_at（店舗の位置ごと）を
+    ウォーターマークとしてキャッシュと比較し、変更があった月と前回以降に
+    日付が進んだ月だけをDBから読み直してキャッシュにマージする。
+
+    Args:
+        store_id: 店舗ID
+        watermark: 取得済みの get_data_watermark の結果（Noneの場合はここで取得する）
+
+    Returns:
+        DataFrame: load_sales_data(store_id) と同じ形式のデータ
+    """
+    if not FRAME_CACHE_ENABLED:
+        return load_sales_data(store_id)
+
+    with get_store_lock(store_id):
+        return _refresh_cached_frame(store_id, watermark)
+
+def get_data_watermark(store_id: int, latitude=None, longitude=None) -> Dict:
+    """
+    店舗データの更新状況を取得
+
+    Returns:
+        Dict: {'months': {'YYYY-MM': sales_data.updated_at}, 'weather_updated_at': 最新の weather_data.updated_at,
+               'latitude', 'longitude'（天気を調べた店舗の位置）}
+    """
+    if latitude is None or longitude is None:
+        latitude, longitude = get_store_location(store_id)
+    watermark_query = """
+        SELECT
+            (SELECT json_object_agg(year || '-' || LPAD(month::text, 2, '0'), updated_at)
+             FROM sales_data WHERE store_id = %(store_id)s) AS months,
+            (SELECT MAX(updated_at)
+             FROM weather_data WHERE latitude = %(latitude)s AND longitude = %(longitude)s) AS weather_updated_at
+    """
+    params = {'store_id': store_id, 'latitude': float(latitude), 'longitude': float(longitude)}
+    watermark = execute_query(watermark_query, params)[0]
+    return {
+        'months': watermark['months'] or {},
+        'weather_updated_at': (
+            watermark['weather_updated_at'].isoformat() if watermark['weather_updated_at'] else None
+        ),
+        'latitude': params['latitude'],
+        'longitude': params['longitude'],
+    }
+
+def watermark_fingerprint(watermark: Dict) -> str:
+    """get_data_watermark の結果から get_data_fingerprint と同じ文字列を作る"""
+    payload = json.dumps(
+        {'months': watermark['months'], 'weather_updated_at': watermark['weather_updated_at']}, sort_keys=True
+    )
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def get_data_fingerprint(store_id: int) -> str:
+    """店舗の売上・天気データの版を表す文字列（どちらかが更新されると変わる）"""
+    return watermark_fingerprint(get_data_watermark(store_id))
+
+def _refresh_cached_frame(store_id: int, watermark: Optional[Dict] = None) -> pd.DataFrame:
+    if watermark is None:
+        watermark = get_data_watermark(store_id)
+    today = date.today()
+
+    location = {'store_id': store_id, 'latitude': watermark['latitude'], 'longitude': watermark['longitude']}
+    months = watermark['months']
+    weather_updated_at = watermark['weather_updated_at']
+
+    if not months:
+        # 売上データがない場合はキャッシュしない
+        return load_sales_data(store_id)
+
+    meta = {
+        'version': FRAME_CACHE_VERSION,
+        'loader_mode': SALES_LOADER_MODE,
+        'compact': COMPACT_DTYPES,
+        # 店舗の位置が変わると全期間の天気の列が変わるため作り直す
+        'latitude': location['latitude'],
+        'longitude': location['longitude'],
+        'months': months,
+        'weather_updated_at': weather_updated_at,
+        'end_date': today.isoformat(),
+    }
+
+    cached_df, cached_meta = load_frame(store_id)
+    if (
+        cached_df is None
+        or cached_meta.get('version') != FRAME_CACHE_VERSION
+        or cached_meta.get('loader_mode') != SALES_LOADER_MODE
+        or cached_meta.get('compact', False) != COMPACT_DTYPES
+        or cached_meta.get('latitude') != location['latitude']
+        or cached_meta.get('longitude') != location['longitude']
+    ):
+        oldest_month = min(months)
+        df = load_sales_data(store_id, start_date=_month_range(oldest_month, today)[0], end_date=today)
+        save_frame(store_id, df, meta)
+        print(f"[データキャッシュ] 店舗ID {store_id} のキャッシュを作成: {len(df)}行")
+        return df
+
+    cached_months = cached_meta.get('months', {})
+    # 追加・更新・削除された月
+    stale_months = {m for m, updated_at in months.items() if cached_months.get(m) != updated_at}
+    stale_months |= set(cached_months) - set(months)
+    # 前回の取得以降に日付が進んだ月
+    cached_end = date.fromisoformat(cached_meta['end_date'])
+    stale_months |= {m for m in months if _month_range(m, today)[1] > cached_end}
+    # 天気データが更新された月
+    if weather_updated_at != cached_meta.get('weather_updated_at'):
+        if cached_meta.get('weather_updated_at') is None:
+            stale_months |= set(months)
+        else:
+            weather_months_query = """
+                SELECT DISTINCT to_char(date, 'YYYY-MM') AS month
+                FROM weather_data
+                WHERE latitude = %(latitude)s AND longitude = %(longitude)s
+                AND updated_at > %(since)s
+            """
+            changed = execute_query(
+                weather_months_query, {**location, 'since': cached_meta['weather_updated_at']}
+            )
+            stale_months |= {row['month'] for row in changed} & set(months)
+
+    if not stale_months:
+        return cached_df
+
+    # 変更があった月を連続する範囲ごとにまとめて読み直す
+    refreshed = []
+    run_start = run_end = None
+    for month in sorted(m for m in stale_months if m in months):
+        first, last = _month_range(month, today)
+        if first > today:
+            continue
+        if run_end is not None and first == run_end + timedelta(days=1):
+            run_end = last
+            continue
+        if run_start is not None:
+            refreshed.append(load_sales_data(store_id, start_date=run_start, end_date=run_end))
+        run_start, run_end = first, last
+    if run_start is not None:
+        refreshed.append(load_sales_data(store_id, start_date=run_start, end_date=run_end))
+
+    kept = cached_df
+    if not kept.empty:
+        kept_months = pd.to_datetime(kept['date']).dt.strftime('%Y-%m')
+        kept = kept[~kept_months.isin(stale_months)]
+    df = pd.concat([kept] + [r for r in refreshed if not r.empty], ignore_index=True)
+    if not df.empty:
+        df = df.sort_values('date').reset_index(drop=True)
+        # 読み直した結果どの日にも値がなくなった項目は列ごと落とす（全期間を読み直した場合と揃える）
+        empty_columns = [c for c in df.columns if c not in BASE_COLUMNS and c not in LEGACY_COLUMNS
+                         and df[c].isna().all()]
+        df = df.drop(columns=empty_columns)
+        if COMPACT_DTYPES:
+            # 結合で category が object に戻るため縮小し直す
+            df = compact_frame(df)
+
+    save_frame(store_id, df, meta)
+    print(f"[データキャッシュ] 店舗ID {store_id} のキャッシュを差分更新: {len(stale_months)}か月分")
+    return df
+
@@ -0,0 +1,62 @@
+"""全店舗共通モデル（売上項目ごとに1つ、店舗の属性を特徴量に加えて全店舗のデータで学習）"""
+import hashlib
+import os
+from typing import Dict, Iterable, List, Optional
+import lightgbm as lgb
+import pandas as pd
+from rolling_features import rolling_feature_names
+
+# 予測に全店舗共通モデルを使うか（共通モデルがない売上項目がある店舗は店舗ごとのモデルを使う）
+GLOBAL_MODEL = os.getenv('GLOBAL_MODEL', 'false').lower() in ('1', 'true', 'yes')
+
+# モデル保存時の店舗IDの代わり（店舗IDは1から始まるため重ならない）
+GLOBAL_STORE_ID = 0
+
+# 店舗の属性の特徴量（store_id と業態はカテゴリとして扱う）
+STORE_FEATURES = ['store_id', 'business_type', 'latitude', 'longitude']
+CATEGORICAL_FEATURES = ['store_id', 'business_type']
+
+def global_feature_columns(columns: Iterable[str], sales_key: str, sales_keys: List[str]) -> List[str]:
+    """
+    店舗の特徴量行列のうち、売上項目 sales_key の共通モデルで使う列
+
+    売上項目の組み合わせは業態ごとに異なるため、他の売上項目のラグ・移動平均は使わない。
+    """
+    others = {name for key in sales_keys if key != sales_key for name in rolling_feature_names(key)}
+    return [col for col in columns if col not in others]
+
+def business_type_codes(business_type_ids: Iterable[Optional[str]]) -> List[str]:
+    """業態IDのコード表（位置がコード、マニフェストに保存して予測時も同じコードを使う）"""
+    return sorted({str(bt) for bt in business_type_ids if bt is not None})
+
+def add_store_features(X: pd.DataFrame, store_id: int, profile: Optional[Dict], business_types: List[str]) -> pd.DataFrame:
+    """
+    特徴量行列に店舗の属性の列を追加したDataFrameを返す
+
+    Args:
+        profile: get_store_profiles の店舗ごとの値（Noneの場合は属性を欠損とする）
+        business_types: business_type_codes のコード表（ない業態は欠損）
+    """
+    profile = profile or {}
+    business_type = profile.get('business_type_id')
+    code = business_types.index(str(business_type)) if str(business_type) in business_types else None
+    store = pd.DataFrame({
+        'store_id': store_id,
+        'business_type': code,
+        'latitude': profile.get('latitude'),
+        'longitude': profile.get('longitude'),
+    }, index=X.index, columns=STORE_FEATURES, dtype='float64')
+    return pd.concat([store, X], axis=1)
+
+def fit_global_model(X: pd.DataFrame, y: pd.Series, params: Dict, num_boost_round: int) -> lgb.Booster:
+    """全店舗分を積み上げた特徴量行列で共通モデルを学習"""
+    dataset = lgb.Dataset(
+        X, label=y, categorical_feature=[col for col in CATEGORICAL_FEATURES if col in X.columns],
+        params={'verbose': -1},
+    )
+    return lgb.train(params, dataset, num_boost_round=num_boost_round)
+
+def combined_fingerprint(fingerprints: Dict[int, str]) -> str:
+    """店舗ごとのデータのフィンガープリントをまとめた値（学習に使った店舗の組み合わせも含む）"""
+    joined = ','.join(f"{store_id}:{fingerprints[store_id]}" for store_id in sorted(fingerprints))
+    return hashlib.sha1(joined.encode('utf-8')).hexdigest()
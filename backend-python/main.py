@@ -1,12 +1,25 @@
 """FastAPIアプリケーション"""
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Literal, Union
 from datetime import date
 from predictor import run_sales_prediction
+from batch_predictor import run_batch_prediction, shutdown_batch_pool
+from precompute_forecasts import forecast_scheduler
+from utils.database import close_pool, get_pool_stats
+from utils.forecast_cache import forecast_cache
+from utils.weather_cache import weather_cache
+from utils.sales_fields import invalidate_sales_fields, sales_fields_cache
+from utils.metrics import observe_predict_request, render_metrics
+from utils.tracing import TRACE_HEADER, TraceMiddleware, log_event
+from utils.model_storage import get_model_cache_stats
+from utils.executor import (
+    QueueFullError, RequestCancelledError,
+    get_prediction_executor, get_executor_stats, shutdown_prediction_executor,
+)
 import os
-import sys
+import time
 
 app = FastAPI(title="Sales Prediction API", version="1.0.0")
 
@@ -17,8 +30,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[TRACE_HEADER],
 )
 
+# トレースはASGIミドルウェアで開始する（クライアントの切断検知を妨げないため）
+app.add_middleware(TraceMiddleware)
+
 class PredictionRequest(BaseModel):
     store_id: int
     predict_days: int = 7
@@ -31,13 +48,79 @@ class PredictionResponse(BaseModel):
     metrics: Dict
     message: Optional[str] = None
 
+class BatchPredictionRequest(BaseModel):
+    store_ids: Union[List[int], Literal["all"]] = "all"  # 店舗IDのリスト、または "all"（全店舗）
+    predict_days: int = 7
+    start_date: Optional[str] = None
+    retrain: bool = False
+
+class SalesFieldsInvalidateRequest(BaseModel):
+    business_type_id: Optional[int] = None  # 省略時（store_idも省略）はすべて破棄
+    store_id: Optional[int] = None
+
+class BatchPredictionResponse(BaseModel):
+    success: bool
+    results: List[Dict]
+    errors: List[Dict]
+    elapsed_seconds: float
+    message: Optional[str] = None
+
+@app.on_event("startup")
+def start_forecast_scheduler():
+    """予測の事前計算のスケジューラを開始（FORECAST_PRECOMPUTE_INTERVAL が0の場合は何もしない）"""
+    forecast_scheduler.start()
+
+@app.on_event("shutdown")
+def shutdown_resources():
+    """終了時に事前計算のスケジューラ・予測実行器とDBコネクションプールを閉じる"""
+    forecast_scheduler.stop()
+    shutdown_prediction_executor()
+    shutdown_batch_pool()
+    close_pool()
+
 @app.get("/health")
 async def health_check():
-    """ヘルスチェック"""
-    return {"status": "healthy"}
+    """ヘルスチェック（DBコネクションプール・予測実行器・各キャッシュのメトリクスを含む）"""
+    return {
+        "status": "healthy",
+        "db_pool": get_pool_stats(),
+        "executor": get_executor_stats(),
+        "forecast_cache": forecast_cache.stats(),
+        "weather_cache": weather_cache.stats(),
+        "model_cache": get_model_cache_stats(),
+        "sales_fields_cache": sales_fields_cache.stats(),
+        "forecast_scheduler": forecast_scheduler.stats(),
+    }
+
+@app.post("/sales-fields/invalidate")
+async def invalidate_sales_fields_cache(request: SalesFieldsInvalidateRequest):
+    """
+    売上項目のキャッシュを破棄（業態のフィールド設定・店舗の業態を変更した後に呼ぶ）
+
+    PREDICTION_EXECUTOR=process の場合、ワーカープロセスのキャッシュは SALES_FIELDS_CACHE_TTL で失効する。
+    """
+    invalidate_sales_fields(request.business_type_id, request.store_id)
+    return {"success": True, "sales_fields_cache": sales_fields_cache.stats()}
+
+@app.post("/forecasts/precompute")
+async def trigger_forecast_precompute():
+    """
+    予測の事前計算をすぐに実行する（売上データの保存後に呼ぶ）
+
+    データ・モデルが変わった店舗だけを計算する。スケジューラが無効の場合は何もしない
+    （precompute_forecasts.py を定時実行している場合はそちらで反映される）。
+    """
+    forecast_scheduler.trigger()
+    return {"success": True, "forecast_scheduler": forecast_scheduler.stats()}
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus形式のメトリクス（DBクエリ・予測の段階ごとのレイテンシ、/predict のレイテンシ、再学習回数）"""
+    content, content_type = render_metrics()
+    return Response(content=content, headers={"Content-Type": content_type})
 
 @app.post("/predict", response_model=PredictionResponse)
-async def predict_sales(request: PredictionRequest):
+async def predict_sales(request: PredictionRequest, http_request: Request):
     """
     売上予測を実行
     
@@ -50,22 +133,25 @@ async def predict_sales(request: PredictionRequest):
     Returns:
         PredictionResponse: 予測結果、評価指標、特徴量重要度
     """
+    started = time.perf_counter()
+    model_status = 'error'
     try:
         start_date_obj = None
         if request.start_date:
             start_date_obj = date.fromisoformat(request.start_date)
         
-        print(f"[main.py] predict_sales called: store_id={request.store_id}, retrain={request.retrain} (type={type(request.retrain)})", flush=True)
-        print(f"[main.py] request.retrain is True: {request.retrain is True}, request.retrain == True: {request.retrain == True}, bool(request.retrain): {bool(request.retrain)}", flush=True)
-        print(f"[main.py] Full request body: {request.model_dump_json()}", flush=True)
-        sys.stdout.flush()
+        log_event('predict_request', **request.model_dump())
         
-        result = run_sales_prediction(
+        # 予測・学習はブロッキング処理のため実行器に投入する
+        result = await get_prediction_executor().run(
+            http_request,
+            run_sales_prediction,
             store_id=request.store_id,
             predict_days=request.predict_days,
             start_date=start_date_obj,
             retrain=request.retrain  # 再学習フラグを渡す
         )
+        model_status = result.get('model_status', 'unknown')
         
         return PredictionResponse(
             success=True,
@@ -73,6 +159,59 @@ async def predict_sales(request: PredictionRequest):
             metrics=result['metrics'],
             message="予測が正常に完了しました"
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RequestCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"予測エラー: {str(e)}")
+    finally:
+        observe_predict_request('/predict', request.store_id, model_status, time.perf_counter() - started)
+
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_sales_batch(request: BatchPredictionRequest, http_request: Request):
+    """
+    複数店舗の売上予測をまとめて実行
+    
+    Args:
+        request: 一括予測リクエスト
+            - store_ids: 店舗IDのリスト、または "all"（売上データのある全店舗）
+            - predict_days: 予測日数（デフォルト7日）
+            - start_date: 予測開始日（YYYY-MM-DD形式、Noneの場合は今日）
+    
+    Returns:
+        BatchPredictionResponse: 店舗ごとの予測結果とエラー
+    """
+    try:
+        start_date_obj = None
+        if request.start_date:
+            start_date_obj = date.fromisoformat(request.start_date)
+        
+        store_ids = None if request.store_ids == "all" else request.store_ids
+        
+        # 店舗ごとの処理はプロセスプールに分散され、受付は予測用の実行器で1件として扱う
+        result = await get_prediction_executor().run(
+            http_request,
+            run_batch_prediction,
+            store_ids=store_ids,
+            predict_days=request.predict_days,
+            start_date=start_date_obj,
+            retrain=request.retrain
+        )
+        
+        return BatchPredictionResponse(
+            success=not result['errors'],
+            results=result['results'],
+            errors=result['errors'],
+            elapsed_seconds=result['elapsed_seconds'],
+            message=f"{len(result['results'])}店舗の予測が完了しました（失敗: {len(result['errors'])}店舗）"
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RequestCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -81,22 +220,28 @@ async def predict_sales(request: PredictionRequest):
 @app.get("/predict/{store_id}")
 async def predict_sales_get(
     store_id: int,
+    http_request: Request,
     predict_days: int = Query(7, ge=1, le=30),
     start_date: Optional[str] = Query(None)
 ):
     """
     GETリクエストで売上予測を実行
     """
+    started = time.perf_counter()
+    model_status = 'error'
     try:
         start_date_obj = None
         if start_date:
             start_date_obj = date.fromisoformat(start_date)
         
-        result = run_sales_prediction(
+        result = await get_prediction_executor().run(
+            http_request,
+            run_sales_prediction,
             store_id=store_id,
             predict_days=predict_days,
             start_date=start_date_obj
         )
+        model_status = result.get('model_status', 'unknown')
         
         return PredictionResponse(
             success=True,
@@ -104,10 +249,16 @@ async def predict_sales_get(
             metrics=result['metrics'],
             message="予測が正常に完了しました"
         )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RequestCancelledError as e:
+        raise HTTPException(status_code=499, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"予測エラー: {str(e)}")
+    finally:
+        observe_predict_request('/predict/{store_id}', store_id, model_status, time.perf_counter() - started)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,205 @@
+"""
+全店舗の今日からの予測を事前計算して sales_forecasts に保存するコマンド・スケジューラ
+
+/predict は FORECAST_TABLE の場合、開始日・予測日数が保存済みの範囲に収まり、モデルが
+計算時から変わっていない要求をこのテーブルから返す（それ以外はその場で予測する）。
+売上・天気・店舗の位置が変わった店舗の結果はトリガーで削除され、次の実行で計算し直す。
+
+使い方:
+    python precompute_forecasts.py                  # データ・モデルが変わった店舗だけ計算
+    python precompute_forecasts.py --stores 1 2 3   # 店舗を指定
+    python precompute_forecasts.py --force          # 変わっていない店舗も計算
+    python precompute_forecasts.py --days 14        # 予測日数（省略時は FORECAST_PRECOMPUTE_DAYS）
+
+サービス内で実行する場合は FORECAST_PRECOMPUTE_INTERVAL（秒）を設定する（ForecastScheduler）。
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+from typing import Dict, List, Optional
+from batch_predictor import BATCH_MAX_STORES, run_batch_prediction, shutdown_batch_pool
+from data_loader import get_all_store_ids, get_data_fingerprint
+from predictor import model_fingerprint, model_versions
+from utils.database import db_connection, close_pool
+from utils.forecast_store import database_now, delete_forecasts, get_forecast_versions, save_forecasts
+
+# 事前計算する予測日数（/predict の予測日数がこれ以下なら保存済みの結果を切り出して返す）
+FORECAST_PRECOMPUTE_DAYS = int(os.getenv('FORECAST_PRECOMPUTE_DAYS', 7))
+# サービス内のスケジューラの実行間隔（秒、0の場合はサービス内では実行しない）
+FORECAST_PRECOMPUTE_INTERVAL = float(os.getenv('FORECAST_PRECOMPUTE_INTERVAL', 0))
+
+def forecast_version(store_id: int, data_fingerprint: str) -> str:
+    """予測結果の版（データのフィンガープリントとモデルファイルの更新日時から作る）"""
+    payload = json.dumps([data_fingerprint, model_versions(store_id)], sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def precompute_forecasts(
+    store_ids: Optional[List[int]] = None,
+    predict_days: int = FORECAST_PRECOMPUTE_DAYS,
+    force: bool = False
+) -> Dict:
+    """
+    今日から predict_days 日分の予測を計算して sales_forecasts に保存
+
+    保存済みの結果とデータ・モデルの版が同じ店舗は計算しない。版が変わった店舗の
+    結果は計算前に削除し（計算中の /predict はその場で予測する）、予測は
+    run_batch_prediction でまとめて実行する。開始日が今日より前の結果は削除する。
+
+    Args:
+        store_ids: 店舗IDのリスト（Noneの場合は売上データのある全店舗）
+        predict_days: 予測日数
+        force: 版が変わっていない店舗も計算するか
+
+    Returns:
+        Dict: {'start_date', 'computed', 'unchanged', 'errors', 'elapsed_seconds'}
+    """
+    started = time.perf_counter()
+    start_date = date.today()
+    errors = []
+
+    with db_connection():
+        if store_ids is None:
+            store_ids = get_all_store_ids()
+        # これ以降に売上・天気が更新された店舗の結果は保存しない
+        data_as_of = database_now()
+        fingerprints = {}
+        for store_id in store_ids:
+            try:
+                fingerprints[store_id] = get_data_fingerprint(store_id)
+            except ValueError as e:
+                errors.append({'store_id': store_id, 'error': str(e)})
+        stored_versions = get_forecast_versions(list(fingerprints), start_date, predict_days)
+        stale = [
+            store_id for store_id, fingerprint in fingerprints.items()
+            if force or stored_versions.get(store_id) != forecast_version(store_id, fingerprint)
+        ]
+        delete_forecasts(stale)
+        delete_forecasts(before=start_date)
+
+    print(f"[事前計算] {start_date} から {predict_days}日分: 対象 {len(stale)}店舗"
+          f"（変更なし: {len(fingerprints) - len(stale)}店舗）")
+
+    computed = 0
+    # 一括予測の店舗数の上限ごとに予測して保存する（途中で止まっても保存済みの店舗は使える）
+    for i in range(0, len(stale), BATCH_MAX_STORES):
+        batch = run_batch_prediction(stale[i:i + BATCH_MAX_STORES], predict_days, start_date)
+        errors.extend(batch['errors'])
+        forecasts = [
+            {
+                'store_id': result['store_id'],
+                # 予測中にモデルを学習した場合があるため、版は予測後に取り直す
+                'version': forecast_version(result['store_id'], fingerprints[result['store_id']]),
+                'model_version': model_fingerprint(result['store_id']),
+                'predictions': result['predictions'],
+                'metrics': result['metrics'],
+            }
+            for result in batch['results']
+        ]
+        with db_connection():
+            computed += save_forecasts(forecasts, start_date, predict_days, data_as_of)
+
+    elapsed = time.perf_counter() - started
+    print(f"[事前計算] 完了: 保存 {computed}店舗, 失敗 {len(errors)}店舗 ({elapsed:.1f}秒)")
+    return {
+        'start_date': start_date.isoformat(),
+        'computed': computed,
+        'unchanged': len(fingerprints) - len(stale),
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+    }
+
+class ForecastScheduler:
+    """
+    サービス内で interval 秒ごとに precompute_forecasts を実行するバックグラウンドスレッド
+
+    データが変わった店舗と日付が変わった後の開始日だけを計算する。trigger() で次の実行を
+    早める（売上の保存後などに呼ぶ）。複数のサービスのプロセスで動かすと同じ計算が
+    重複するため、1つのプロセスだけで有効にするか、コマンドを定時実行する。
+    """
+
+    def __init__(self, interval: float = FORECAST_PRECOMPUTE_INTERVAL, predict_days: int = FORECAST_PRECOMPUTE_DAYS):
+        self.interval = interval
+        self.predict_days = predict_days
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # メトリクス
+        self._runs = 0
+        self._failures = 0
+        self._last_run: Optional[Dict] = None
+        self._last_error: Optional[str] = None
+
+    def start(self):
+        """スレッドを開始（interval が0以下の場合は何もしない）"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='forecast-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """スレッドを停止（実行中の事前計算は完了を待たない）"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def trigger(self):
+        """次の事前計算をすぐに実行する"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                summary = precompute_forecasts(predict_days=self.predict_days)
+                with self._lock:
+                    self._runs += 1
+                    self._last_run = {**summary, 'finished_at': datetime.now().isoformat()}
+            except Exception as e:
+                print(f"[事前計算エラー] {e}")
+                with self._lock:
+                    self._failures += 1
+                    self._last_error = str(e)
+            self._wake.wait(self.interval)
+
+    def stats(self) -> Dict:
+        """スケジューラのメトリクスを取得"""
+        with self._lock:
+            return {
+                'enabled': self._thread is not None,
+                'interval_seconds': self.interval,
+                'predict_days': self.predict_days,
+                'runs': self._runs,
+                'failures': self._failures,
+                'last_run': self._last_run,
+                'last_error': self._last_error,
+            }
+
+forecast_scheduler = ForecastScheduler()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='全店舗の今日からの売上予測を事前計算して保存する')
+    parser.add_argument('--stores', type=int, nargs='+', help='計算する店舗ID（省略時は売上データのある全店舗）')
+    parser.add_argument('--days', type=int, default=FORECAST_PRECOMPUTE_DAYS, help='予測日数')
+    parser.add_argument('--force', action='store_true', help='データ・モデルが変わっていない店舗も計算する')
+    args = parser.parse_args(argv)
+
+    try:
+        summary = precompute_forecasts(args.stores, predict_days=args.days, force=args.force)
+    finally:
+        shutdown_batch_pool()
+        close_pool()
+    for error in summary['errors']:
+        print(f"[事前計算] 店舗ID {error['store_id']}: 失敗 {error['error']}")
+    return 1 if summary['errors'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
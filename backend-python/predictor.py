@@ -2,15 +2,56 @@
 from sklearn.metrics import mean_absolute_error, r2_score, mean_absolute_percentage_error
 import pandas as pd
 import numpy as np
+import hashlib
+import json
+import os
 import sys
-from datetime import date, timedelta
+import time
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Tuple, Optional
+import lightgbm as lgb
 from lightgbm import LGBMRegressor
-from data_loader import load_sales_data, is_holiday_jp
-from utils.sales_fields import get_sales_fields
-from utils.model_storage import save_model, load_model, model_exists, delete_model
+from data_loader import (
+    load_sales_data_incremental, get_data_watermark, watermark_fingerprint,
+    get_store_location, get_store_profiles, get_all_store_ids,
+)
+from calendar_features import calendar_features, holiday_flags
+from backtest import BACKTEST_ENABLED, BACKTEST_WORKERS, run_backtest, run_global_backtest
+from rolling_features import RECURSIVE_FORECAST, RollingFeaturizer, recursive_forecast
+from global_model import (
+    GLOBAL_MODEL, GLOBAL_STORE_ID, add_store_features, business_type_codes, combined_fingerprint,
+    fit_global_model, global_feature_columns,
+)
+from utils.sales_fields import get_sales_fields, get_sales_fields_bulk
+from utils.model_storage import (
+    NativeModel, save_model, load_model, model_exists, delete_model, get_store_model_versions,
+    get_model_feature_names, load_model_manifest,
+)
+from utils.forecast_cache import forecast_cache
+from utils.forecast_store import FORECAST_TABLE, load_forecast
+from utils.database import db_connection
+from utils.metrics import stage_timer, observe_stages, count_feature_mismatch_retrain
+from utils.tracing import span, traced
+from utils.weather_cache import weather_cache, to_weather_frame
+from utils.dtypes import COMPACT_DTYPES, compact_frame, memory_report
 
-def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields: List[str] = None) -> pd.DataFrame:
+# 複数の売上項目を学習する際に、LightGBMのDataset（特徴量のビン分割）を共有するか
+MULTI_TARGET_TRAINING = os.getenv('MULTI_TARGET_TRAINING', 'false').lower() in ('1', 'true', 'yes')
+
+# LGBMRegressor(random_state=42, verbose=-1) と同じ学習パラメータ（lgb.train 用）
+LGBM_PARAMS = {'objective': 'regression', 'seed': 42, 'verbose': -1}
+LGBM_NUM_BOOST_ROUND = 100
+
+# 増分学習: 保存済みモデルから新しく増えた日の行だけで学習を続ける（train_store_models で使用）
+INCREMENTAL_TRAINING = os.getenv('INCREMENTAL_TRAINING', 'true').lower() in ('1', 'true', 'yes')
+INCREMENTAL_NUM_BOOST_ROUND = int(os.getenv('INCREMENTAL_NUM_BOOST_ROUND', 10))  # 1回の更新で追加する木の数
+INCREMENTAL_MIN_ROWS = int(os.getenv('INCREMENTAL_MIN_ROWS', 90))  # 新しい行が少ない場合は直近の行を足してこの行数で学習
+FULL_REBUILD_DAYS = int(os.getenv('FULL_REBUILD_DAYS', 30))  # 前回の全期間の学習からこの日数が過ぎたら作り直す
+
+@traced()
+def make_features(
+    df: pd.DataFrame, include_target: bool = False, sales_fields: List[str] = None, dropna: bool = True
+) -> pd.DataFrame:
     """
     特徴量を作成（参考サイトのmake_features関数を移植）
     
@@ -18,6 +59,7 @@ def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields:
         df: 日付、売上、天気データを含むDataFrame
         include_target: ターゲット変数を含めるか
         sales_fields: 予測対象の売上項目のキーリスト（例: ['edwNetSales', 'ohbNetSales']）
+        dropna: 移動平均・ラグが欠損する最初の行を削除するか（False は履歴の短い店舗を共通モデルで予測する場合）
     
     Returns:
         DataFrame: 特徴量を含むDataFrame
@@ -28,6 +70,9 @@ def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields:
     if sales_fields is None:
         sales_fields = ['edw_sales', 'ohb_sales']  # デフォルト
     
+    # カレンダー特徴量（ベクトル化）
+    calendar = calendar_features(df['date'])
+    
     # 基本特徴量
     features_df = pd.DataFrame({
         'temperature': df['temperature'].fillna(0),
@@ -38,13 +83,13 @@ def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields:
         'windspeed': df['windspeed'].fillna(0),
         'pressure': df['pressure'].fillna(0),
         'feelslike': df['feelslike'].fillna(0),
-        'weekday': df['date'].apply(lambda d: d.weekday()),
+        'weekday': calendar['weekday'],
         'is_holiday': df['is_holiday'].astype(int),
-        'month': df['date'].apply(lambda d: d.month),
-        'day': df['date'].apply(lambda d: d.day),
-        'is_month_start': df['date'].apply(lambda d: 1 if d.day == 1 else 0),
-        'is_month_end': df['date'].apply(lambda d: 1 if d.day == pd.Timestamp(d).days_in_month else 0),
-        'dayofyear': df['date'].apply(lambda d: d.timetuple().tm_yday),
+        'month': calendar['month'],
+        'day': calendar['day'],
+        'is_month_start': calendar['is_month_start'],
+        'is_month_end': calendar['is_month_end'],
+        'dayofyear': calendar['dayofyear'],
         'date': df['date'],
     })
     
@@ -72,7 +117,12 @@ def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields:
                 features_df[f'{sales_key}_lag14'] = features_df[sales_key].shift(14)
         
         # NaNを削除
-        features_df.dropna(inplace=True)
+        if dropna:
+            features_df.dropna(inplace=True)
+    
+    if COMPACT_DTYPES:
+        # 移動平均は float64 で計算してから縮小する
+        features_df = compact_frame(features_df)
     
     return features_df
 
@@ -92,19 +142,333 @@ def align_features(train_X: pd.DataFrame, future_X: pd.DataFrame) -> pd.DataFram
     
     return future_X_aligned
 
+def build_design_matrix(
+    train_df: pd.DataFrame,
+    future_df: Optional[pd.DataFrame],
+    target_columns: List[str]
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """
+    学習用・予測用の特徴量行列（train_X, future_X）を作成
+    
+    特徴量は予測対象の売上項目によらず共通なので、リクエストごとに1回だけ作って
+    すべての売上項目で使い回す。
+    
+    Args:
+        train_df: make_features(include_target=True) の結果
+        future_df: make_features(include_target=False) の結果（Noneの場合は学習用のみ作成）
+        target_columns: 予測対象の売上項目（特徴量から除外する）
+    
+    Returns:
+        (train_X, future_X): future_X は train_X と同じ列・列順（future_dfがNoneの場合はNone）
+    """
+    # One-hotエンコーディング（予測対象カラムを除外）
+    drop_columns = target_columns + ['date']
+    train_df_features = train_df.drop(columns=drop_columns)
+    
+    if future_df is None:
+        train_X = pd.get_dummies(train_df_features, drop_first=True)
+        if 'weekday' in train_df.columns and 'weekday' not in train_X.columns:
+            train_X['weekday'] = train_df['weekday'].astype(int)
+        return train_X, None
+    
+    future_df_features = future_df.drop(columns=['date'])
+    
+    # 学習データと予測データを結合して、すべてのカテゴリ値を統一
+    # これにより、pd.get_dummiesが同じ列を生成することを保証
+    combined_df = pd.concat([train_df_features, future_df_features], ignore_index=True)
+    combined_X = pd.get_dummies(combined_df, drop_first=True)
+    
+    # 学習データと予測データに分割
+    train_X = combined_X.iloc[:len(train_df_features)].copy()
+    future_X = combined_X.iloc[len(train_df_features):].copy()
+    
+    # 曜日を数値で追加（既にget_dummiesで処理されている場合はスキップ）
+    if 'weekday' in train_df.columns and 'weekday' not in train_X.columns:
+        train_X['weekday'] = train_df['weekday'].astype(int)
+    if 'weekday' in future_df.columns and 'weekday' not in future_X.columns:
+        future_X['weekday'] = future_df['weekday'].astype(int)
+    
+    # 特徴量整列
+    future_X = align_features(train_X, future_X)
+    return train_X, future_X
+
+def _save_fitted_model(
+    store_id: int,
+    sales_key: str,
+    model,
+    train_X: pd.DataFrame,
+    train_dates: pd.Series,
+    training_seconds: float,
+    data_fingerprint: Optional[str],
+    backtest: Optional[Dict] = None,
+    full_trained_at: Optional[str] = None,
+    incremental_updates: int = 0,
+    extra: Optional[Dict] = None,
+    backtest_trained_at: Optional[str] = None
+):
+    """
+    学習したモデルを保存（学習時の特徴量スキーマ・データのフィンガープリント・バックテスト結果などをマニフェストに残す）
+
+    Args:
+        full_trained_at: 増分学習の場合、元になった全期間の学習の日時（Noneの場合は今回が全期間の学習）
+        incremental_updates: 全期間の学習からの増分学習の回数
+        backtest_trained_at: 引き継いだバックテストを行った学習の日時（Noneの場合は今回の学習）
+        extra: マニフェストに追加で記録する値
+    """
+    train_dates = pd.to_datetime(train_dates)
+    trained_at = datetime.now().isoformat()
+    save_model(store_id, sales_key, model, manifest={
+        'feature_names': list(train_X.columns),
+        'feature_dtypes': {col: str(dtype) for col, dtype in train_X.dtypes.items()},
+        'train_start': train_dates.min().date().isoformat(),
+        'train_end': train_dates.max().date().isoformat(),
+        'n_rows': int(len(train_X)),
+        'trained_at': trained_at,
+        'training_seconds': training_seconds,
+        'data_fingerprint': data_fingerprint,
+        'backtest': backtest,
+        'backtest_trained_at': (backtest_trained_at or trained_at) if backtest else None,
+        'training_mode': 'incremental' if incremental_updates else 'full',
+        'full_trained_at': full_trained_at or trained_at,
+        'incremental_updates': incremental_updates,
+        **(extra or {}),
+    })
+
+def _fit_model(
+    store_id: int,
+    sales_key: str,
+    train_X: pd.DataFrame,
+    y_target: pd.Series,
+    train_dates: pd.Series,
+    data_fingerprint: Optional[str] = None,
+    backtest: Optional[Dict] = None
+) -> LGBMRegressor:
+    """LightGBMモデルを学習して保存"""
+    print(f"[予測] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを学習中...")
+    started = time.perf_counter()
+    model = LGBMRegressor(random_state=42, verbose=-1)
+    model.fit(train_X, y_target)
+    training_seconds = time.perf_counter() - started
+    
+    _save_fitted_model(store_id, sales_key, model, train_X, train_dates, training_seconds, data_fingerprint, backtest)
+    return model
+
+def _update_model(
+    store_id: int,
+    sales_key: str,
+    train_X: pd.DataFrame,
+    y_target: pd.Series,
+    train_dates: pd.Series,
+    data_fingerprint: Optional[str] = None
+) -> Optional[Tuple[NativeModel, int]]:
+    """
+    保存済みのモデルを初期モデルとして、前回の学習以降に増えた日の行だけで木を追加して保存
+
+    学習時間は全期間の行数ではなく新しい行数に比例する。次の場合は増分学習せずNoneを返す
+    （呼び出し側で全期間を学習し直す）:
+    特徴量スキーマ（名前・順序）が変わった、新しい行がない、前回の全期間の学習から
+    FULL_REBUILD_DAYS 日以上経った。過去の日のデータの修正は次の全期間の学習まで反映されない。
+
+    Args:
+        train_X: 全期間の特徴量行列（日付の昇順）
+        y_target: 全期間の目的変数
+        train_dates: train_X の行ごとの日付
+
+    Returns:
+        (更新したモデル, 新しい行数): 増分学習できない場合はNone
+    """
+    manifest = load_model_manifest(store_id, sales_key)
+    if not manifest or manifest.get('feature_names') != list(train_X.columns) or not manifest.get('train_end'):
+        return None
+    full_trained_at = manifest.get('full_trained_at') or manifest.get('trained_at')
+    if not full_trained_at or datetime.now() - datetime.fromisoformat(full_trained_at) > timedelta(days=FULL_REBUILD_DAYS):
+        return None
+
+    new_rows = np.flatnonzero((pd.to_datetime(train_dates) > pd.Timestamp(manifest['train_end'])).to_numpy())
+    if len(new_rows) == 0:
+        return None
+    model = load_model(store_id, sales_key)
+    if model is None:
+        return None
+
+    # 新しい行が少ないと葉の最小データ数に届かず木が分岐しないため、直近の行を足す
+    start = max(0, min(new_rows[0], len(train_X) - INCREMENTAL_MIN_ROWS))
+    print(f"[予測] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを増分学習中（新しい行 {len(new_rows)}行）...")
+    started = time.perf_counter()
+    dataset = lgb.Dataset(train_X.iloc[start:], label=y_target.iloc[start:], params={'verbose': -1})
+    booster = lgb.train(
+        LGBM_PARAMS, dataset, num_boost_round=INCREMENTAL_NUM_BOOST_ROUND,
+        init_model=model.booster_, keep_training_booster=False,
+    )
+    training_seconds = time.perf_counter() - started
+
+    updated = NativeModel(booster)
+    _save_fitted_model(
+        store_id, sales_key, updated, train_X, train_dates, training_seconds, data_fingerprint,
+        manifest.get('backtest'), full_trained_at=full_trained_at,
+        incremental_updates=int(manifest.get('incremental_updates') or 0) + 1,
+        # バックテストは増分学習前のモデルのもの（次の全期間の学習で取り直す）
+        backtest_trained_at=manifest.get('backtest_trained_at') or full_trained_at,
+    )
+    return updated, len(new_rows)
+
+def _fit_models(
+    store_id: int,
+    sales_keys: List[str],
+    train_X: pd.DataFrame,
+    y_targets: Dict[str, pd.Series],
+    train_dates: pd.Series,
+    data_fingerprint: Optional[str] = None,
+    timings: Optional[Dict[str, float]] = None,
+    backtest_workers: Optional[int] = None,
+    history: Optional[Dict[str, pd.Series]] = None,
+    backtest: bool = False
+) -> Dict:
+    """
+    複数の売上項目のモデルを同じ特徴量行列で学習して保存
+    
+    LightGBMのDataset（特徴量のビン分割）は1回だけ作り、backtest かつ BACKTEST_ENABLED の場合は
+    ローリングオリジンのバックテストに使って予測期間外の指標をマニフェストに保存する。
+    MULTI_TARGET_TRAINING の場合は本番モデルも同じDatasetで目的変数だけを差し替えて
+    学習する（結果は LGBMRegressor と同じ）。
+    
+    Args:
+        sales_keys: 学習する売上項目
+        y_targets: 売上項目ごとの目的変数
+        timings: 指定した場合、売上項目ごとの学習時間（秒）を書き込む
+        backtest_workers: バックテストのプロセス数（Noneの場合は BACKTEST_WORKERS）
+        history: バックテストの評価期間のラグ・移動平均特徴量を作る売上項目ごとの値
+            （予測時の RollingFeaturizer と同じ売上項目、Noneの場合は y_targets）
+        backtest: バックテストを行うか（学習コマンドのみ、予測リクエストの学習では応答を遅らせないよう行わない）
+    
+    Returns:
+        Dict: 売上項目ごとのモデル
+    """
+    models = {}
+    if not sales_keys:
+        return models
+    
+    shared = MULTI_TARGET_TRAINING and len(sales_keys) > 1
+    backtest = backtest and BACKTEST_ENABLED
+    dataset = None
+    if shared or backtest:
+        dataset = lgb.Dataset(
+            train_X, label=y_targets[sales_keys[0]], free_raw_data=False, params={'verbose': -1}
+        ).construct()
+    
+    backtests = {}
+    if backtest:
+        try:
+            with span('backtest', store_id=store_id, sales_keys=len(sales_keys)):
+                backtests = run_backtest(
+                    dataset, train_X, {key: y_targets[key] for key in sales_keys}, train_dates,
+                    LGBM_PARAMS, LGBM_NUM_BOOST_ROUND,
+                    workers=backtest_workers if backtest_workers is not None else BACKTEST_WORKERS,
+                    history=history,
+                )
+        except Exception as e:
+            print(f"[バックテストエラー] 店舗ID {store_id}: {e}")
+    
+    if not shared:
+        for sales_key in sales_keys:
+            started = time.perf_counter()
+            with span('model_fit', sales_key=sales_key, rows=len(train_X)):
+                models[sales_key] = _fit_model(
+                    store_id, sales_key, train_X, y_targets[sales_key], train_dates, data_fingerprint,
+                    backtests.get(sales_key),
+                )
+            if timings is not None:
+                timings[sales_key] = time.perf_counter() - started
+        return models
+    
+    print(f"[予測] 店舗ID {store_id}, 売上項目 {sales_keys} のモデルをまとめて学習中...")
+    for sales_key in sales_keys:
+        started = time.perf_counter()
+        with span('model_fit', sales_key=sales_key, rows=len(train_X), shared_dataset=True):
+            dataset.set_label(y_targets[sales_key])
+            booster = lgb.train(LGBM_PARAMS, dataset, num_boost_round=LGBM_NUM_BOOST_ROUND)
+            training_seconds = time.perf_counter() - started
+            models[sales_key] = NativeModel(booster)
+            _save_fitted_model(
+                store_id, sales_key, models[sales_key], train_X, train_dates, training_seconds, data_fingerprint,
+                backtests.get(sales_key),
+            )
+        if timings is not None:
+            timings[sales_key] = time.perf_counter() - started
+    return models
+
+def _predict_future(
+    models: Dict,
+    train_df: pd.DataFrame,
+    future_df: pd.DataFrame,
+    future_X: pd.DataFrame,
+    target_columns: List[str],
+    feature_orders: Dict[str, List[str]]
+) -> Dict[str, np.ndarray]:
+    """
+    予測期間の売上項目ごとの予測値を計算
+    
+    RECURSIVE_FORECAST の場合は予測開始日より前の目的変数でリングバッファを初期化し、
+    前日までの予測値から1日ずつラグ・移動平均特徴量を作って予測する。
+    それ以外は従来どおりラグ・移動平均特徴量を0としてまとめて予測する。
+    
+    売上データが予測開始日の前日まで揃っていない場合（売上の登録が遅れている、
+    開始日が先の日付など）は、間の日を直近7日平均で埋めてから予測する
+    （間の日の天気・曜日は使わない。埋めた日数が長いほどラグ・移動平均は平均に近づく）。
+    """
+    if not RECURSIVE_FORECAST:
+        return {
+            sales_key: model.predict(future_X[feature_orders[sales_key]] if sales_key in feature_orders else future_X)
+            for sales_key, model in models.items()
+        }
+    start = future_df['date'].min()
+    history = train_df[train_df['date'] < start]
+    featurizer = RollingFeaturizer({key: history[key].to_numpy() for key in target_columns})
+    if not history.empty:
+        last_date = pd.Timestamp(history['date'].max())
+        gap_days = (pd.Timestamp(start) - last_date).days - 1
+        if gap_days > 0:
+            print(f"[予測] 売上データの最終日 {last_date.date()} から予測開始日まで"
+                  f"{gap_days}日空いているため、直近7日平均で埋めて予測します")
+            featurizer.skip(gap_days)
+    return recursive_forecast(models, future_X, featurizer, feature_orders)
+
+def _query_future_weather(store_id: int, predict_dates: pd.DatetimeIndex) -> pd.DataFrame:
+    """予測期間の天気データを取得（同じ地点の店舗・リクエストと共有する天気キャッシュを使う）"""
+    latitude, longitude = get_store_location(store_id)
+    return weather_cache.get(latitude, longitude, predict_dates.min().date(), predict_dates.max().date())
+
+def _future_frame_from_weather(weather: pd.DataFrame, sales_field_keys: List[str]) -> pd.DataFrame:
+    """天気データ（weather_cache.get の形式）から予測対象データを作成"""
+    future_data = to_weather_frame(weather)
+    future_data['is_holiday'] = holiday_flags(future_data['date'])
+    # すべての売上項目を0で初期化
+    for sales_key in sales_field_keys:
+        future_data[sales_key] = 0
+    return future_data
+
 def run_sales_prediction(
     store_id: int,
     predict_days: int = 7,
     start_date: Optional[date] = None,
-    retrain: bool = False
+    retrain: bool = False,
+    sales_fields_list: Optional[List[Dict]] = None,
+    future_weather: Optional[pd.DataFrame] = None
 ) -> Dict:
     """
     売上予測を実行（動的に売上項目を検出）
     
+    データ（売上・天気）とモデルファイルが変わっていなければ、同じ店舗・開始日の
+    結果を予測結果キャッシュから返す。retrain=True の場合は店舗のキャッシュを破棄する。
+    FORECAST_TABLE の場合は、まず事前計算した結果（sales_forecasts）を探す。
+    
     Args:
         store_id: 店舗ID
         predict_days: 予測日数（デフォルト7日）
         start_date: 予測開始日（Noneの場合は今日）
+        retrain: モデルを再学習するか
+        sales_fields_list: 取得済みの売上項目（バッチ予測用、Noneの場合はDBから取得）
+        future_weather: 取得済みの予測期間の天気データ（バッチ予測用、weather_cache.get の形式、Noneの場合は天気キャッシュから取得）
     
     Returns:
         Dict: 予測結果、評価指標、特徴量重要度
@@ -112,91 +476,125 @@ def run_sales_prediction(
     if start_date is None:
         start_date = date.today()
     
+    if FORECAST_TABLE and not retrain:
+        try:
+            with span('forecast_table.lookup', store_id=store_id):
+                stored = load_forecast(store_id, start_date, predict_days, model_fingerprint(store_id))
+        except Exception as e:
+            print(f"[予測] 事前計算の予測結果の取得エラー（店舗ID {store_id}）: {e}")
+            stored = None
+        if stored is not None:
+            print(f"[予測] 店舗ID {store_id} の事前計算の予測結果を返します")
+            return {**stored, 'model_status': 'precomputed'}
+    
+    # データの読み込みでも同じウォーターマークを使う（キャッシュにない場合に2回取得しない）
+    with db_connection():
+        data_watermark = get_data_watermark(store_id)
+    data_fingerprint = watermark_fingerprint(data_watermark)
+    
+    if retrain:
+        forecast_cache.invalidate(store_id)
+    else:
+        version = (data_fingerprint, model_versions(store_id))
+        cached = forecast_cache.get(store_id, start_date, predict_days, version)
+        if cached is not None:
+            print(f"[予測] 店舗ID {store_id} の予測結果をキャッシュから返します")
+            return {**cached, 'model_status': 'cached'}
+    
+    result = _run_sales_prediction(
+        store_id, predict_days, start_date, retrain,
+        sales_fields_list=sales_fields_list, future_weather=future_weather,
+        data_fingerprint=data_fingerprint, data_watermark=data_watermark,
+    )
+    
+    # 学習でモデルファイルが更新されている場合があるため、モデルの版は実行後に取り直す
+    version = (data_fingerprint, model_versions(store_id))
+    forecast_cache.put(store_id, start_date, predict_days, version, result)
+    return result
+
+def model_versions(store_id: int) -> Tuple:
+    """予測結果キャッシュの版に使うモデルファイルの更新日時（GLOBAL_MODEL の場合は共通モデルも含む）"""
+    versions = get_store_model_versions(store_id)
+    if GLOBAL_MODEL:
+        versions.update(get_store_model_versions(GLOBAL_STORE_ID))
+    return tuple(versions.items())
+
+def model_fingerprint(store_id: int) -> str:
+    """事前計算した予測結果と比べるモデルファイルの版（model_versions のハッシュ）"""
+    payload = json.dumps(model_versions(store_id))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _run_sales_prediction(
+    store_id: int,
+    predict_days: int,
+    start_date: date,
+    retrain: bool,
+    sales_fields_list: Optional[List[Dict]] = None,
+    future_weather: Optional[pd.DataFrame] = None,
+    data_fingerprint: Optional[str] = None,
+    data_watermark: Optional[Dict] = None
+) -> Dict:
+    """売上予測の本体（キャッシュを通さずに実行、data_watermark は取得済みの get_data_watermark の結果）"""
+    # 段階ごとの所要時間（モデルを学習したか再利用したかが決まった後でメトリクスに記録する）
+    timings: Dict[str, List[float]] = {}
+    trained = False
     end_date = start_date + timedelta(days=predict_days - 1)
     predict_dates = pd.date_range(start=start_date, end=end_date)
     
-    # 売上項目を動的に取得
-    sales_fields_list = get_sales_fields(store_id)
-    sales_field_keys = [sf['key'] for sf in sales_fields_list]
+    # データ取得はリクエスト全体で1本のDB接続を共有する
+    with db_connection():
+        # 売上項目を動的に取得
+        if sales_fields_list is None:
+            sales_fields_list = get_sales_fields(store_id)
+        sales_field_keys = [sf['key'] for sf in sales_fields_list]
     
-    # 店舗純売上（netSales）を明示的に除外
-    sales_field_keys = [key for key in sales_field_keys if key.lower() not in ['netsales', 'net_sales', 'net sales']]
+        # 店舗純売上（netSales）を明示的に除外
+        sales_field_keys = [key for key in sales_field_keys if key.lower() not in ['netsales', 'net_sales', 'net sales']]
     
-    if not sales_field_keys:
-        raise ValueError(f"No sales fields found for store {store_id}")
+        if not sales_field_keys:
+            raise ValueError(f"No sales fields found for store {store_id}")
     
-    print(f"[予測] 店舗ID {store_id} の売上項目: {sales_field_keys} (店舗純売上は除外)")
+        print(f"[予測] 店舗ID {store_id} の売上項目: {sales_field_keys} (店舗純売上は除外)")
     
-    # データ取得
-    all_data = load_sales_data(store_id)
+        # データ取得
+        with stage_timer(timings, 'load_data'), span('load_data', store_id=store_id):
+            all_data = load_sales_data_incremental(store_id, data_watermark)
     
-    if all_data.empty:
-        raise ValueError(f"No sales data found for store {store_id}")
+        if all_data.empty:
+            raise ValueError(f"No sales data found for store {store_id}")
     
-    # 予測期間を除外
-    # 売上項目のいずれかが0でない日を学習データに含める
-    train_condition = ~all_data['date'].isin(predict_dates)
-    # すべての売上項目が0の日を除外
-    for sales_key in sales_field_keys:
-        if sales_key in all_data.columns:
-            train_condition = train_condition & (all_data[sales_key].fillna(0) > 0)
-            break  # 最初の売上項目で判定
+        # 予測期間を除外
+        # 売上項目のいずれかが0でない日を学習データに含める
+        train_condition = ~all_data['date'].isin(predict_dates)
+        # すべての売上項目が0の日を除外
+        for sales_key in sales_field_keys:
+            if sales_key in all_data.columns:
+                train_condition = train_condition & (all_data[sales_key].fillna(0) > 0)
+                break  # 最初の売上項目で判定
     
-    train_data = all_data[train_condition].copy()
+        train_data = all_data[train_condition].copy()
     
-    # 予測対象データ: 予測期間のデータ（天気データがあれば使用）
-    future_data = all_data[all_data['date'].isin(predict_dates)].copy()
+        # 予測対象データ: 予測期間のデータ（天気データがあれば使用）
+        future_data = all_data[all_data['date'].isin(predict_dates)].copy()
     
-    # 予測対象データが存在しない場合は、天気データのみで作成
-    if future_data.empty:
-        from utils.database import execute_query
-        store_query = "SELECT latitude, longitude FROM stores WHERE id = %s"
-        store_result = execute_query(store_query, (store_id,))
-        if not store_result:
-            raise ValueError(f"Store {store_id} not found")
-        
-        latitude = store_result[0]['latitude']
-        longitude = store_result[0]['longitude']
-        
-        weather_query = """
-            SELECT date, weather, temperature, humidity, precipitation, snow,
-                   windspeed, gust, pressure, feelslike
-            FROM weather_data
-            WHERE latitude = %s AND longitude = %s
-            AND date = ANY(%s::date[])
-        """
-        date_str_list = [d.isoformat() for d in predict_dates]
-        weather_results = execute_query(
-            weather_query,
-            (float(latitude), float(longitude), date_str_list)
-        )
-        
-        future_records = []
-        for w in weather_results:
-            w_date = w['date'] if isinstance(w['date'], date) else pd.Timestamp(w['date']).date()
-            record = {
-                'date': w_date,
-                'temperature': float(w['temperature']) if w['temperature'] else None,
-                'humidity': float(w['humidity']) if w['humidity'] else None,
-                'precipitation': float(w['precipitation']) if w['precipitation'] else None,
-                'snow': float(w['snow']) if w['snow'] else None,
-                'windspeed': float(w['windspeed']) if w['windspeed'] else None,
-                'gust': float(w['gust']) if w['gust'] else None,
-                'pressure': float(w['pressure']) if w['pressure'] else None,
-                'feelslike': float(w['feelslike']) if w['feelslike'] else None,
-                'weather': w['weather'] or '',
-                'is_holiday': is_holiday_jp(w_date),
-            }
-            # すべての売上項目を0で初期化
-            for sales_key in sales_field_keys:
-                record[sales_key] = 0
-            future_records.append(record)
-        
-        future_data = pd.DataFrame(future_records)
+        # 予測対象データが存在しない場合は、天気データのみで作成
+        if future_data.empty:
+            if future_weather is None:
+                future_weather = _query_future_weather(store_id, predict_dates)
+            future_data = _future_frame_from_weather(future_weather, sales_field_keys)
     
     if train_data.empty:
         raise ValueError(f"Insufficient training data for store {store_id}. Need at least some historical sales data.")
     
+    # すべての売上項目に全店舗共通モデルがある場合はそれで予測する（再学習の指定は店舗ごとのモデルで行う）
+    if GLOBAL_MODEL and not retrain:
+        with stage_timer(timings, 'model_load'):
+            global_models = {key: load_model(GLOBAL_STORE_ID, key) for key in sales_field_keys}
+        if all(model is not None for model in global_models.values()):
+            return _run_global_prediction(
+                store_id, train_data, future_data, sales_fields_list, global_models, timings
+            )
+    
     # データ量を確認（月数で判定）
     train_data['year_month'] = train_data['date'].apply(lambda d: f"{d.year}-{d.month:02d}")
     unique_months = train_data['year_month'].nunique()
@@ -208,8 +606,9 @@ def run_sales_prediction(
         print(f"[予測] 店舗ID {store_id} のデータが2か月未満（{unique_months}か月）のため、移動平均線のみで予測します")
     
     # 特徴量作成（売上項目を指定）
-    train_df = make_features(train_data, include_target=True, sales_fields=sales_field_keys)
-    future_df = make_features(future_data, include_target=False, sales_fields=sales_field_keys)
+    with stage_timer(timings, 'build_features'):
+        train_df = make_features(train_data, include_target=True, sales_fields=sales_field_keys)
+        future_df = make_features(future_data, include_target=False, sales_fields=sales_field_keys)
     
     if train_df.empty or future_df.empty:
         raise ValueError("Failed to create features")
@@ -223,18 +622,18 @@ def run_sales_prediction(
     predictions_list = []
     metrics_dict = {}
     
+    # 目的変数（データが少なすぎる売上項目はスキップ）
+    y_targets = {}
     for sales_key in target_columns:
-        if sales_key not in train_df.columns:
-            continue
-        
         y_target = train_df[sales_key].fillna(0)
         
-        # データが少なすぎる場合はスキップ
         if len(y_target[y_target > 0]) < 10:
             print(f"[予測] 売上項目 {sales_key} のデータが不足しているためスキップ")
             continue
-        
-        if use_fallback:
+        y_targets[sales_key] = y_target
+    
+    if use_fallback:
+        for sales_key, y_target in y_targets.items():
             # Fallback: 移動平均線のみで予測
             # 7日移動平均を計算
             ma7 = y_target.rolling(7).mean().iloc[-1] if len(y_target) >= 7 else y_target.mean()
@@ -261,79 +660,85 @@ def run_sales_prediction(
                 "feature_importance": {},
                 "method": "moving_average"
             }
-        else:
-            # 通常の予測: LightGBMモデルを使用
-            # One-hotエンコーディング（予測対象カラムを除外）
-            drop_columns = target_columns + ['date']
-            
-            # 学習データと予測データを結合して、すべてのカテゴリ値を統一
-            # これにより、pd.get_dummiesが同じ列を生成することを保証
-            train_df_features = train_df.drop(columns=drop_columns)
-            future_df_features = future_df.drop(columns=['date'])
-            
-            # すべてのカテゴリ列を取得
-            categorical_cols = train_df_features.select_dtypes(include=['object', 'category']).columns.tolist()
-            
-            # 学習データと予測データを結合して、すべてのカテゴリ値を統一
-            combined_df = pd.concat([train_df_features, future_df_features], ignore_index=True)
-            
-            # One-hotエンコーディングを結合データに対して実行
-            combined_X = pd.get_dummies(combined_df, drop_first=True)
-            
-            # 学習データと予測データに分割
-            train_X = combined_X.iloc[:len(train_df_features)].copy()
-            future_X = combined_X.iloc[len(train_df_features):].copy()
-            
-            # 曜日を数値で追加（既にget_dummiesで処理されている場合はスキップ）
-            if 'weekday' in train_df.columns and 'weekday' not in train_X.columns:
-                train_X['weekday'] = train_df['weekday'].astype(int)
-            if 'weekday' in future_df.columns and 'weekday' not in future_X.columns:
-                future_X['weekday'] = future_df['weekday'].astype(int)
-            
-            # 特徴量整列
-            future_X = align_features(train_X, future_X)
-
-            # 再学習が必要な場合は既存のモデルを削除
+    elif y_targets:
+        # 通常の予測: LightGBMモデルを使用
+        # 特徴量行列は売上項目によらず共通なので、リクエストごとに1回だけ作る
+        with stage_timer(timings, 'design_matrix'):
+            train_X, future_X = build_design_matrix(train_df, future_df, target_columns)
+        
+        # 既存モデルを読み込み、学習が必要な売上項目を決める
+        models = {}
+        feature_orders = {}
+        to_fit = []
+        for sales_key in y_targets:
             model = None
-
+            
             if retrain:
+                # 再学習が必要な場合は既存のモデルを削除
                 delete_model(store_id, sales_key)
                 print(f"[予測] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを再学習します")
             else:
-                model = load_model(store_id, sales_key)
+                with stage_timer(timings, 'model_load'):
+                    model = load_model(store_id, sales_key)
                 if model is not None:
-                    # 特徴量数が一致しない場合は削除して再学習
-                    if model.n_features_ != future_X.shape[1]:
-                        print(f"[予測] 特徴量数不一致（モデル={model.n_features_}, データ={future_X.shape[1]}）。再学習します。")
+                    # 学習時の特徴量（名前と順序）と一致しない場合は削除して再学習
+                    model_features = get_model_feature_names(store_id, sales_key, model)
+                    if model_features is None:
+                        # マニフェストのない古いモデルは特徴量数のみで判定
+                        schema_matches = model.n_features_ == future_X.shape[1]
+                    else:
+                        schema_matches = sorted(model_features) == sorted(future_X.columns)
+                        if schema_matches and model_features != list(future_X.columns):
+                            # 列の並びだけが異なる場合はモデルの順序に合わせる
+                            feature_orders[sales_key] = model_features
+                    if not schema_matches:
+                        print(f"[予測] 特徴量スキーマ不一致（モデル={model.n_features_}列, データ={future_X.shape[1]}列）。再学習します。")
+                        count_feature_mismatch_retrain(store_id)
                         delete_model(store_id, sales_key)
                         model = None
             
-            model_loaded = model is not None
-            
-            # 再学習が必要な場合、またはモデルが存在しない場合は学習
-            if retrain or model is None:
-                print(f"[予測] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを学習中...")
-                model = LGBMRegressor(random_state=42, verbose=-1)
-                model.fit(train_X, y_target)
-                save_model(store_id, sales_key, model)
+            if model is None:
+                to_fit.append(sales_key)
             else:
+                models[sales_key] = model
                 print(f"[予測] 店舗ID {store_id}, 売上項目 {sales_key} の既存モデルを使用")
+        
+        # 再学習が必要な場合、またはモデルが存在しない場合はまとめて学習（バックテストは学習コマンドで行う）
+        fit_timings = {}
+        models.update(_fit_models(
+            store_id, to_fit, train_X, y_targets, train_df['date'], data_fingerprint, fit_timings,
+        ))
+        if fit_timings:
+            timings['model_fit'] = list(fit_timings.values())
+        trained = bool(to_fit)
+        
+        for sales_key, y_target in y_targets.items():
+            model = models[sales_key]
+            target_future_X = future_X[feature_orders[sales_key]] if sales_key in feature_orders else future_X
             
             # 予測前に特徴量数を再確認
-            if model.n_features_ != future_X.shape[1]:
-                print(f"[予測] 特徴量数不一致のため再学習: モデル={model.n_features_}, データ={future_X.shape[1]}")
+            if model.n_features_ != target_future_X.shape[1]:
+                print(f"[予測] 特徴量数不一致のため再学習: モデル={model.n_features_}, データ={target_future_X.shape[1]}")
+                count_feature_mismatch_retrain(store_id)
                 delete_model(store_id, sales_key)
-                model = LGBMRegressor(random_state=42, verbose=-1)
-                model.fit(train_X, y_target)
-                save_model(store_id, sales_key, model)
-                future_X = align_features(train_X, future_X)
-
+                with stage_timer(timings, 'model_fit'), span('model_fit', sales_key=sales_key, rows=len(train_X)):
+                    model = _fit_model(store_id, sales_key, train_X, y_target, train_df['date'], data_fingerprint)
+                trained = True
+                models[sales_key] = model
+                feature_orders.pop(sales_key, None)
+            
             # 最終確認
             if model.n_features_ != future_X.shape[1]:
                 raise ValueError(f"特徴量数が一致しません: モデル={model.n_features_}, データ={future_X.shape[1]}")
-            
-            # 予測
-            predictions = model.predict(future_X)
+        
+        # 予測（ラグ・移動平均特徴量は予測値から1日ずつ作る）
+        with stage_timer(timings, 'model_predict'), span('model_predict', days=len(future_X), recursive=RECURSIVE_FORECAST):
+            all_predictions = _predict_future(models, train_df, future_df, future_X, target_columns, feature_orders)
+        
+        for sales_key, y_target in y_targets.items():
+            model = models[sales_key]
+            predictions = all_predictions[sales_key]
+            target_train_X = train_X[feature_orders[sales_key]] if sales_key in feature_orders else train_X
             
             # 予測結果を保存
             for i, pred_date in enumerate(future_df['date']):
@@ -345,26 +750,351 @@ def run_sales_prediction(
                         sales_key: int(max(0, predictions[i])),
                     })
             
-            # 評価
-            y_pred_train = model.predict(train_X)
+            # 評価: 学習時に保存したバックテスト（予測期間外）の指標を使う
+            # バックテスト結果のないモデルは従来どおり学習データ上で計算する
+            # rolling_features のない古いバックテストは評価期間の実績値をラグ・移動平均に使った1日先の評価
+            # 増分学習したモデルのバックテストは元になった全期間の学習のもの（trained_at に日時を返す）
+            manifest = load_model_manifest(store_id, sales_key) or {}
+            backtest = manifest.get('backtest')
+            if backtest:
+                scores = {"mae": backtest['mae'], "r2": backtest['r2'], "mape": backtest['mape']}
+            else:
+                y_pred_train = model.predict(target_train_X)
+                scores = {
+                    "mae": float(mean_absolute_error(y_target, y_pred_train)),
+                    "r2": float(r2_score(y_target, y_pred_train)),
+                    "mape": float(mean_absolute_percentage_error(y_target, y_pred_train)),
+                }
             
             metrics_dict[sales_key] = {
-                "mae": float(mean_absolute_error(y_target, y_pred_train)),
-                "r2": float(r2_score(y_target, y_pred_train)),
-                "mape": float(mean_absolute_percentage_error(y_target, y_pred_train)),
+                **scores,
                 "feature_importance": {
                     col: float(importance) 
-                    for col, importance in zip(train_X.columns, model.feature_importances_)
+                    for col, importance in zip(target_train_X.columns, model.feature_importances_)
                 },
-                "method": "lightgbm"
+                "method": "lightgbm",
+                "evaluation": (
+                    ("backtest" if backtest.get('rolling_features') else "backtest_one_step")
+                    if backtest else "in_sample"
+                ),
             }
+            if backtest:
+                metrics_dict[sales_key]["backtest"] = {
+                    "n_folds": backtest['n_folds'],
+                    "horizon_days": backtest['horizon_days'],
+                    "rolling_features": backtest.get('rolling_features', 'actual'),
+                    "folds": backtest['folds'],
+                    "trained_at": manifest.get('backtest_trained_at') or manifest.get('full_trained_at'),
+                    "incremental_updates": int(manifest.get('incremental_updates') or 0),
+                }
     
     if not predictions_list:
         raise ValueError("No predictions generated")
     
+    model_status = 'fallback' if use_fallback else ('trained' if trained else 'reused')
+    observe_stages(store_id, model_status, timings)
+    
     return {
         'predictions': predictions_list,
         'metrics': metrics_dict,
         'sales_fields': sales_fields_list,
+        'model_status': model_status,
     }
 
+def _run_global_prediction(
+    store_id: int,
+    train_data: pd.DataFrame,
+    future_data: pd.DataFrame,
+    sales_fields_list: List[Dict],
+    models: Dict[str, object],
+    timings: Dict[str, List[float]]
+) -> Dict:
+    """
+    全店舗共通モデルで予測（店舗ごとの学習は行わない）
+    
+    ラグ・移動平均特徴量は予測開始日の前日までの売上から作り、足りない日は履歴の平均で
+    埋めるため、データが2か月未満の店舗も移動平均線ではなくモデルで予測する。
+    評価指標は学習時に保存したバックテストの指標を使う（ない場合はNone）。
+    """
+    with db_connection():
+        profile = get_store_profiles([store_id]).get(store_id)
+    
+    target_columns = list(models)
+    with stage_timer(timings, 'build_features'):
+        train_df = make_features(train_data, include_target=True, sales_fields=target_columns, dropna=False)
+        future_df = make_features(future_data, include_target=False, sales_fields=target_columns)
+    if train_df.empty or future_df.empty:
+        raise ValueError("Failed to create features")
+    
+    with stage_timer(timings, 'design_matrix'):
+        train_X, future_X = build_design_matrix(train_df, future_df, target_columns)
+        # 業態のコード表は同じ学習で作ったすべての共通モデルで共通
+        manifest = load_model_manifest(GLOBAL_STORE_ID, target_columns[0]) or {}
+        business_types = manifest.get('business_types', [])
+        train_X = add_store_features(train_X, store_id, profile, business_types)
+        future_X = add_store_features(future_X, store_id, profile, business_types)
+        feature_orders = {}
+        for sales_key, model in models.items():
+            feature_orders[sales_key] = get_model_feature_names(GLOBAL_STORE_ID, sales_key, model)
+            for col in feature_orders[sales_key]:
+                if col not in future_X.columns:
+                    train_X[col] = 0
+                    future_X[col] = 0
+    
+    with stage_timer(timings, 'model_predict'), span('model_predict', days=len(future_X), recursive=RECURSIVE_FORECAST, model='global'):
+        all_predictions = _predict_future(models, train_df, future_df, future_X, target_columns, feature_orders)
+    
+    predictions_list = [{'date': pred_date.isoformat()} for pred_date in future_df['date']]
+    metrics_dict = {}
+    for sales_key, model in models.items():
+        for i, value in enumerate(all_predictions[sales_key]):
+            predictions_list[i][sales_key] = int(max(0, value))
+        
+        # 評価: 共通モデルの学習時に保存したバックテストの指標（ない場合は評価なし）
+        global_manifest = load_model_manifest(GLOBAL_STORE_ID, sales_key) or {}
+        backtest = global_manifest.get('backtest')
+        metrics_dict[sales_key] = {
+            "mae": backtest['mae'] if backtest else None,
+            "r2": backtest['r2'] if backtest else None,
+            "mape": backtest['mape'] if backtest else None,
+            "feature_importance": {
+                col: float(importance)
+                for col, importance in zip(feature_orders[sales_key], model.feature_importances_)
+            },
+            "method": "lightgbm_global",
+            "evaluation": "backtest" if backtest else None,
+        }
+        if backtest:
+            metrics_dict[sales_key]["backtest"] = {
+                "n_folds": backtest['n_folds'],
+                "horizon_days": backtest['horizon_days'],
+                "rolling_features": backtest['rolling_features'],
+                "folds": backtest['folds'],
+                "trained_at": global_manifest.get('backtest_trained_at'),
+                "incremental_updates": 0,
+            }
+    
+    observe_stages(store_id, 'global', timings)
+    return {
+        'predictions': predictions_list,
+        'metrics': metrics_dict,
+        'sales_fields': sales_fields_list,
+        'model_status': 'global',
+    }
+
+def train_store_models(
+    store_id: int,
+    sales_fields_list: Optional[List[Dict]] = None,
+    data_fingerprint: Optional[str] = None,
+    backtest_workers: Optional[int] = None,
+    incremental: bool = INCREMENTAL_TRAINING,
+    memory: Optional[Dict[str, int]] = None
+) -> List[Dict]:
+    """
+    店舗のすべての売上項目のモデルを学習して保存（予測は行わない、オフライン学習用）
+    
+    学習データと特徴量は run_sales_prediction と同じ手順で作るため、
+    保存したモデルはそのまま予測リクエストで再利用される。
+    
+    Args:
+        store_id: 店舗ID
+        sales_fields_list: 取得済みの売上項目（Noneの場合はDBから取得）
+        data_fingerprint: 学習に使ったデータのフィンガープリント（マニフェストに記録）
+        backtest_workers: バックテストのプロセス数（Noneの場合は BACKTEST_WORKERS）
+        incremental: 保存済みのモデルを新しい行だけで増分学習するか（できない売上項目は全期間を学習）
+        memory: 指定した場合、読み込んだデータ・特徴量・特徴量行列のメモリ使用量（バイト）を書き込む
+    
+    Returns:
+        List[Dict]: 売上項目ごとの学習結果（sales_key, status（'trained' / 'updated' / 'skipped'）, seconds, rows, features, backtest_mae）
+    """
+    with db_connection():
+        if sales_fields_list is None:
+            sales_fields_list = get_sales_fields(store_id)
+        watermark = None
+        if data_fingerprint is None:
+            watermark = get_data_watermark(store_id)
+            data_fingerprint = watermark_fingerprint(watermark)
+        all_data = load_sales_data_incremental(store_id, watermark)
+    
+    sales_field_keys = [sf['key'] for sf in sales_fields_list]
+    sales_field_keys = [key for key in sales_field_keys if key.lower() not in ['netsales', 'net_sales', 'net sales']]
+    if not sales_field_keys:
+        raise ValueError(f"No sales fields found for store {store_id}")
+    if all_data.empty:
+        raise ValueError(f"No sales data found for store {store_id}")
+    
+    # 売上項目のいずれかが0でない日を学習データに含める（最初の売上項目で判定）
+    train_condition = pd.Series(True, index=all_data.index)
+    for sales_key in sales_field_keys:
+        if sales_key in all_data.columns:
+            train_condition = train_condition & (all_data[sales_key].fillna(0) > 0)
+            break
+    train_data = all_data[train_condition].copy()
+    
+    if train_data.empty:
+        raise ValueError(f"Insufficient training data for store {store_id}. Need at least some historical sales data.")
+    
+    # データが2か月未満の場合は予測時に移動平均を使うため、モデルは作らない
+    unique_months = pd.to_datetime(train_data['date']).dt.to_period('M').nunique()
+    if unique_months < 2:
+        return [
+            {'sales_key': key, 'status': 'skipped', 'reason': f'only {unique_months} month(s) of data'}
+            for key in sales_field_keys
+        ]
+    
+    train_df = make_features(train_data, include_target=True, sales_fields=sales_field_keys)
+    if train_df.empty:
+        raise ValueError("Failed to create features")
+    
+    target_columns = [col for col in sales_field_keys if col in train_df.columns]
+    train_X, _ = build_design_matrix(train_df, None, target_columns)
+    if memory is not None:
+        memory.update(memory_report(all_data=all_data, train_df=train_df, train_X=train_X))
+    
+    report = []
+    y_targets = {}
+    for sales_key in target_columns:
+        y_target = train_df[sales_key].fillna(0)
+        if len(y_target[y_target > 0]) < 10:
+            report.append({'sales_key': sales_key, 'status': 'skipped', 'reason': 'insufficient data'})
+            continue
+        y_targets[sales_key] = y_target
+    
+    timings = {}
+    new_rows = {}
+    if incremental:
+        for sales_key in y_targets:
+            started = time.perf_counter()
+            with span('model_update', sales_key=sales_key):
+                updated = _update_model(
+                    store_id, sales_key, train_X, y_targets[sales_key], train_df['date'], data_fingerprint
+                )
+            if updated is not None:
+                timings[sales_key] = time.perf_counter() - started
+                new_rows[sales_key] = updated[1]
+    
+    to_fit = [key for key in y_targets if key not in new_rows]
+    _fit_models(
+        store_id, to_fit, train_X, y_targets, train_df['date'], data_fingerprint, timings, backtest_workers,
+        history={key: train_df[key] for key in target_columns}, backtest=True,
+    )
+    for sales_key in y_targets:
+        manifest = load_model_manifest(store_id, sales_key) or {}
+        backtest = manifest.get('backtest') or {}
+        report.append({
+            'sales_key': sales_key,
+            'status': 'updated' if sales_key in new_rows else 'trained',
+            'seconds': timings[sales_key],
+            'rows': new_rows.get(sales_key, int(len(train_X))),
+            'features': int(train_X.shape[1]),
+            'backtest_mae': backtest.get('mae'),
+        })
+    return report
+
+def train_global_models(store_ids: Optional[List[int]] = None, force: bool = False) -> List[Dict]:
+    """
+    売上項目ごとに全店舗共通のモデルを1つ学習して保存（GLOBAL_MODEL の予測で使う）
+    
+    店舗ごとの特徴量行列（自店の売上項目のラグ・移動平均のみ）に店舗ID・業態・緯度・経度を
+    加えて全店舗分を積み上げ、1回だけ学習する。学習回数とモデル数は店舗数ではなく
+    売上項目数に比例する。
+    
+    Args:
+        store_ids: 学習に使う店舗ID（Noneの場合は売上データのある全店舗）
+        force: 前回の学習から店舗のデータが変わっていなくても学習するか
+    
+    Returns:
+        List[Dict]: 売上項目ごとの学習結果（sales_key, status（'trained' / 'unchanged'）, seconds, rows, stores, features, backtest_mae）
+    """
+    with db_connection():
+        if store_ids is None:
+            store_ids = get_all_store_ids()
+        sales_fields = get_sales_fields_bulk(store_ids)
+        profiles = get_store_profiles(store_ids)
+        watermarks = {store_id: get_data_watermark(store_id) for store_id in store_ids if store_id in profiles}
+    fingerprints = {store_id: watermark_fingerprint(watermark) for store_id, watermark in watermarks.items()}
+    data_fingerprint = combined_fingerprint(fingerprints)
+    business_types = business_type_codes(profile['business_type_id'] for profile in profiles.values())
+    
+    # 売上項目ごとの店舗の特徴量行列・目的変数・日付
+    parts: Dict[str, List[Tuple[pd.DataFrame, pd.Series, pd.Series]]] = {}
+    for store_id in fingerprints:
+        sales_field_keys = [
+            sf['key'] for sf in sales_fields[store_id]
+            if sf['key'].lower() not in ['netsales', 'net_sales', 'net sales']
+        ]
+        if not sales_field_keys:
+            continue
+        with db_connection():
+            all_data = load_sales_data_incremental(store_id, watermarks[store_id])
+        if all_data.empty:
+            continue
+        
+        # 売上項目のいずれかが0でない日を学習データに含める（最初の売上項目で判定）
+        train_condition = pd.Series(True, index=all_data.index)
+        for sales_key in sales_field_keys:
+            if sales_key in all_data.columns:
+                train_condition = train_condition & (all_data[sales_key].fillna(0) > 0)
+                break
+        train_df = make_features(all_data[train_condition], include_target=True, sales_fields=sales_field_keys)
+        if train_df.empty:
+            # ラグ・移動平均がそろう行のない店舗は学習に使わない（予測は共通モデルで行える）
+            continue
+        
+        target_columns = [col for col in sales_field_keys if col in train_df.columns]
+        train_X, _ = build_design_matrix(train_df, None, target_columns)
+        for sales_key in target_columns:
+            y_target = train_df[sales_key].fillna(0)
+            if len(y_target[y_target > 0]) < 10:
+                continue
+            X = add_store_features(
+                train_X[global_feature_columns(train_X.columns, sales_key, target_columns)],
+                store_id, profiles[store_id], business_types,
+            )
+            parts.setdefault(sales_key, []).append((X, y_target, train_df['date']))
+    
+    report = []
+    for sales_key, store_parts in parts.items():
+        manifest = load_model_manifest(GLOBAL_STORE_ID, sales_key) or {}
+        if not force and manifest.get('data_fingerprint') == data_fingerprint and model_exists(GLOBAL_STORE_ID, sales_key):
+            report.append({'sales_key': sales_key, 'status': 'unchanged'})
+            continue
+        
+        train_X = pd.concat([X for X, _, _ in store_parts], ignore_index=True)
+        y_target = pd.concat([y for _, y, _ in store_parts], ignore_index=True)
+        train_dates = pd.concat([dates for _, _, dates in store_parts], ignore_index=True)
+        print(f"[予測] 売上項目 {sales_key} の全店舗共通モデルを学習中（{len(store_parts)}店舗, {len(train_X)}行）...")
+        started = time.perf_counter()
+        with span('model_fit', sales_key=sales_key, rows=len(train_X), model='global'):
+            booster = fit_global_model(train_X, y_target, LGBM_PARAMS, LGBM_NUM_BOOST_ROUND)
+        training_seconds = time.perf_counter() - started
+        
+        # 予測リクエストで返す評価指標（予測時に学習データ全体を予測し直さない）
+        backtest = None
+        if BACKTEST_ENABLED:
+            try:
+                with span('backtest', sales_key=sales_key, model='global'):
+                    backtest = run_global_backtest(
+                        train_X, y_target, train_dates, sales_key, LGBM_PARAMS, LGBM_NUM_BOOST_ROUND
+                    )
+            except Exception as e:
+                print(f"[バックテストエラー] 全店舗共通モデル, 売上項目 {sales_key}: {e}")
+        
+        _save_fitted_model(
+            GLOBAL_STORE_ID, sales_key, NativeModel(booster), train_X, train_dates, training_seconds,
+            data_fingerprint, backtest, extra={
+                'scope': 'global',
+                'stores': sorted(int(store_id) for store_id in train_X['store_id'].unique()),
+                'business_types': business_types,
+            },
+        )
+        report.append({
+            'sales_key': sales_key,
+            'status': 'trained',
+            'seconds': training_seconds,
+            'rows': int(len(train_X)),
+            'stores': len(store_parts),
+            'features': int(train_X.shape[1]),
+            'backtest_mae': backtest['mae'] if backtest else None,
+        })
+    return report
@@ -7,23 +7,15 @@ from datetime import date, timedelta
 from typing import Dict, List, Tuple, Optional
 from lightgbm import LGBMRegressor
 from data_loader import load_sales_data, is_holiday_jp
+from calendar_features import calendar_features, EVENT_RULES
 from utils.sales_fields import get_sales_fields
 from utils.model_storage import save_model, load_model, model_exists, delete_model
 
 # イベント定義（売上に影響を与える特別な日）
+# 判定ロジックは calendar_features.EVENT_RULES に一本化している
 EVENTS = {
-    "valentine": lambda dt: dt.month == 2 and dt.day == 14,
-    "white_day": lambda dt: dt.month == 3 and dt.day == 14,
-    "mother_day": lambda dt: dt.month == 5 and dt.weekday() == 6 and 7 < dt.day <= 14,
-    "father_day": lambda dt: dt.month == 6 and dt.weekday() == 6 and 14 < dt.day <= 21,
-    "obon": lambda dt: dt.month == 8 and 13 <= dt.day <= 16,
-    "christmas_eve": lambda dt: dt.month == 12 and dt.day == 24,
-    "christmas": lambda dt: dt.month == 12 and dt.day == 25,
-    "new_year": lambda dt: dt.month == 1 and 1 <= dt.day <= 3,
-    "year_end": lambda dt: dt.month == 12 and 28 <= dt.day <= 31,
-    "golden_week": lambda dt: dt.month == 5 and 3 <= dt.day <= 5,
-    "school_graduation": lambda dt: dt.month == 3 and 1 <= dt.day <= 25,
-    "school_admission": lambda dt: dt.month == 4 and dt.day <= 10,
+    name: (lambda dt, rule=rule: bool(rule(dt.month, dt.day, dt.weekday())))
+    for name, rule in EVENT_RULES.items()
 }
 
 def get_event_features(dt) -> Dict[str, int]:
@@ -48,6 +40,9 @@ def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields:
     if sales_fields is None:
         sales_fields = ['edw_sales', 'ohb_sales']
 
+    # カレンダー特徴量（ベクトル化）
+    calendar = calendar_features(df['date'], extended=True, events=True)
+
     # 基本特徴量
     features_df = pd.DataFrame({
         'temperature': df['temperature'].fillna(0),
@@ -58,23 +53,23 @@ def make_features(df: pd.DataFrame, include_target: bool = False, sales_fields:
         'windspeed': df['windspeed'].fillna(0),
         'pressure': df['pressure'].fillna(0),
         'feelslike': df['feelslike'].fillna(0),
-        'weekday': df['date'].apply(lambda d: d.weekday()),
+        'weekday': calendar['weekday'],
         'is_holiday': df['is_holiday'].astype(int),
-        'month': df['date'].apply(lambda d: d.month),
-        'day': df['date'].apply(lambda d: d.day),
-        'is_month_start': df['date'].apply(lambda d: 1 if d.day == 1 else 0),
-        'is_month_end': df['date'].apply(lambda d: 1 if d.day == pd.Timestamp(d).days_in_month else 0),
-        'dayofyear': df['date'].apply(lambda d: d.timetuple().tm_yday),
+        'month': calendar['month'],
+        'day': calendar['day'],
+        'is_month_start': calendar['is_month_start'],
+        'is_month_end': calendar['is_month_end'],
+        'dayofyear': calendar['dayofyear'],
         # 追加特徴量
-        'week_of_month': df['date'].apply(lambda d: (d.day - 1) // 7 + 1),
-        'is_payday': df['date'].apply(lambda d: 1 if d.day == 25 or d.day == pd.Timestamp(d).days_in_month else 0),
-        'is_weekend': df['date'].apply(lambda d: 1 if d.weekday() >= 5 else 0),
+        'week_of_month': calendar['week_of_month'],
+        'is_payday': calendar['is_payday'],
+        'is_weekend': calendar['is_weekend'],
         'date': df['date'],
     })
 
     # イベント特徴量を追加
-    for event_name, event_func in EVENTS.items():
-        features_df[f'is_{event_name}'] = df['date'].apply(lambda d: int(event_func(d)))
+    for event_name in EVENT_RULES:
+        features_df[f'is_{event_name}'] = calendar[f'is_{event_name}']
 
     if include_target:
         for sales_key in sales_fields:
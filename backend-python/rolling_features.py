@@ -0,0 +1,121 @@
+"""予測期間のラグ・移動平均特徴量を1日ずつ作る（リングバッファによる再帰予測）"""
+import os
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+# 予測期間のラグ・移動平均特徴量を再帰的に作るか（falseの場合は従来どおり0で埋める）
+RECURSIVE_FORECAST = os.getenv('RECURSIVE_FORECAST', 'true').lower() not in ('0', 'false', 'no')
+
+# make_features の学習用特徴量と同じ定義（t日目の値は t-1 日目までの値から作る）
+MA_WINDOWS = (7, 90)
+LAGS = (7, 14)
+HISTORY_DAYS = max(max(MA_WINDOWS), max(LAGS))
+
+def rolling_feature_names(sales_key: str) -> List[str]:
+    """売上項目のラグ・移動平均特徴量の列名（make_features と同じ）"""
+    return [f'{sales_key}_ma{w}' for w in MA_WINDOWS] + [f'{sales_key}_lag{lag}' for lag in LAGS]
+
+class RollingFeaturizer:
+    """
+    売上項目ごとの直近 HISTORY_DAYS 日の値をリングバッファで保持し、
+    次の日のラグ・移動平均特徴量を O(売上項目数) で返す
+
+    移動平均は窓から出る値と入る値の差分で更新するため、予測日数によらず1日あたりの
+    計算量は一定。履歴が HISTORY_DAYS 日に満たない場合は、足りない分を履歴の平均で埋める。
+    """
+
+    def __init__(self, history: Dict[str, np.ndarray]):
+        """
+        Args:
+            history: 売上項目ごとの過去の値（古い順、学習データの目的変数と同じ行の並び）
+        """
+        self.sales_keys = list(history)
+        self._buffer = np.zeros((len(self.sales_keys), HISTORY_DAYS), dtype=np.float64)
+        for i, key in enumerate(self.sales_keys):
+            values = np.asarray(history[key], dtype=np.float64)[-HISTORY_DAYS:]
+            values = values[~np.isnan(values)]
+            fill = values.mean() if len(values) else 0.0
+            self._buffer[i, :HISTORY_DAYS - len(values)] = fill
+            self._buffer[i, HISTORY_DAYS - len(values):] = values
+        # 次に書き込む位置（= 最も古い値の位置）
+        self._pos = 0
+        self._sums = {w: self._buffer[:, -w:].sum(axis=1) for w in MA_WINDOWS}
+        self.feature_names = [name for key in self.sales_keys for name in rolling_feature_names(key)]
+
+    def _back(self, days: int) -> np.ndarray:
+        """days 日前の値（1 = 直前の日）"""
+        return self._buffer[:, (self._pos - days) % HISTORY_DAYS]
+
+    def features(self) -> np.ndarray:
+        """次の日の特徴量（feature_names の順）"""
+        columns = [self._sums[w] / w for w in MA_WINDOWS] + [self._back(lag) for lag in LAGS]
+        return np.column_stack(columns).ravel()
+
+    def moving_average(self, window: int = 7) -> np.ndarray:
+        """売上項目ごとの直近 window 日の平均（モデルのない売上項目の次の日の値に使う）"""
+        return self._sums[window] / window
+
+    def push(self, values: np.ndarray):
+        """1日分の値（sales_keys の順）を追加して1日進める"""
+        values = np.asarray(values, dtype=np.float64)
+        for w in MA_WINDOWS:
+            self._sums[w] += values - self._back(w)
+        self._buffer[:, self._pos] = values
+        self._pos = (self._pos + 1) % HISTORY_DAYS
+
+    def skip(self, days: int):
+        """
+        値のない days 日分を直近7日平均で埋めて進める
+
+        履歴の最後の日と予測開始日の間が空いている場合に、ラグ・移動平均が
+        予測開始日から数えた日数になるようにする。
+        """
+        for _ in range(days):
+            self.push(self.moving_average())
+
+def recursive_forecast(
+    models: Dict[str, object],
+    future_X: pd.DataFrame,
+    featurizer: RollingFeaturizer,
+    feature_orders: Optional[Dict[str, List[str]]] = None
+) -> Dict[str, np.ndarray]:
+    """
+    予測期間を1日ずつ予測し、その日の予測値を翌日以降のラグ・移動平均特徴量に使う
+
+    Args:
+        models: 売上項目ごとのモデル（LGBMRegressor または NativeModel）
+        future_X: 予測用の特徴量行列（ラグ・移動平均以外の列は作成済み）
+        featurizer: 予測開始日の前日までの値で初期化した RollingFeaturizer
+        feature_orders: モデルの特徴量の並びが future_X と異なる売上項目の列順
+
+    Returns:
+        Dict: 売上項目ごとの予測値（future_X の行順）
+    """
+    feature_orders = feature_orders or {}
+    # 1行ずつ取り出して予測するため行優先（C順）で持つ（列優先だとLightGBMが行ごとにコピーする）
+    X = np.ascontiguousarray(future_X.to_numpy(dtype=np.float64, copy=True))
+    names = list(featurizer.feature_names)
+    present = [i for i, name in enumerate(names) if name in future_X.columns]
+    rolling_columns = [future_X.columns.get_loc(names[i]) for i in present]
+    model_columns = {
+        key: [future_X.columns.get_loc(col) for col in feature_orders[key]] if key in feature_orders else None
+        for key in models
+    }
+    key_index = {key: i for i, key in enumerate(featurizer.sales_keys)}
+
+    predictions = {key: np.zeros(len(X)) for key in models}
+    for step in range(len(X)):
+        X[step, rolling_columns] = featurizer.features()[present]
+        # モデルのない売上項目は直近7日平均がそのまま続くとする
+        next_values = featurizer.moving_average()
+        for key, model in models.items():
+            row = X[step:step + 1]
+            if model_columns[key] is not None:
+                row = row[:, model_columns[key]]
+            value = float(model.booster_.predict(row)[0])
+            predictions[key][step] = value
+            if key in key_index:
+                next_values[key_index[key]] = value
+        featurizer.push(next_values)
+    return predictions
@@ -0,0 +1,52 @@
+"""calendar_features.py の祝日判定（祝日法の特例・振替休日・国民の休日）"""
+from datetime import date
+import numpy as np
+import pandas as pd
+import pytest
+from calendar_features import holiday_flags, is_holiday, japanese_holidays
+
+@pytest.mark.parametrize('day, name', [
+    # 2019年の即位関連（4/30・5/2 は前後が祝日の国民の休日）
+    (date(2019, 4, 30), '国民の休日'),
+    (date(2019, 5, 1), '天皇の即位の日'),
+    (date(2019, 5, 2), '国民の休日'),
+    (date(2019, 5, 6), '振替休日'),
+    (date(2019, 10, 22), '即位礼正殿の儀の行われる日'),
+    # 東京オリンピックに伴う移動
+    (date(2020, 7, 23), '海の日'),
+    (date(2020, 7, 24), 'スポーツの日'),
+    (date(2020, 8, 10), '山の日'),
+    (date(2021, 7, 22), '海の日'),
+    (date(2021, 7, 23), 'スポーツの日'),
+    (date(2021, 8, 8), '山の日'),
+    (date(2021, 8, 9), '振替休日'),
+    # 秋分の日（9/22）が日曜日
+    (date(2024, 9, 23), '振替休日'),
+    # 敬老の日（9/21）と秋分の日（9/23）に挟まれた日
+    (date(2026, 9, 22), '国民の休日'),
+])
+def test_special_holidays(day, name):
+    assert japanese_holidays(day.year).get(day) == name
+    assert is_holiday(day)
+    assert holiday_flags([day])[0]
+
+@pytest.mark.parametrize('day', [
+    # 移動前の日付
+    date(2020, 7, 20), date(2020, 8, 11), date(2020, 10, 12),
+    date(2021, 7, 19), date(2021, 8, 11), date(2021, 10, 11),
+    # 2019年以降は12/23は祝日でない
+    date(2019, 12, 23), date(2020, 12, 23), date(2024, 12, 23),
+])
+def test_moved_or_abolished_days(day):
+    assert not is_holiday(day)
+    assert not holiday_flags([day])[0]
+
+def test_emperor_birthday_before_2019():
+    assert japanese_holidays(2018).get(date(2018, 12, 23)) == '天皇誕生日'
+    assert not any(d.month == 12 and d.day == 23 for year in range(2019, 2030) for d in japanese_holidays(year))
+
+def test_out_of_range_and_missing_dates():
+    dates = pd.Series([pd.Timestamp('1999-01-01'), pd.Timestamp('2100-01-01'), pd.NaT, pd.Timestamp('2024-01-01')])
+    np.testing.assert_array_equal(holiday_flags(dates), [False, False, False, True])
+    assert not is_holiday(date(1999, 1, 1))
+    assert not is_holiday(date(2100, 1, 1))
@@ -0,0 +1,65 @@
+"""main.py のミドルウェアとクライアント切断の扱い"""
+import asyncio
+import json
+import time
+import main
+
+def _call(scope_path: str, body: dict, disconnect: bool):
+    """ASGIアプリを直接呼び出し、送信されたメッセージを返す（disconnect の場合は本文の後に切断を返す）"""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': scope_path,
+        'raw_path': scope_path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'host', b'test')],
+        'client': ('127.0.0.1', 1234),
+        'server': ('test', 80),
+    }
+    payload = json.dumps(body).encode()
+    received = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': payload, 'more_body': False}
+        if disconnect:
+            return {'type': 'http.disconnect'}
+        await asyncio.sleep(3600)
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(main.app(scope, receive, send))
+    return sent
+
+def _response_start(sent):
+    return next(m for m in sent if m['type'] == 'http.response.start')
+
+def test_disconnected_client_cancels_prediction(monkeypatch):
+    def slow_prediction(**kwargs):
+        time.sleep(1.5)
+        return {'predictions': [], 'metrics': {}, 'model_status': 'reused'}
+
+    monkeypatch.setattr(main, 'run_sales_prediction', slow_prediction)
+    started = time.perf_counter()
+    start = _response_start(_call('/predict', {'store_id': 1}, disconnect=True))
+    assert start['status'] == 499
+    # 予測の完了を待たずに返す
+    assert time.perf_counter() - started < 1.5
+
+def test_trace_id_header(monkeypatch):
+    monkeypatch.setattr(
+        main, 'run_sales_prediction',
+        lambda **kwargs: {'predictions': [], 'metrics': {}, 'model_status': 'reused'},
+    )
+    start = _response_start(_call('/predict', {'store_id': 1}, disconnect=False))
+    assert start['status'] == 200
+    headers = dict(start['headers'])
+    assert len(headers[b'x-trace-id']) == 32
@@ -0,0 +1,36 @@
+"""predictor.py の予測期間のラグ・移動平均特徴量"""
+import numpy as np
+import pandas as pd
+import pytest
+import predictor
+from rolling_features import rolling_feature_names
+
+class _LagModel:
+    """lag7 の列の値をそのまま予測値とするモデル（booster_.predict のみ）"""
+
+    def __init__(self, column: int):
+        self.booster_ = self
+        self._column = column
+
+    def predict(self, row):
+        return row[:, self._column]
+
+@pytest.mark.parametrize('as_date', [False, True])
+@pytest.mark.parametrize('gap_days', [0, 3])
+def test_lag_features_count_from_start_date(monkeypatch, gap_days, as_date):
+    monkeypatch.setattr(predictor, 'RECURSIVE_FORECAST', True)
+    dates = pd.date_range('2024-01-01', periods=120, freq='D')
+    start = dates[-1] + pd.Timedelta(days=gap_days + 1)
+    future_dates = pd.date_range(start, periods=3, freq='D')
+    # make_features の date 列は datetime.date の場合がある
+    train_df = pd.DataFrame({'date': dates.date if as_date else dates, 'sales': np.arange(len(dates), dtype=float)})
+    future_df = pd.DataFrame({'date': future_dates.date if as_date else future_dates})
+    columns = rolling_feature_names('sales')
+    future_X = pd.DataFrame(0.0, index=future_df.index, columns=columns)
+    model = _LagModel(columns.index('sales_lag7'))
+
+    predictions = predictor._predict_future({'sales': model}, train_df, future_df, future_X, ['sales'], {})
+
+    # 予測開始日の7日前の売上（売上データの最終日から数えると gap_days 日ずれる）
+    expected = float((start - pd.Timedelta(days=7) - dates[0]).days)
+    assert predictions['sales'][0] == expected
@@ -0,0 +1,276 @@
+"""
+全店舗・全売上項目のモデルをまとめて学習するコマンド（夜間バッチ用）
+
+使い方:
+    python train_models.py                    # データが変わった店舗だけ学習
+    python train_models.py --stores 1 2 3     # 店舗を指定
+    python train_models.py --force            # データが変わっていなくても学習
+    python train_models.py --full             # 増分学習せず全期間で学習し直す
+    python train_models.py --workers 4 --threads 2 --report report.json
+    python train_models.py --stores 1 --backtest-workers 4   # 1店舗のバックテストを並列に実行
+    python train_models.py --global           # 売上項目ごとの全店舗共通モデルを学習（GLOBAL_MODEL 用）
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from data_loader import get_all_store_ids, get_data_fingerprint
+from predictor import INCREMENTAL_TRAINING, train_global_models, train_store_models
+from utils.database import db_connection, close_pool
+from utils.executor import limit_worker_threads
+from utils.model_storage import MODELS_DIR, ensure_models_dir, model_exists
+from utils.sales_fields import get_sales_fields_bulk
+
+# 学習の設定（コマンドライン引数で上書き可能）
+TRAINING_WORKERS = int(os.getenv('TRAINING_WORKERS', os.cpu_count() or 1))
+TRAINING_THREADS = int(os.getenv('TRAINING_THREADS', 0))  # 0の場合は CPU数 / ワーカー数
+
+# 店舗ごとの前回学習時のデータのフィンガープリントと学習済みの売上項目
+TRAINING_STATE_PATH = MODELS_DIR / 'training_state.json'
+
+def _sales_keys(sales_fields_list: List[Dict]) -> List[str]:
+    """学習対象の売上項目キー（店舗純売上を除く）"""
+    return [
+        sf['key'] for sf in sales_fields_list
+        if sf['key'].lower() not in ['netsales', 'net_sales', 'net sales']
+    ]
+
+def load_training_state() -> Dict[str, Dict]:
+    """前回の学習状態を読み込み（{店舗ID: {'data_fingerprint', 'sales_keys', 'trained_keys', 'trained_at'}}）"""
+    try:
+        with open(TRAINING_STATE_PATH, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_training_state(state: Dict[str, Dict]):
+    """学習状態を保存（一時ファイルに書いてから置き換える）"""
+    ensure_models_dir()
+    tmp_path = TRAINING_STATE_PATH.with_suffix('.json.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, TRAINING_STATE_PATH)
+
+def is_store_up_to_date(store_id: int, sales_fields_list: List[Dict], data_fingerprint: str,
+                        state: Dict[str, Dict]) -> bool:
+    """前回の学習からデータ・売上項目が変わっておらず、学習済みのモデルが残っているか"""
+    entry = state.get(str(store_id))
+    if not entry:
+        return False
+    if entry.get('data_fingerprint') != data_fingerprint or entry.get('sales_keys') != _sales_keys(sales_fields_list):
+        return False
+    return all(model_exists(store_id, key) for key in entry.get('trained_keys', []))
+
+def _train_store(store_id: int, sales_fields_list: List[Dict], data_fingerprint: str,
+                 backtest_workers: Optional[int] = None, incremental: bool = INCREMENTAL_TRAINING) -> Dict:
+    """ワーカープロセスで1店舗のモデルを学習（例外は店舗ごとのエラーとして返す）"""
+    started = time.perf_counter()
+    try:
+        memory = {}
+        models = train_store_models(
+            store_id, sales_fields_list, data_fingerprint, backtest_workers, incremental, memory
+        )
+        return {
+            'store_id': store_id,
+            'status': 'trained',
+            'seconds': time.perf_counter() - started,
+            'models': models,
+            'memory': memory,
+        }
+    except Exception as e:
+        return {
+            'store_id': store_id,
+            'status': 'failed',
+            'seconds': time.perf_counter() - started,
+            'error': str(e),
+        }
+
+def train_all(
+    store_ids: Optional[List[int]] = None,
+    workers: int = TRAINING_WORKERS,
+    threads: int = TRAINING_THREADS,
+    force: bool = False,
+    backtest_workers: Optional[int] = None,
+    incremental: bool = INCREMENTAL_TRAINING
+) -> Dict:
+    """
+    複数店舗のモデルをプロセスプールで並列に学習
+
+    Args:
+        store_ids: 店舗IDのリスト（Noneの場合は売上データのある全店舗）
+        workers: 同時に学習する店舗数（ワーカープロセス数）
+        threads: ワーカーごとのLightGBMのスレッド数（0の場合は CPU数 / ワーカー数）
+        force: データが変わっていない店舗も学習するか
+        backtest_workers: 店舗ごとのバックテストのプロセス数（Noneの場合は BACKTEST_WORKERS）
+        incremental: 保存済みのモデルを新しい行だけで増分学習するか（FULL_REBUILD_DAYS ごとと
+            特徴量が変わった場合は全期間で学習し直す）
+
+    Returns:
+        Dict: 店舗ごとの学習結果と全体の所要時間
+    """
+    started = time.perf_counter()
+    workers = max(1, workers)
+    threads = threads if threads > 0 else max(1, (os.cpu_count() or 1) // workers)
+
+    with db_connection():
+        if store_ids is None:
+            store_ids = get_all_store_ids()
+        sales_fields = get_sales_fields_bulk(store_ids)
+        fingerprints = {}
+        failures = {}
+        for store_id in store_ids:
+            try:
+                fingerprints[store_id] = get_data_fingerprint(store_id)
+            except ValueError as e:
+                failures[store_id] = str(e)
+
+    state = load_training_state()
+    stores = []
+    tasks = []
+    for store_id in store_ids:
+        if store_id in failures:
+            stores.append({'store_id': store_id, 'status': 'failed', 'seconds': 0.0, 'error': failures[store_id]})
+            _print_store_result(stores[-1])
+        elif not force and is_store_up_to_date(store_id, sales_fields[store_id], fingerprints[store_id], state):
+            stores.append({'store_id': store_id, 'status': 'unchanged', 'seconds': 0.0})
+        else:
+            tasks.append((store_id, sales_fields[store_id], fingerprints[store_id], backtest_workers, incremental))
+
+    unchanged = sum(1 for store in stores if store['status'] == 'unchanged')
+    print(f"[一括学習] 対象 {len(tasks)}店舗（変更なしでスキップ: {unchanged}店舗）, "
+          f"ワーカー {workers}, スレッド {threads}/ワーカー")
+
+    if tasks:
+        # DB接続などを親から引き継がないようspawnで起動する
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=limit_worker_threads,
+            initargs=(threads,),
+        ) as pool:
+            futures = [pool.submit(_train_store, *task) for task in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                stores.append(result)
+                _print_store_result(result)
+                if result['status'] == 'trained':
+                    store_id = result['store_id']
+                    state[str(store_id)] = {
+                        'data_fingerprint': fingerprints[store_id],
+                        'sales_keys': _sales_keys(sales_fields[store_id]),
+                        'trained_keys': [
+                            m['sales_key'] for m in result['models'] if m['status'] in ('trained', 'updated')
+                        ],
+                        'trained_at': datetime.now().isoformat(),
+                    }
+                    # 途中で中断しても完了した店舗は次回スキップできるよう都度保存する
+                    save_training_state(state)
+
+    stores.sort(key=lambda s: store_ids.index(s['store_id']))
+    return {
+        'stores': stores,
+        'workers': workers,
+        'threads': threads,
+        'elapsed_seconds': time.perf_counter() - started,
+    }
+
+def _print_store_result(result: Dict):
+    """店舗ごとの学習結果を表示"""
+    store_id = result['store_id']
+    if result['status'] == 'failed':
+        print(f"[一括学習] 店舗ID {store_id}: 失敗 ({result['seconds']:.1f}秒) {result['error']}")
+        return
+    print(f"[一括学習] 店舗ID {store_id}: 完了 ({result['seconds']:.1f}秒)")
+    memory = result.get('memory')
+    if memory:
+        # 型の縮小（COMPACT_DTYPES）の効果を店舗ごとに確認できるよう内訳を表示する
+        detail = ', '.join(f"{name} {size / 1024:.0f}KB" for name, size in memory.items() if name != 'total')
+        print(f"    メモリ: {memory['total'] / 1024:.0f}KB ({detail})")
+    for model in result['models']:
+        if model['status'] == 'trained':
+            backtest = f", バックテストMAE {model['backtest_mae']:.0f}" if model.get('backtest_mae') is not None else ''
+            print(f"    {model['sales_key']}: {model['seconds']:.2f}秒, "
+                  f"{model['rows']}行, {model['features']}特徴量{backtest}")
+        elif model['status'] == 'updated':
+            print(f"    {model['sales_key']}: 増分学習 {model['seconds']:.2f}秒, 新しい行 {model['rows']}行")
+        else:
+            print(f"    {model['sales_key']}: スキップ ({model['reason']})")
+
+def _main_global(args: argparse.Namespace) -> int:
+    """--global: 全店舗共通モデルを学習して結果を表示"""
+    started = time.perf_counter()
+    try:
+        models = train_global_models(args.stores, force=args.force)
+    finally:
+        close_pool()
+
+    for model in models:
+        if model['status'] == 'trained':
+            backtest = f", バックテストMAE {model['backtest_mae']:.0f}" if model.get('backtest_mae') is not None else ''
+            print(f"[一括学習] 共通モデル {model['sales_key']}: {model['seconds']:.2f}秒, "
+                  f"{model['stores']}店舗, {model['rows']}行, {model['features']}特徴量{backtest}")
+        else:
+            print(f"[一括学習] 共通モデル {model['sales_key']}: 変更なし")
+    n_models = sum(1 for model in models if model['status'] == 'trained')
+    elapsed = time.perf_counter() - started
+    print(f"[一括学習] 完了: 共通モデル {n_models}モデル（変更なし {len(models) - n_models}モデル） ({elapsed:.1f}秒)")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'models': models, 'elapsed_seconds': elapsed}, f, ensure_ascii=False, indent=2)
+    return 0
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='全店舗の売上予測モデルを一括で学習する')
+    parser.add_argument('--stores', type=int, nargs='+', help='学習する店舗ID（省略時は売上データのある全店舗）')
+    parser.add_argument('--workers', type=int, default=TRAINING_WORKERS, help='同時に学習する店舗数')
+    parser.add_argument('--threads', type=int, default=TRAINING_THREADS,
+                        help='ワーカーごとのスレッド数（0の場合は CPU数 / ワーカー数）')
+    parser.add_argument('--force', action='store_true', help='データが変わっていない店舗も学習する')
+    parser.add_argument('--full', action='store_true',
+                        help='増分学習せず全期間で学習し直す（省略時は INCREMENTAL_TRAINING に従う）')
+    parser.add_argument('--backtest-workers', type=int,
+                        help='店舗ごとのバックテストのプロセス数（省略時は BACKTEST_WORKERS）')
+    parser.add_argument('--global', dest='global_model', action='store_true',
+                        help='店舗ごとのモデルの代わりに売上項目ごとの全店舗共通モデルを学習する')
+    parser.add_argument('--report', help='学習結果をJSONで書き出すファイル')
+    args = parser.parse_args(argv)
+
+    if args.global_model:
+        return _main_global(args)
+
+    try:
+        summary = train_all(
+            args.stores, workers=args.workers, threads=args.threads, force=args.force,
+            backtest_workers=args.backtest_workers,
+            incremental=INCREMENTAL_TRAINING and not args.full,
+        )
+    finally:
+        close_pool()
+
+    counts = {}
+    for store in summary['stores']:
+        counts[store['status']] = counts.get(store['status'], 0) + 1
+    n_models = sum(
+        1 for store in summary['stores'] for model in store.get('models', []) if model['status'] == 'trained'
+    )
+    n_updated = sum(
+        1 for store in summary['stores'] for model in store.get('models', []) if model['status'] == 'updated'
+    )
+    print(f"[一括学習] 完了: 学習 {counts.get('trained', 0)}店舗（{n_models}モデル, 増分学習 {n_updated}モデル）, "
+          f"変更なし {counts.get('unchanged', 0)}店舗, 失敗 {counts.get('failed', 0)}店舗 "
+          f"({summary['elapsed_seconds']:.1f}秒)")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    return 1 if counts.get('failed') else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
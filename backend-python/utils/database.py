@@ -1,11 +1,25 @@
 """データベース接続ユーティリティ"""
+import io
 import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import pandas as pd
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
+from utils.metrics import observe_query, query_kind
+from utils.tracing import span
 
 load_dotenv()
 
+# コネクションプール設定
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))  # 接続待ちの上限（秒）
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv('DB_POOL_HEALTHCHECK_INTERVAL', 30))  # アイドル接続の再検証間隔（秒）
+
 def get_db_password():
     """データベースパスワードを取得（DB_PASSWORD_FILEまたはDB_PASSWORDから）"""
     password_file = os.getenv('DB_PASSWORD_FILE')
@@ -14,48 +28,322 @@ def get_db_password():
             return f.read().strip()
     return os.getenv('DB_PASSWORD', '')
 
+# 接続に成功したホスト（以降はフォールバックを試さずに使う）
+_resolved_host: Optional[str] = None
+
 def get_db_connection():
     """PostgreSQLデータベース接続を取得"""
+    global _resolved_host
     db_host = os.getenv('DB_HOST', 'management-db')
     db_port = int(os.getenv('DB_PORT', 5432))
     db_name = os.getenv('DB_NAME', 'shift_management')
     db_user = os.getenv('DB_USER', 'postgres')
     db_password = get_db_password()
-    
+
     # 複数のホスト名を試す（フォールバック）
     hosts_to_try = [db_host]
     if db_host == 'postgres':
         hosts_to_try.append('management-db')
     elif db_host == 'management-db':
         hosts_to_try.append('postgres')
-    
+    if _resolved_host in hosts_to_try:
+        hosts_to_try.remove(_resolved_host)
+        hosts_to_try.insert(0, _resolved_host)
+
     last_error = None
     for host in hosts_to_try:
         try:
-            return psycopg2.connect(
+            conn = psycopg2.connect(
                 host=host,
                 port=db_port,
                 database=db_name,
                 user=db_user,
                 password=db_password
             )
+            _resolved_host = host
+            return conn
         except psycopg2.OperationalError as e:
             last_error = e
             continue
-    
+
     # すべてのホストで失敗した場合
     raise psycopg2.OperationalError(f"Could not connect to database. Tried hosts: {hosts_to_try}. Last error: {last_error}")
 
-def execute_query(query, params=None):
-    """クエリを実行して結果を取得"""
-    conn = get_db_connection()
+class ConnectionPool:
+    """
+    プロセス全体で共有するPostgreSQLコネクションプール
+
+    - min_size本の接続を事前に確保し、max_size本まで必要に応じて増やす
+    - 上限に達した場合はtimeout秒まで返却を待つ
+    - 一定時間アイドルだった接続は貸し出し前に SELECT 1 で検証する
+    """
+
+    def __init__(self, min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 timeout: float = DB_POOL_TIMEOUT,
+                 healthcheck_interval: float = DB_POOL_HEALTHCHECK_INTERVAL):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.healthcheck_interval = healthcheck_interval
+        self._cond = threading.Condition()
+        self._idle = []  # [(connection, 返却時刻)]
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+        # メトリクス
+        self._acquire_count = 0
+        self._acquire_time_total = 0.0
+        self._acquire_time_max = 0.0
+        self._timeouts = 0
+        self._connections_created = 0
+        self._connections_discarded = 0
+
+        for _ in range(min_size):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = get_db_connection()
+        # 1クエリ1トランザクションで扱い、プール内にトランザクションを残さない
+        conn.autocommit = True
+        self._connections_created += 1
+        return conn
+
+    def _discard(self, conn):
+        self._connections_discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.healthcheck_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """接続を借りる（上限到達時はtimeout秒まで待機）"""
+        started = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise psycopg2.InterfaceError("Connection pool is closed")
+            self._waiting += 1
+            try:
+                while not self._idle and self._in_use >= self.max_size:
+                    remaining = self.timeout - (time.monotonic() - started)
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if not self._idle and self._in_use >= self.max_size:
+                            self._timeouts += 1
+                            raise psycopg2.OperationalError(
+                                f"Timed out after {self.timeout}s waiting for a database connection "
+                                f"(pool max_size={self.max_size})"
+                            )
+                    if self._closed:
+                        raise psycopg2.InterfaceError("Connection pool is closed")
+            finally:
+                self._waiting -= 1
+            entry = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        # 接続の作成・検証はロックの外で行う
+        try:
+            conn = None
+            if entry is not None:
+                idle_conn, idle_since = entry
+                if self._is_healthy(idle_conn, idle_since):
+                    conn = idle_conn
+                else:
+                    self._discard(idle_conn)
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._acquire_count += 1
+            self._acquire_time_total += elapsed
+            self._acquire_time_max = max(self._acquire_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn, discard: bool = False):
+        """接続を返却する（壊れた接続は破棄）"""
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed or len(self._idle) >= self.max_size:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """プール内のアイドル接続をすべて閉じる"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        """プールのメトリクスを取得"""
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'acquire_count': self._acquire_count,
+                'acquire_timeouts': self._timeouts,
+                'acquire_latency_avg_ms': (
+                    self._acquire_time_total / self._acquire_count * 1000 if self._acquire_count else 0.0
+                ),
+                'acquire_latency_max_ms': self._acquire_time_max * 1000,
+                'connections_created': self._connections_created,
+                'connections_discarded': self._connections_discarded,
+            }
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+# スレッドごとに貸し出し中の接続（db_connectionのネスト時に共有する）
+_local = threading.local()
+
+def get_pool() -> ConnectionPool:
+    """プロセス共有のコネクションプールを取得（初回呼び出し時に作成）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def close_pool():
+    """コネクションプールを閉じる（アプリケーション終了時）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+def get_pool_stats() -> Optional[Dict]:
+    """コネクションプールのメトリクスを取得（未作成の場合はNone）"""
+    return _pool.stats() if _pool is not None else None
+
+@contextmanager
+def db_connection():
+    """
+    プールから接続を借りるコンテキストマネージャ
+
+    同じスレッド内でネストした場合は外側の接続をそのまま使うため、
+    リクエスト全体を with db_connection(): で囲むと、その中の
+    execute_query はすべて1本の接続を共有する。
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+
+    pool = get_pool()
+    conn = pool.getconn()
+    _local.conn = conn
+    broken = False
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query, params)
-            if cur.description:
-                return cur.fetchall()
-            conn.commit()
-            return []
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
     finally:
-        conn.close()
+        _local.conn = None
+        pool.putconn(conn, discard=broken)
+
+@contextmanager
+def read_snapshot():
+    """
+    ブロック内のクエリを1つのスナップショット（REPEATABLE READ の読み取り専用トランザクション）で実行
+
+    プールの接続は autocommit のため、続けて実行した複数のクエリはそれぞれ別の時点の
+    データを見る。結果を突き合わせるクエリ（同じ日の集合を前提とする など）はこの中で実行する。
+    すでにトランザクション中の場合はそのまま使う。
+    """
+    with db_connection() as conn:
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            yield conn
+            return
+        with conn.cursor() as cur:
+            cur.execute("BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        try:
+            yield conn
+        finally:
+            # 読み取り専用のため、例外の有無によらず終了するだけでよい
+            if not conn.closed:
+                with conn.cursor() as cur:
+                    cur.execute("ROLLBACK")
+
+def execute_query(query, params=None) -> List[Dict]:
+    """クエリを実行して結果を取得（所要時間はクエリの種類ごとにメトリクスとスパンに記録）"""
+    kind = query_kind(query)
+    with db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur, span('db.query', kind=kind) as query_span:
+            started = time.perf_counter()
+            try:
+                cur.execute(query, params)
+                rows = cur.fetchall() if cur.description else []
+                query_span.set_attribute('rows', len(rows))
+                return rows
+            finally:
+                observe_query(kind, time.perf_counter() - started)
+
+def fetch_frame(query, params=None, dtypes: Optional[Dict[str, str]] = None,
+                parse_dates: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    クエリの結果を COPY ... TO STDOUT（CSV）で受け取り、列ごとの配列としてDataFrameにする
+
+    execute_query のように1行ごとのdictを作らず、CSVのバイト列をpandasのCパーサーで
+    型付きの列に直接変換する。メモリ使用量は行数 x 列数のPythonオブジェクトではなく、
+    CSVのバイト列と結果の列の分で済む。
+
+    NULLと空文字列は欠損（NaN）になる（'NA' などの文字列はそのまま）。booleanは 't' / 'f' を変換する。
+
+    Args:
+        query: SELECT文（パラメータは execute_query と同じ形式）
+        dtypes: 列ごとの型（'float64', 'int64', 'bool', 'category' など、指定しない列は推定）
+        parse_dates: datetime64として読み込む列
 
+    Returns:
+        DataFrame: クエリの列をそのまま列とする（結果が0行でも列は作る）
+    """
+    kind = query_kind(query)
+    with db_connection() as conn:
+        with conn.cursor() as cur, span('db.query', kind=kind, copy=True) as query_span, \
+                io.BytesIO() as buffer:
+            started = time.perf_counter()
+            try:
+                sql = cur.mogrify(query, params).decode(psycopg2.extensions.encodings[conn.encoding])
+                cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+                buffer.seek(0)
+                frame = pd.read_csv(
+                    buffer, dtype=dtypes, parse_dates=parse_dates or False,
+                    keep_default_na=False, na_values=[''], true_values=['t'], false_values=['f'],
+                )
+                query_span.set_attribute('rows', len(frame))
+                return frame
+            finally:
+                observe_query(kind, time.perf_counter() - started)
@@ -0,0 +1,45 @@
+"""DataFrameの型の縮小とメモリ使用量の集計"""
+import os
+from typing import Dict, Iterable
+import numpy as np
+import pandas as pd
+
+# 売上・天気を float32、カレンダー・フラグを int8/uint8、天気の種類を category で持つか
+# （float32 は 16,777,216 までの整数を正確に表せるため、日次の売上額はそのまま保持できる）
+COMPACT_DTYPES = os.getenv('COMPACT_DTYPES', 'false').lower() in ('1', 'true', 'yes')
+
+# category にする文字列の列
+CATEGORICAL_COLUMNS = ('weather',)
+
+def compact_frame(df: pd.DataFrame, exclude: Iterable[str] = ('date',)) -> pd.DataFrame:
+    """
+    列の型を値の範囲に合わせて縮小したDataFrameを返す
+
+    float64 は float32 に、整数は値が収まる最小の整数型（負の値がなければ符号なし）に、
+    CATEGORICAL_COLUMNS の文字列は category にする。bool と exclude の列はそのまま。
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if col in exclude:
+            columns[col] = values
+        elif values.dtype == np.float64:
+            columns[col] = values.astype(np.float32)
+        elif pd.api.types.is_integer_dtype(values.dtype) and len(values):
+            downcast = 'unsigned' if values.min() >= 0 else 'integer'
+            columns[col] = pd.to_numeric(values, downcast=downcast)
+        elif col in CATEGORICAL_COLUMNS and values.dtype == object:
+            columns[col] = values.astype('category')
+        else:
+            columns[col] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """DataFrameのメモリ使用量（バイト、文字列・categoryの中身を含む）"""
+    return int(df.memory_usage(deep=True).sum())
+
+def memory_report(**frames: pd.DataFrame) -> Dict[str, int]:
+    """名前ごとのメモリ使用量（バイト）と合計（'total'）"""
+    report = {name: memory_usage(frame) for name, frame in frames.items() if frame is not None}
+    report['total'] = sum(report.values())
+    return report
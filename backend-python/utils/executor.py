@@ -0,0 +1,213 @@
+"""予測・学習処理をイベントループ外で実行するための実行器"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+from utils.tracing import TraceContext, get_trace_context, use_trace_context
+
+# 実行器設定
+PREDICTION_EXECUTOR = os.getenv('PREDICTION_EXECUTOR', 'thread')  # 'thread' または 'process'
+PREDICTION_WORKERS = int(os.getenv('PREDICTION_WORKERS', 2))
+PREDICTION_QUEUE_SIZE = int(os.getenv('PREDICTION_QUEUE_SIZE', 16))  # 実行中を含む受付上限
+DISCONNECT_POLL_INTERVAL = 0.5  # クライアント切断の確認間隔（秒）
+
+_thread_limits = None  # ワーカープロセス内のスレッド数制限（参照を保持する）
+
+class QueueFullError(Exception):
+    """実行待ちキューが上限に達している"""
+
+class RequestCancelledError(Exception):
+    """クライアントが切断したため処理を取り消した"""
+
+def limit_worker_threads(threads: int):
+    """
+    ワーカープロセスのBLAS/OpenMP（LightGBM・NumPy）のスレッド数を制限する
+
+    複数のワーカープロセスが全コアを使おうとして過剰にスレッドを作らないよう、
+    プロセスプールの initializer として使う。threadpoolctl は読み込み済みのライブラリ
+    だけを制限するため、spawn したワーカーではNumPy・LightGBMを先に読み込む。
+    """
+    import lightgbm  # noqa: F401
+    import numpy  # noqa: F401
+    from threadpoolctl import threadpool_limits
+    global _thread_limits
+    _thread_limits = threadpool_limits(limits=threads)
+
+def _timed_call(fn: Callable, args: tuple, kwargs: dict, trace_context: Optional[TraceContext] = None):
+    """
+    ワーカー側で開始時刻を記録して関数を実行（プロセス間でも待ち時間を計測できるよう時刻を返す）
+
+    投入元のトレースを引き継ぎ、ワーカー内のスパンも同じトレースに記録する。
+    """
+    started_at = time.time()
+    with use_trace_context(trace_context):
+        return started_at, fn(*args, **kwargs)
+
+class BoundedExecutor:
+    """
+    上限付きキューを持つスレッド/プロセスプール
+
+    - 受付数（実行中 + 待機中）が queue_size を超える投入は QueueFullError
+    - 開始前に取り消された処理は実行されない
+    - 待機数・待ち時間などのメトリクスを stats() で取得できる
+    """
+
+    def __init__(self, kind: str = PREDICTION_EXECUTOR, max_workers: int = PREDICTION_WORKERS,
+                 queue_size: int = PREDICTION_QUEUE_SIZE):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_size = max(queue_size, max_workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        # メトリクス
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._cancelled = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._run_time_total = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                # DB接続などを親から引き継がないようspawnで起動する
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix='prediction',
+                )
+        return self._executor
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """処理を投入する（結果は関数の戻り値）"""
+        with self._lock:
+            if self._outstanding >= self.queue_size:
+                self._rejected += 1
+                raise QueueFullError(
+                    f"Prediction queue is full ({self._outstanding}/{self.queue_size})"
+                )
+            self._outstanding += 1
+            self._submitted += 1
+
+        submitted_at = time.time()
+        result_future = Future()
+        try:
+            inner = self._get_executor().submit(_timed_call, fn, args, kwargs, get_trace_context())
+        except Exception:
+            with self._lock:
+                self._outstanding -= 1
+            raise
+
+        def _on_done(f: Future):
+            finished_at = time.time()
+            with self._lock:
+                self._outstanding -= 1
+                if f.cancelled():
+                    self._cancelled += 1
+                elif f.exception() is not None:
+                    self._failed += 1
+                else:
+                    started_at, _ = f.result()
+                    wait = max(0.0, started_at - submitted_at)
+                    self._completed += 1
+                    self._wait_time_total += wait
+                    self._wait_time_max = max(self._wait_time_max, wait)
+                    self._run_time_total += finished_at - started_at
+            if result_future.cancelled():
+                # 実行開始後に呼び出し側が取り消した場合は結果を捨てる
+                return
+            if f.cancelled():
+                result_future.cancel()
+            elif f.exception() is not None:
+                result_future.set_exception(f.exception())
+            else:
+                result_future.set_result(f.result()[1])
+
+        # 呼び出し側の取り消しを内部のFutureに伝える（開始前なら実行されない）
+        result_future.add_done_callback(lambda f: f.cancelled() and inner.cancel())
+        inner.add_done_callback(_on_done)
+        return result_future
+
+    async def run(self, request, fn: Callable, *args, **kwargs):
+        """
+        処理を投入して完了を待つ
+
+        Args:
+            request: FastAPIのRequest（Noneの場合は切断を確認しない）
+            fn: 実行する関数
+        """
+        future = self.submit(fn, *args, **kwargs)
+        awaitable = asyncio.wrap_future(future)
+        try:
+            while True:
+                done, _ = await asyncio.wait({awaitable}, timeout=DISCONNECT_POLL_INTERVAL)
+                if done:
+                    return awaitable.result()
+                if request is not None and await request.is_disconnected():
+                    future.cancel()
+                    raise RequestCancelledError("Client disconnected before prediction finished")
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+
+    def stats(self) -> Dict:
+        """実行器のメトリクスを取得"""
+        with self._lock:
+            running = min(self._outstanding, self.max_workers)
+            return {
+                'kind': self.kind,
+                'max_workers': self.max_workers,
+                'queue_size': self.queue_size,
+                'running': running,
+                'queued': self._outstanding - running,
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'cancelled': self._cancelled,
+                'wait_time_avg_ms': (
+                    self._wait_time_total / self._completed * 1000 if self._completed else 0.0
+                ),
+                'wait_time_max_ms': self._wait_time_max * 1000,
+                'run_time_avg_ms': (
+                    self._run_time_total / self._completed * 1000 if self._completed else 0.0
+                ),
+            }
+
+    def shutdown(self):
+        """未開始の処理を取り消して終了する"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+_prediction_executor: Optional[BoundedExecutor] = None
+
+def get_prediction_executor() -> BoundedExecutor:
+    """予測用の実行器を取得（初回呼び出し時に作成）"""
+    global _prediction_executor
+    if _prediction_executor is None:
+        _prediction_executor = BoundedExecutor()
+    return _prediction_executor
+
+def get_executor_stats() -> Optional[Dict]:
+    """予測用実行器のメトリクスを取得（未作成の場合はNone）"""
+    return _prediction_executor.stats() if _prediction_executor is not None else None
+
+def shutdown_prediction_executor():
+    """予測用の実行器を終了する"""
+    global _prediction_executor
+    if _prediction_executor is not None:
+        _prediction_executor.shutdown()
+        _prediction_executor = None
@@ -0,0 +1,111 @@
+"""予測結果のキャッシュ（LRU + TTL）"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, Optional, Tuple
+
+# キャッシュ設定
+FORECAST_CACHE_SIZE = int(os.getenv('FORECAST_CACHE_SIZE', 256))  # 保持する（店舗, 開始日）の数
+FORECAST_CACHE_TTL = float(os.getenv('FORECAST_CACHE_TTL', 600))  # 有効期間（秒）
+
+class ForecastCache:
+    """
+    run_sales_prediction の結果キャッシュ
+
+    キーは（店舗ID, 予測開始日）で、予測日数・版（モデルファイルの更新日時と
+    データのフィンガープリント）と一緒に保持する。版が一致すれば、
+    より長い予測日数の結果を切り出して短い予測日数の要求にも応える。
+    """
+
+    def __init__(self, max_entries: int = FORECAST_CACHE_SIZE, ttl: float = FORECAST_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[int, date], Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # メトリクス
+        self._hits = 0
+        self._slice_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def get(self, store_id: int, start_date: date, predict_days: int, version: Tuple) -> Optional[Dict]:
+        """キャッシュから予測結果を取得（なければNone）"""
+        key = (store_id, start_date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['version'] != version or entry['predict_days'] < predict_days:
+                self._misses += 1
+                return None
+            if entry['expires_at'] <= time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry['predict_days'] == predict_days:
+                self._hits += 1
+                return entry['result']
+            self._slice_hits += 1
+            return self._slice(entry['result'], start_date, predict_days)
+
+    def put(self, store_id: int, start_date: date, predict_days: int, version: Tuple, result: Dict):
+        """予測結果を保存（同じ版でより長い予測日数の結果がある場合はそちらを残す）"""
+        key = (store_id, start_date)
+        with self._lock:
+            current = self._entries.get(key)
+            if (
+                current is not None
+                and current['version'] == version
+                and current['predict_days'] > predict_days
+                and current['expires_at'] > time.monotonic()
+            ):
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = {
+                'predict_days': predict_days,
+                'version': version,
+                'result': result,
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, store_id: Optional[int] = None):
+        """店舗のキャッシュを削除（Noneの場合はすべて）"""
+        with self._lock:
+            keys = [k for k in self._entries if store_id is None or k[0] == store_id]
+            for key in keys:
+                del self._entries[key]
+            self._invalidations += len(keys)
+
+    @staticmethod
+    def _slice(result: Dict, start_date: date, predict_days: int) -> Dict:
+        end_date = (start_date + timedelta(days=predict_days - 1)).isoformat()
+        sliced = dict(result)
+        sliced['predictions'] = [p for p in result['predictions'] if p['date'] <= end_date]
+        return sliced
+
+    def stats(self) -> Dict:
+        """キャッシュのメトリクスを取得"""
+        with self._lock:
+            lookups = self._hits + self._slice_hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self._hits,
+                'slice_hits': self._slice_hits,
+                'misses': self._misses,
+                'hit_rate': (self._hits + self._slice_hits) / lookups if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'invalidations': self._invalidations,
+            }
+
+forecast_cache = ForecastCache()
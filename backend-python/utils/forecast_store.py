@@ -0,0 +1,104 @@
+"""事前計算した予測結果の保存・取得（マイグレーション018の sales_forecasts テーブル）"""
+import json
+import os
+from datetime import date, datetime
+from typing import Dict, List, Optional
+from utils.database import execute_query
+
+# 予測リクエストを sales_forecasts の事前計算の結果から返すか
+FORECAST_TABLE = os.getenv('FORECAST_TABLE', 'false').lower() in ('1', 'true', 'yes')
+
+def load_forecast(store_id: int, start_date: date, predict_days: int, model_version: str) -> Optional[Dict]:
+    """
+    事前計算した予測結果を主キーの1回の検索で取得
+
+    開始日が同じで予測日数が要求以上、かつ現在のモデルファイルの版で計算した結果があれば
+    返す（予測日数が長い場合は先頭を切り出す）。店舗の売上・天気が更新された結果は
+    トリガーで削除されるため、ここではデータの鮮度を調べない。
+
+    Args:
+        model_version: 現在のモデルファイルの版（predictor.model_fingerprint）
+
+    Returns:
+        Dict: {'predictions', 'metrics'}（ない・モデルが変わった場合はNone）
+    """
+    rows = execute_query("""
+        SELECT predictions, metrics
+        FROM sales_forecasts
+        WHERE store_id = %(store_id)s AND start_date = %(start_date)s
+        AND predict_days >= %(predict_days)s AND model_version = %(model_version)s
+    """, {'store_id': store_id, 'start_date': start_date, 'predict_days': predict_days,
+          'model_version': model_version})
+    if not rows:
+        return None
+    return {'predictions': rows[0]['predictions'][:predict_days], 'metrics': rows[0]['metrics']}
+
+def get_forecast_versions(store_ids: List[int], start_date: date, predict_days: int) -> Dict[int, str]:
+    """店舗ごとの保存済みの予測結果の版（開始日が同じで予測日数が指定以上のもの）"""
+    rows = execute_query("""
+        SELECT store_id, version FROM sales_forecasts
+        WHERE store_id = ANY(%s) AND start_date = %s AND predict_days >= %s
+    """, (list(store_ids), start_date, predict_days))
+    return {row['store_id']: row['version'] for row in rows}
+
+def save_forecasts(forecasts: List[Dict], start_date: date, predict_days: int, data_as_of: datetime) -> int:
+    """
+    予測結果をまとめて保存（同じ店舗・開始日の結果は置き換える）
+
+    data_as_of 以降に売上・天気が更新された店舗の結果は保存しない（読み込んだ後の更新は
+    トリガーでは消せないため、書き込み時に調べる）。
+
+    Args:
+        forecasts: {'store_id', 'version', 'model_version', 'predictions', 'metrics'} のリスト
+        data_as_of: 予測に使ったデータを読み込む前のDBの時刻
+
+    Returns:
+        int: 保存した店舗数
+    """
+    if not forecasts:
+        return 0
+    rows = execute_query("""
+        INSERT INTO sales_forecasts
+            (store_id, start_date, predict_days, predictions, metrics, version, model_version, data_as_of)
+        SELECT f.store_id, %(start_date)s, %(predict_days)s, f.predictions, f.metrics, f.version, f.model_version,
+            %(data_as_of)s
+        FROM unnest(%(store_ids)s::int[], %(predictions)s::jsonb[], %(metrics)s::jsonb[], %(versions)s::text[],
+                    %(model_versions)s::text[])
+            AS f(store_id, predictions, metrics, version, model_version)
+        JOIN stores s ON s.id = f.store_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM sales_data d WHERE d.store_id = f.store_id AND d.updated_at > %(data_as_of)s)
+        AND NOT EXISTS (
+            SELECT 1 FROM weather_data w
+            WHERE w.latitude = s.latitude AND w.longitude = s.longitude AND w.updated_at > %(data_as_of)s)
+        ON CONFLICT (store_id, start_date) DO UPDATE SET
+            predict_days = EXCLUDED.predict_days,
+            predictions = EXCLUDED.predictions,
+            metrics = EXCLUDED.metrics,
+            version = EXCLUDED.version,
+            model_version = EXCLUDED.model_version,
+            data_as_of = EXCLUDED.data_as_of,
+            computed_at = NOW()
+        RETURNING store_id
+    """, {
+        'start_date': start_date,
+        'predict_days': predict_days,
+        'data_as_of': data_as_of,
+        'store_ids': [f['store_id'] for f in forecasts],
+        'predictions': [json.dumps(f['predictions'], ensure_ascii=False) for f in forecasts],
+        'metrics': [json.dumps(f['metrics'], ensure_ascii=False) for f in forecasts],
+        'versions': [f['version'] for f in forecasts],
+        'model_versions': [f['model_version'] for f in forecasts],
+    })
+    return len(rows)
+
+def delete_forecasts(store_ids: Optional[List[int]] = None, before: Optional[date] = None):
+    """予測結果を削除（store_ids の店舗、または開始日が before より前のもの）"""
+    if store_ids is not None:
+        execute_query("DELETE FROM sales_forecasts WHERE store_id = ANY(%s)", (list(store_ids),))
+    if before is not None:
+        execute_query("DELETE FROM sales_forecasts WHERE start_date < %s", (before,))
+
+def database_now() -> datetime:
+    """DBの現在時刻（売上・天気の updated_at と比べるため、サーバーの時計ではなくDBの時刻を使う）"""
+    return execute_query("SELECT NOW() AS now")[0]['now']
@@ -0,0 +1,88 @@
+"""店舗ごとの学習用データ（1日1行のDataFrame）のディスクキャッシュ"""
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import pandas as pd
+from utils.model_storage import MODELS_DIR
+
+# キャッシュ保存ディレクトリ（モデル保存ディレクトリの下）
+FRAMES_DIR = MODELS_DIR / 'frames'
+
+# キャッシュを使うか（FRAME_CACHE_ENABLED=false で無効化）
+FRAME_CACHE_ENABLED = os.getenv('FRAME_CACHE_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+# 店舗ごとの更新処理を直列化するためのロック
+_store_locks: Dict[int, threading.Lock] = {}
+_store_locks_guard = threading.Lock()
+
+def ensure_frames_dir():
+    """キャッシュ保存ディレクトリが存在することを確認"""
+    FRAMES_DIR.mkdir(parents=True, exist_ok=True)
+
+def get_frame_paths(store_id: int) -> Tuple[Path, Path]:
+    """キャッシュファイル（Parquet）とメタデータ（JSON）のパスを取得"""
+    ensure_frames_dir()
+    return FRAMES_DIR / f"store_{store_id}.parquet", FRAMES_DIR / f"store_{store_id}.json"
+
+def get_store_lock(store_id: int) -> threading.Lock:
+    """店舗ごとのロックを取得"""
+    with _store_locks_guard:
+        if store_id not in _store_locks:
+            _store_locks[store_id] = threading.Lock()
+        return _store_locks[store_id]
+
+def load_frame(store_id: int) -> Tuple[Optional[pd.DataFrame], Optional[Dict]]:
+    """
+    キャッシュを読み込み
+
+    Returns:
+        (DataFrame, メタデータ)（存在しない・読めない場合は (None, None)）
+    """
+    try:
+        frame_path, meta_path = get_frame_paths(store_id)
+        if not frame_path.exists() or not meta_path.exists():
+            return None, None
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        df = pd.read_parquet(frame_path)
+        return df, meta
+    except Exception as e:
+        print(f"[データキャッシュ読み込みエラー] 店舗ID {store_id}: {e}")
+        return None, None
+
+def save_frame(store_id: int, df: pd.DataFrame, meta: Dict) -> bool:
+    """
+    キャッシュを保存（一時ファイルに書いてから置き換える）
+
+    Returns:
+        bool: 保存成功かどうか
+    """
+    try:
+        frame_path, meta_path = get_frame_paths(store_id)
+        # プロセスプールで並行して書き込まれても壊れないよう一時ファイル名にPIDを含める
+        tmp_frame = frame_path.with_suffix(f'.parquet.{os.getpid()}.tmp')
+        tmp_meta = meta_path.with_suffix(f'.json.{os.getpid()}.tmp')
+        df.to_parquet(tmp_frame, index=False)
+        with open(tmp_meta, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_frame, frame_path)
+        os.replace(tmp_meta, meta_path)
+        return True
+    except Exception as e:
+        print(f"[データキャッシュ保存エラー] 店舗ID {store_id}: {e}")
+        return False
+
+def delete_frame(store_id: int) -> bool:
+    """キャッシュを削除"""
+    try:
+        deleted = False
+        for path in get_frame_paths(store_id):
+            if path.exists():
+                path.unlink()
+                deleted = True
+        return deleted
+    except Exception as e:
+        print(f"[データキャッシュ削除エラー] 店舗ID {store_id}: {e}")
+        return False
@@ -0,0 +1,99 @@
+"""Prometheusメトリクス（/metrics で公開する）"""
+import os
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest,
+)
+
+# レイテンシのバケット（秒）: 数ミリ秒のクエリから数十秒の学習までを1つのバケット定義で扱う
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DB_QUERY_SECONDS = Histogram(
+    'sales_db_query_duration_seconds',
+    'Duration of database queries by query kind',
+    ['kind'],
+    buckets=LATENCY_BUCKETS,
+)
+PREDICTION_STAGE_SECONDS = Histogram(
+    'sales_prediction_stage_duration_seconds',
+    'Duration of prediction stages (load_data, build_features, model_load, model_fit, model_predict)',
+    ['stage', 'store', 'model'],
+    buckets=LATENCY_BUCKETS,
+)
+PREDICT_REQUEST_SECONDS = Histogram(
+    'sales_predict_request_duration_seconds',
+    'End-to-end latency of /predict requests',
+    ['endpoint', 'store', 'model'],
+    buckets=LATENCY_BUCKETS,
+)
+FEATURE_MISMATCH_RETRAINS = Counter(
+    'sales_feature_mismatch_retrains_total',
+    'Models retrained because their features did not match the request data',
+    ['store'],
+)
+
+_QUERY_TABLE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+([A-Za-z_][A-Za-z0-9_.]*)', re.IGNORECASE)
+
+def query_kind(query: str) -> str:
+    """クエリの種類（先頭の命令と最初のテーブル名、例: select_sales_data）"""
+    words = query.split(None, 1)
+    verb = words[0].lower() if words else 'unknown'
+    if verb == 'with':
+        verb = 'select'
+    match = _QUERY_TABLE.search(query)
+    return f"{verb}_{match.group(1).split('.')[-1].lower()}" if match else verb
+
+def observe_query(kind: str, seconds: float):
+    """DBクエリの所要時間を記録（kind は query_kind の値）"""
+    DB_QUERY_SECONDS.labels(kind=kind).observe(seconds)
+
+@contextmanager
+def stage_timer(timings: Dict[str, List[float]], stage: str):
+    """
+    処理の所要時間を段階ごとに集める（モデルの学習・再利用が決まった後で observe_stages に渡す）
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.setdefault(stage, []).append(time.perf_counter() - started)
+
+def observe_stages(store_id: int, model_status: str, timings: Dict[str, List[float]]):
+    """
+    集めた段階ごとの所要時間を記録
+
+    Args:
+        model_status: 'trained'（学習した）/ 'reused'（既存モデルを使用）/ 'fallback'（移動平均）
+    """
+    for stage, values in timings.items():
+        histogram = PREDICTION_STAGE_SECONDS.labels(stage=stage, store=str(store_id), model=model_status)
+        for seconds in values:
+            histogram.observe(seconds)
+
+def observe_predict_request(endpoint: str, store_id: int, model_status: str, seconds: float):
+    """/predict のエンドツーエンドの所要時間を記録（model_status はエラーの場合 'error'）"""
+    PREDICT_REQUEST_SECONDS.labels(endpoint=endpoint, store=str(store_id), model=model_status).observe(seconds)
+
+def count_feature_mismatch_retrain(store_id: int):
+    """特徴量の不一致による再学習を数える"""
+    FEATURE_MISMATCH_RETRAINS.labels(store=str(store_id)).inc()
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Prometheusのテキスト形式でメトリクスを出力
+
+    PREDICTION_EXECUTOR=process などで複数プロセスから記録する場合は、起動前に
+    PROMETHEUS_MULTIPROC_DIR を設定すると全プロセスの値をまとめて出力する。
+
+    Returns:
+        (本文, Content-Type)
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -1,9 +1,19 @@
 """モデル保存・読み込みユーティリティ"""
+import json
 import os
 import pickle
+import platform
+import threading
+from collections import OrderedDict
+from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import sklearn
 from lightgbm import LGBMRegressor
+from utils.tracing import span
 
 # モデル保存ディレクトリ（Dockerコンテナ内とホストの両方に対応）
 # 環境変数で指定されていない場合は、実行環境に応じて自動選択
@@ -13,89 +23,296 @@ if os.path.exists('/app/models'):
 else:
     MODELS_DIR = Path(__file__).parent.parent / 'models'  # ホスト環境
 
+# モデルの保存形式: 'pickle'（LGBMRegressorをpickle）または 'native'（LightGBMのテキスト形式）
+MODEL_STORAGE_FORMAT = os.getenv('MODEL_STORAGE_FORMAT', 'pickle')
+
+# メモリ上のモデルキャッシュ設定（件数とファイルサイズ合計の両方で上限を設ける）
+MODEL_CACHE_SIZE = int(os.getenv('MODEL_CACHE_SIZE', 128))
+MODEL_CACHE_MAX_BYTES = int(os.getenv('MODEL_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+
+# (store_id, sales_key) -> (ファイルの更新日時, ファイルサイズ, モデル)
+_model_cache: "OrderedDict[Tuple[int, str], Tuple[float, int, LGBMRegressor]]" = OrderedDict()
+_model_cache_lock = threading.Lock()
+_model_cache_bytes = 0
+_model_cache_counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+def _cache_get(key: Tuple[int, str], mtime: float) -> Optional[LGBMRegressor]:
+    with _model_cache_lock:
+        entry = _model_cache.get(key)
+        if entry is None or entry[0] != mtime:
+            _model_cache_counters['misses'] += 1
+            return None
+        _model_cache.move_to_end(key)
+        _model_cache_counters['hits'] += 1
+        return entry[2]
+
+def _cache_put(key: Tuple[int, str], mtime: float, size: int, model: LGBMRegressor):
+    global _model_cache_bytes
+    with _model_cache_lock:
+        if key in _model_cache:
+            _model_cache_bytes -= _model_cache.pop(key)[1]
+        if size > MODEL_CACHE_MAX_BYTES or MODEL_CACHE_SIZE <= 0:
+            return
+        _model_cache[key] = (mtime, size, model)
+        _model_cache_bytes += size
+        while len(_model_cache) > MODEL_CACHE_SIZE or _model_cache_bytes > MODEL_CACHE_MAX_BYTES:
+            _, (_, evicted_size, _) = _model_cache.popitem(last=False)
+            _model_cache_bytes -= evicted_size
+            _model_cache_counters['evictions'] += 1
+
+def invalidate_model_cache(store_id: Optional[int] = None, sales_key: Optional[str] = None):
+    """メモリ上のモデルキャッシュを破棄（引数なしの場合はすべて）"""
+    global _model_cache_bytes
+    with _model_cache_lock:
+        keys = [
+            k for k in _model_cache
+            if (store_id is None or k[0] == store_id) and (sales_key is None or k[1] == sales_key)
+        ]
+        for key in keys:
+            _model_cache_bytes -= _model_cache.pop(key)[1]
+        _model_cache_counters['invalidations'] += len(keys)
+
+def get_model_cache_stats() -> Dict:
+    """メモリ上のモデルキャッシュのメトリクスを取得"""
+    with _model_cache_lock:
+        lookups = _model_cache_counters['hits'] + _model_cache_counters['misses']
+        return {
+            'entries': len(_model_cache),
+            'bytes': _model_cache_bytes,
+            'max_entries': MODEL_CACHE_SIZE,
+            'max_bytes': MODEL_CACHE_MAX_BYTES,
+            **_model_cache_counters,
+            'hit_rate': _model_cache_counters['hits'] / lookups if lookups else 0.0,
+        }
+
 def ensure_models_dir():
     """モデル保存ディレクトリが存在することを確認"""
     MODELS_DIR.mkdir(parents=True, exist_ok=True)
 
+def _safe_key(sales_key: str) -> str:
+    # ファイル名に使用できない文字を置換
+    return sales_key.replace('/', '_').replace('\\', '_')
+
 def get_model_path(store_id: int, sales_key: str) -> Path:
-    """モデルファイルのパスを取得"""
+    """モデルファイル（pickle形式）のパスを取得"""
     ensure_models_dir()
-    # ファイル名に使用できない文字を置換
-    safe_key = sales_key.replace('/', '_').replace('\\', '_')
-    return MODELS_DIR / f"store_{store_id}_{safe_key}.pkl"
+    return MODELS_DIR / f"store_{store_id}_{_safe_key(sales_key)}.pkl"
 
-def save_model(store_id: int, sales_key: str, model: LGBMRegressor) -> bool:
+def get_native_model_path(store_id: int, sales_key: str) -> Path:
+    """モデルファイル（LightGBMネイティブ形式）のパスを取得"""
+    ensure_models_dir()
+    return MODELS_DIR / f"store_{store_id}_{_safe_key(sales_key)}.txt"
+
+def get_manifest_path(store_id: int, sales_key: str) -> Path:
+    """モデルのマニフェスト（学習時の特徴量スキーマなど）のパスを取得"""
+    ensure_models_dir()
+    return MODELS_DIR / f"store_{store_id}_{_safe_key(sales_key)}.json"
+
+def _find_model_file(store_id: int, sales_key: str) -> Optional[Path]:
+    """保存済みのモデルファイルを探す（MODEL_STORAGE_FORMATの形式を優先）"""
+    paths = [get_native_model_path(store_id, sales_key), get_model_path(store_id, sales_key)]
+    if MODEL_STORAGE_FORMAT != 'native':
+        paths.reverse()
+    for path in paths:
+        if path.exists():
+            return path
+    return None
+
+class NativeModel:
+    """
+    LightGBMネイティブ形式から読み込んだBoosterを、予測処理から
+    LGBMRegressorと同じ属性（predict, n_features_, feature_importances_）で使うためのラッパー
+    """
+
+    def __init__(self, booster: lgb.Booster):
+        self.booster_ = booster
+
+    @property
+    def n_features_(self) -> int:
+        return self.booster_.num_feature()
+
+    @property
+    def feature_name_(self) -> List[str]:
+        return self.booster_.feature_name()
+
+    @property
+    def feature_importances_(self) -> np.ndarray:
+        # LGBMRegressorのデフォルト（importance_type='split'）と同じ値
+        return self.booster_.feature_importance(importance_type='split')
+
+    def predict(self, X) -> np.ndarray:
+        return self.booster_.predict(X)
+
+def _library_versions() -> Dict[str, str]:
+    return {
+        'python': platform.python_version(),
+        'lightgbm': lgb.__version__,
+        'scikit-learn': sklearn.__version__,
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+    }
+
+def save_model(store_id: int, sales_key: str, model: LGBMRegressor, manifest: Optional[Dict] = None) -> bool:
     """
     モデルを保存
     
+    MODEL_STORAGE_FORMAT='native' の場合はBoosterをLightGBMのテキスト形式で、
+    それ以外はLGBMRegressorをpickleで保存する。どちらの場合もマニフェスト（JSON）を
+    一緒に保存する。
+    
     Args:
         store_id: 店舗ID
         sales_key: 売上項目のキー
         model: LightGBMモデル
+        manifest: 学習時の情報（feature_names, feature_dtypes, train_start, train_end, n_rows, training_seconds など）
     
     Returns:
         bool: 保存成功かどうか
     """
     try:
         ensure_models_dir()
-        model_path = get_model_path(store_id, sales_key)
-        with open(model_path, 'wb') as f:
-            pickle.dump(model, f)
+        invalidate_model_cache(store_id, sales_key)
+        if MODEL_STORAGE_FORMAT == 'native':
+            model_path = get_native_model_path(store_id, sales_key)
+            stale_path = get_model_path(store_id, sales_key)
+            with span('model_storage.save', sales_key=sales_key, format='native'):
+                model.booster_.save_model(str(model_path))
+            cached_model = NativeModel(model.booster_)
+        else:
+            model_path = get_model_path(store_id, sales_key)
+            stale_path = get_native_model_path(store_id, sales_key)
+            with span('model_storage.save', sales_key=sales_key, format='pickle'), open(model_path, 'wb') as f:
+                pickle.dump(model, f)
+            cached_model = model
+        # もう一方の形式の古いファイルが残っていると読み込み時に混ざるため削除
+        if stale_path.exists():
+            stale_path.unlink()
+        
+        full_manifest = {
+            'format': MODEL_STORAGE_FORMAT,
+            'feature_names': list(model.feature_name_),
+            'n_features': int(model.n_features_),
+            'saved_at': datetime.now().isoformat(),
+            'versions': _library_versions(),
+        }
+        full_manifest.update(manifest or {})
+        with open(get_manifest_path(store_id, sales_key), 'w') as f:
+            json.dump(full_manifest, f, ensure_ascii=False, indent=2)
+        
+        # 保存したモデルはそのままメモリ上のキャッシュに載せる
+        stat = model_path.stat()
+        _cache_put((store_id, sales_key), stat.st_mtime, stat.st_size, cached_model)
         print(f"[モデル保存] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを保存: {model_path}")
         return True
     except Exception as e:
         print(f"[モデル保存エラー] 店舗ID {store_id}, 売上項目 {sales_key}: {e}")
         return False
 
-def load_model(store_id: int, sales_key: str) -> Optional[LGBMRegressor]:
+def load_model(store_id: int, sales_key: str) -> Optional[Union[LGBMRegressor, NativeModel]]:
     """
-    モデルを読み込み
+    モデルを読み込み（ファイルの更新日時が同じ間はメモリ上のキャッシュを返す）
     
     Args:
         store_id: 店舗ID
         sales_key: 売上項目のキー
     
     Returns:
-        LGBMRegressor: モデル（存在しない場合はNone）
+        LGBMRegressor または NativeModel: モデル（存在しない場合はNone）
     """
     try:
-        model_path = get_model_path(store_id, sales_key)
-        if not model_path.exists():
+        model_path = _find_model_file(store_id, sales_key)
+        if model_path is None:
+            invalidate_model_cache(store_id, sales_key)
             return None
         
-        with open(model_path, 'rb') as f:
-            model = pickle.load(f)
+        # ファイルの更新日時が変わっていなければメモリ上のモデルを使う
+        stat = model_path.stat()
+        model = _cache_get((store_id, sales_key), stat.st_mtime)
+        if model is not None:
+            return model
+        
+        with span('model_storage.load', sales_key=sales_key, bytes=stat.st_size):
+            if model_path.suffix == '.txt':
+                model = NativeModel(lgb.Booster(model_file=str(model_path)))
+            else:
+                with open(model_path, 'rb') as f:
+                    model = pickle.load(f)
+        _cache_put((store_id, sales_key), stat.st_mtime, stat.st_size, model)
         print(f"[モデル読み込み] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを読み込み: {model_path}")
         return model
     except Exception as e:
         print(f"[モデル読み込みエラー] 店舗ID {store_id}, 売上項目 {sales_key}: {e}")
         return None
 
+def load_model_manifest(store_id: int, sales_key: str) -> Optional[Dict]:
+    """モデルのマニフェストを読み込み（存在しない場合はNone）"""
+    try:
+        manifest_path = get_manifest_path(store_id, sales_key)
+        if not manifest_path.exists():
+            return None
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[マニフェスト読み込みエラー] 店舗ID {store_id}, 売上項目 {sales_key}: {e}")
+        return None
+
+def get_model_feature_names(store_id: int, sales_key: str, model) -> Optional[List[str]]:
+    """
+    モデルの学習時の特徴量名（順序どおり）を取得
+
+    マニフェストがあればその値を、なければモデル自身の特徴量名を返す。
+    LightGBMが列名を置き換えている（自動生成の Column_0 など）場合はNone。
+    """
+    manifest = load_model_manifest(store_id, sales_key)
+    if manifest and manifest.get('feature_names'):
+        return manifest['feature_names']
+    names = list(getattr(model, 'feature_name_', []) or [])
+    if not names or names[0] == 'Column_0':
+        return None
+    return names
+
 def model_exists(store_id: int, sales_key: str) -> bool:
     """モデルが存在するか確認"""
-    model_path = get_model_path(store_id, sales_key)
-    return model_path.exists()
+    return _find_model_file(store_id, sales_key) is not None
 
 def get_model_last_modified(store_id: int, sales_key: str) -> Optional[float]:
     """モデルの最終更新日時を取得（Unixタイムスタンプ）"""
     try:
-        model_path = get_model_path(store_id, sales_key)
-        if not model_path.exists():
+        model_path = _find_model_file(store_id, sales_key)
+        if model_path is None:
             return None
         return model_path.stat().st_mtime
     except Exception:
         return None
 
 def delete_model(store_id: int, sales_key: str) -> bool:
-    """モデルを削除"""
+    """モデルを削除（両方の形式のファイルとマニフェスト）"""
     try:
-        model_path = get_model_path(store_id, sales_key)
-        if model_path.exists():
-            model_path.unlink()
+        invalidate_model_cache(store_id, sales_key)
+        deleted = False
+        for path in (
+            get_model_path(store_id, sales_key),
+            get_native_model_path(store_id, sales_key),
+            get_manifest_path(store_id, sales_key),
+        ):
+            if path.exists():
+                path.unlink()
+                deleted = True
+        if deleted:
             print(f"[モデル削除] 店舗ID {store_id}, 売上項目 {sales_key} のモデルを削除")
-            return True
-        return False
+        return deleted
     except Exception as e:
         print(f"[モデル削除エラー] 店舗ID {store_id}, 売上項目 {sales_key}: {e}")
         return False
 
+def get_store_model_versions(store_id: int) -> Dict[str, float]:
+    """店舗の全モデルファイルの最終更新日時を取得（ファイル名 -> Unixタイムスタンプ）"""
+    try:
+        ensure_models_dir()
+        return {
+            path.name: path.stat().st_mtime
+            for path in sorted(MODELS_DIR.glob(f"store_{store_id}_*"))
+            if path.suffix in ('.pkl', '.txt')
+        }
+    except Exception:
+        return {}
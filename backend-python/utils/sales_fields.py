@@ -1,10 +1,243 @@
 """売上項目の取得ユーティリティ"""
-from typing import List, Dict
+import os
+import threading
+import time
+from typing import List, Dict, Iterable, Optional, Tuple
 from utils.database import execute_query
+from utils.tracing import traced
 
+# キャッシュ設定（業態のフィールド設定が変わった場合は invalidate_sales_fields で破棄する）
+SALES_FIELDS_CACHE_TTL = float(os.getenv('SALES_FIELDS_CACHE_TTL', 300))  # 有効期間（秒）
+
+def _default_sales_fields() -> List[Dict[str, str]]:
+    """デフォルトの売上項目"""
+    return [
+        {'key': 'edwNetSales', 'label': 'EDW純売上'},
+        {'key': 'ohbNetSales', 'label': 'OHB純売上'},
+    ]
+
+def _sales_fields_from_config(fields) -> List[Dict[str, str]]:
+    """business_type_fields のフィールド設定から売上項目を抽出"""
+    sales_fields = []
+    if isinstance(fields, list):
+        for field in fields:
+            # labelに「売上」が含まれる、またはcategoryが'sales'の項目を抽出
+            label = field.get('label', '')
+            category = field.get('category', '')
+            key = field.get('key', '')
+
+            if ('売上' in label or category == 'sales') and key:
+                # 計算項目（isCalculated=true）は除外
+                # また、店舗純売上（netSales）はEDW売上とOHB売上の合計なので除外
+                key_lower = key.lower()
+                excluded_keys = ['netsales', 'net_sales', 'net sales', '店舗純売上']
+                is_excluded = field.get('isCalculated', False) or key_lower in excluded_keys or '店舗純売上' in label
+
+                if not is_excluded:
+                    sales_fields.append({
+                        'key': key,
+                        'label': label,
+                    })
+    return sales_fields
+
+def _sales_fields_from_sample(daily_data) -> List[Dict[str, str]]:
+    """daily_data のサンプルから「売上」を含む項目を抽出"""
+    sales_fields = []
+    if isinstance(daily_data, dict):
+        # 最初の日のデータを取得
+        for day_key, day_data in daily_data.items():
+            if isinstance(day_data, dict):
+                # 数値型で「売上」を含むキーを検索
+                for key, value in day_data.items():
+                    if isinstance(value, (int, float)) and value > 0:
+                        # キー名に「売上」や「Sales」が含まれるか、または大きな数値（売上の可能性）
+                        # ただし、店舗純売上（netSales）は除外
+                        key_lower = key.lower()
+                        excluded_keys = ['netsales', 'net_sales', 'net sales']
+                        is_excluded = key_lower in excluded_keys or '店舗純売上' in key
+
+                        if (('売上' in key or 'Sales' in key or 'sales' in key_lower) and
+                            not is_excluded):
+                            # 既に追加されていない場合のみ追加
+                            if not any(sf['key'] == key for sf in sales_fields):
+                                sales_fields.append({
+                                    'key': key,
+                                    'label': key,  # ラベルが見つからない場合はキーを使用
+                                })
+                break  # 最初の日のデータのみを使用
+    return sales_fields
+
+def _query_business_types(store_ids: List[int]) -> Dict[int, Optional[int]]:
+    """店舗ID -> business_type_id（店舗がない場合はNone）を1回のクエリで取得"""
+    rows = execute_query("SELECT id, business_type_id FROM stores WHERE id = ANY(%s)", (store_ids,))
+    business_types = {store_id: None for store_id in store_ids}
+    business_types.update({row['id']: row['business_type_id'] for row in rows})
+    return business_types
+
+def _query_config_fields(business_type_ids: List[int]) -> Dict[int, List[Dict[str, str]]]:
+    """業態ごとのフィールド設定の売上項目を1回のクエリで取得（設定がない業態は空のリスト、複数ある場合は最後に更新したもの）"""
+    # business_type_fieldsテーブルが存在しない場合は、すべての業態を設定なしとして扱う
+    try:
+        rows = execute_query(
+            """
+            SELECT DISTINCT ON (business_type_id) business_type_id, fields
+            FROM business_type_fields
+            WHERE business_type_id = ANY(%s)
+            ORDER BY business_type_id, updated_at DESC NULLS LAST
+            """,
+            (business_type_ids,)
+        )
+    except Exception:
+        rows = []
+    config_fields = {business_type_id: [] for business_type_id in business_type_ids}
+    for row in rows:
+        if row['fields']:
+            config_fields[row['business_type_id']] = _sales_fields_from_config(row['fields'])
+    return config_fields
+
+def _query_sample_fields(store_ids: List[int]) -> Dict[int, List[Dict[str, str]]]:
+    """店舗ごとのdaily_dataのサンプル（最新の月）の売上項目を1回のクエリで取得（見つからない店舗は空のリスト）"""
+    rows = execute_query(
+        """
+        SELECT DISTINCT ON (store_id) store_id, daily_data
+        FROM sales_data
+        WHERE store_id = ANY(%s)
+        ORDER BY store_id, year DESC, month DESC
+        """,
+        (store_ids,)
+    )
+    sample_fields = {store_id: [] for store_id in store_ids}
+    for row in rows:
+        if row['daily_data']:
+            sample_fields[row['store_id']] = _sales_fields_from_sample(row['daily_data'])
+    return sample_fields
+
+class SalesFieldsCache:
+    """
+    売上項目の解決結果のキャッシュ（TTL付き）
+
+    店舗 -> 業態（business_type_id）、業態 -> フィールド設定の売上項目、
+    設定から見つからない店舗のdaily_dataのサンプルの売上項目を別々に保持する。
+    同じ業態の店舗は業態の設定を共有し、キャッシュにないものだけを種類ごとに
+    1回のクエリでまとめて取得する。
+    """
+
+    def __init__(self, ttl: float = SALES_FIELDS_CACHE_TTL):
+        self.ttl = ttl
+        self._store_business_types: Dict[int, Tuple] = {}  # 店舗ID -> (business_type_id, 期限)
+        self._config_fields: Dict[int, Tuple] = {}  # business_type_id -> (売上項目, 期限)
+        self._sample_fields: Dict[int, Tuple] = {}  # 店舗ID -> (売上項目, 期限)
+        self._lock = threading.Lock()
+        # メトリクス
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def _lookup(self, table: Dict[int, Tuple], keys: List[int]):
+        """キャッシュにある値と、ない（または期限切れの）キーを返す"""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = table.get(key)
+                if entry is not None and entry[1] > now:
+                    found[key] = entry[0]
+                else:
+                    missing.append(key)
+            self._hits += len(found)
+            self._misses += len(missing)
+        return found, missing
+
+    def _resolve(self, table: Dict[int, Tuple], keys: List[int], query) -> Dict:
+        """キャッシュにないキーだけを query でまとめて取得して保存"""
+        found, missing = self._lookup(table, keys)
+        if missing:
+            fetched = query(missing)
+            expires_at = time.monotonic() + self.ttl
+            with self._lock:
+                for key, value in fetched.items():
+                    table[key] = (value, expires_at)
+            found.update(fetched)
+        return found
+
+    def get_many(self, store_ids: List[int]) -> Dict[int, List[Dict[str, str]]]:
+        """複数店舗の売上項目を取得（キャッシュにないものは種類ごとに1回のクエリ）"""
+        business_types = self._resolve(self._store_business_types, store_ids, _query_business_types)
+        business_type_ids = list(dict.fromkeys(bt for bt in business_types.values() if bt))
+        config_fields = (
+            self._resolve(self._config_fields, business_type_ids, _query_config_fields) if business_type_ids else {}
+        )
+
+        result = {}
+        need_sample = []
+        for store_id in store_ids:
+            business_type_id = business_types[store_id]
+            if not business_type_id:
+                # 店舗またはbusiness_type_idがない場合は、デフォルトの売上項目
+                result[store_id] = _default_sales_fields()
+            elif config_fields[business_type_id]:
+                result[store_id] = config_fields[business_type_id]
+            else:
+                need_sample.append(store_id)
+
+        # 設定から見つからない店舗は、daily_dataのサンプルから検索
+        if need_sample:
+            sample_fields = self._resolve(self._sample_fields, need_sample, _query_sample_fields)
+            for store_id in need_sample:
+                result[store_id] = sample_fields[store_id] or _default_sales_fields()
+
+        # 呼び出し側での変更がキャッシュに及ばないようコピーを返す
+        return {store_id: [dict(field) for field in fields] for store_id, fields in result.items()}
+
+    def invalidate(self, business_type_id: Optional[int] = None, store_id: Optional[int] = None):
+        """
+        キャッシュを破棄（引数なしの場合はすべて）
+
+        Args:
+            business_type_id: 業態のフィールド設定を変更した場合に指定
+            store_id: 店舗の業態を変更した場合に指定
+        """
+        with self._lock:
+            if business_type_id is None and store_id is None:
+                count = len(self._store_business_types) + len(self._config_fields) + len(self._sample_fields)
+                self._store_business_types.clear()
+                self._config_fields.clear()
+                self._sample_fields.clear()
+            else:
+                count = 0
+                if business_type_id is not None:
+                    count += self._config_fields.pop(business_type_id, None) is not None
+                    # 設定がなくサンプルから解決した店舗も、設定の追加で結果が変わる
+                    stores = [s for s, (bt, _) in self._store_business_types.items() if bt == business_type_id]
+                    for s in stores:
+                        count += self._sample_fields.pop(s, None) is not None
+                if store_id is not None:
+                    count += self._store_business_types.pop(store_id, None) is not None
+                    count += self._sample_fields.pop(store_id, None) is not None
+            self._invalidations += count
+
+    def stats(self) -> Dict:
+        """キャッシュのメトリクスを取得"""
+        with self._lock:
+            return {
+                'stores': len(self._store_business_types),
+                'business_types': len(self._config_fields),
+                'sample_stores': len(self._sample_fields),
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'invalidations': self._invalidations,
+            }
+
+sales_fields_cache = SalesFieldsCache()
+
+@traced()
 def get_sales_fields(store_id: int) -> List[Dict[str, str]]:
     """
-    店舗の売上項目を取得
+    店舗の売上項目を取得（業態ごとにキャッシュした結果を使う）
+    
+    業態（business_type_fields）のフィールド設定から「売上」の項目を抽出し、
+    見つからない場合はdaily_dataのサンプル、それでもない場合はデフォルトの売上項目を返す。
     
     Args:
         store_id: 店舗ID
@@ -12,102 +245,26 @@ def get_sales_fields(store_id: int) -> List[Dict[str, str]]:
     Returns:
         List[Dict]: 売上項目のリスト [{'key': 'edwNetSales', 'label': 'EDW純売上'}, ...]
     """
-    # 店舗のbusiness_type_idを取得
-    store_query = """
-        SELECT business_type_id
-        FROM stores
-        WHERE id = %s
+    return sales_fields_cache.get_many([int(store_id)])[int(store_id)]
+
+def get_sales_fields_bulk(store_ids: Iterable[int]) -> Dict[int, List[Dict[str, str]]]:
     """
-    store_result = execute_query(store_query, (store_id,))
-    
-    if not store_result or not store_result[0]['business_type_id']:
-        # business_type_idがない場合は、デフォルトの売上項目を返す
-        return [
-            {'key': 'edwNetSales', 'label': 'EDW純売上'},
-            {'key': 'ohbNetSales', 'label': 'OHB純売上'},
-        ]
-    
-    business_type_id = store_result[0]['business_type_id']
-    
-    # business_type_fieldsテーブルからフィールド設定を取得（テーブルが存在しない場合はスキップ）
-    fields_result = []
-    try:
-        fields_query = """
-            SELECT fields
-            FROM business_type_fields
-            WHERE business_type_id = %s
-        """
-        fields_result = execute_query(fields_query, (business_type_id,))
-    except Exception:
-        # テーブルが存在しない場合は空の結果として扱う
-        fields_result = []
-    
-    sales_fields = []
-    
-    if fields_result and fields_result[0]['fields']:
-        fields = fields_result[0]['fields']
-        if isinstance(fields, list):
-            for field in fields:
-                # labelに「売上」が含まれる、またはcategoryが'sales'の項目を抽出
-                label = field.get('label', '')
-                category = field.get('category', '')
-                key = field.get('key', '')
-                
-                if ('売上' in label or category == 'sales') and key:
-                    # 計算項目（isCalculated=true）は除外
-                    # また、店舗純売上（netSales）はEDW売上とOHB売上の合計なので除外
-                    key_lower = key.lower()
-                    excluded_keys = ['netsales', 'net_sales', 'net sales', '店舗純売上']
-                    is_excluded = field.get('isCalculated', False) or key_lower in excluded_keys or '店舗純売上' in label
-                    
-                    if not is_excluded:
-                        sales_fields.append({
-                            'key': key,
-                            'label': label,
-                        })
-    
-    # 売上項目が見つからない場合は、daily_dataから「売上」を含む項目を検索
-    if not sales_fields:
-        # サンプルデータから売上項目を抽出
-        sample_query = """
-            SELECT daily_data
-            FROM sales_data
-            WHERE store_id = %s
-            LIMIT 1
-        """
-        sample_result = execute_query(sample_query, (store_id,))
-        
-        if sample_result and sample_result[0]['daily_data']:
-            daily_data = sample_result[0]['daily_data']
-            if isinstance(daily_data, dict):
-                # 最初の日のデータを取得
-                for day_key, day_data in daily_data.items():
-                    if isinstance(day_data, dict):
-                        # 数値型で「売上」を含むキーを検索
-                        for key, value in day_data.items():
-                            if isinstance(value, (int, float)) and value > 0:
-                                # キー名に「売上」や「Sales」が含まれるか、または大きな数値（売上の可能性）
-                                # ただし、店舗純売上（netSales）は除外
-                                key_lower = key.lower()
-                                excluded_keys = ['netsales', 'net_sales', 'net sales']
-                                is_excluded = key_lower in excluded_keys or '店舗純売上' in key
-                                
-                                if (('売上' in key or 'Sales' in key or 'sales' in key_lower) and 
-                                    not is_excluded):
-                                    # 既に追加されていない場合のみ追加
-                                    if not any(sf['key'] == key for sf in sales_fields):
-                                        sales_fields.append({
-                                            'key': key,
-                                            'label': key,  # ラベルが見つからない場合はキーを使用
-                                        })
-                        break  # 最初の日のデータのみを使用
-    
-    # それでも見つからない場合は、デフォルトの売上項目を返す
-    if not sales_fields:
-        sales_fields = [
-            {'key': 'edwNetSales', 'label': 'EDW純売上'},
-            {'key': 'ohbNetSales', 'label': 'OHB純売上'},
-        ]
-    
-    return sales_fields
+    複数店舗の売上項目をまとめて取得（バッチ処理用）
+
+    店舗ごとに get_sales_fields を呼ぶ代わりに、キャッシュにない店舗・業態・
+    daily_dataのサンプルをそれぞれ1回のクエリで取得する。結果は get_sales_fields と同じ。
+
+    Args:
+        store_ids: 店舗IDのリスト
+
+    Returns:
+        Dict[int, List[Dict]]: 店舗IDごとの売上項目のリスト
+    """
+    store_ids = list(dict.fromkeys(int(s) for s in store_ids))
+    if not store_ids:
+        return {}
+    return sales_fields_cache.get_many(store_ids)
 
+def invalidate_sales_fields(business_type_id: Optional[int] = None, store_id: Optional[int] = None):
+    """売上項目のキャッシュを破棄（業態のフィールド設定・店舗の業態を変更した場合に呼ぶ）"""
+    sales_fields_cache.invalidate(business_type_id, store_id)
@@ -0,0 +1,330 @@
+"""リクエスト単位のトレーシング（スパンをファイルまたはOTLP互換のコレクターに書き出す）"""
+import atexit
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+# トレーシング設定
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', 'none')  # 'none' / 'file' / 'otlp'
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')  # 'file' の場合の出力先（1行1スパンのJSON）
+TRACE_OTLP_ENDPOINT = os.getenv('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces')  # OTLP/HTTP（JSON）
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))  # スパンを記録するリクエストの割合
+TRACE_EXPORT_INTERVAL = float(os.getenv('TRACE_EXPORT_INTERVAL', 5.0))  # 書き出し間隔（秒）
+TRACE_EXPORT_BATCH_SIZE = 512  # これだけ溜まったら間隔を待たずに書き出す
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.1))  # 構造化ログを出力する割合
+
+SERVICE_NAME = 'sales-prediction'
+TRACE_HEADER = 'X-Trace-Id'
+
+if TRACE_EXPORTER not in ('none', 'file', 'otlp'):
+    raise ValueError(f"Unknown trace exporter: {TRACE_EXPORTER}")
+
+class TraceContext(NamedTuple):
+    """実行中のトレース（スレッド・プロセスをまたいで引き継ぐ）"""
+    trace_id: str
+    span_id: Optional[str]  # 親スパン（新しいスパンはこの子になる）
+    sampled: bool
+
+_context: ContextVar[Optional[TraceContext]] = ContextVar('trace_context', default=None)
+
+class Span:
+    """1つの処理区間"""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': datetime.fromtimestamp(self.start_ns / 1e9).isoformat(),
+            'duration_ms': (self.end_ns - self.start_ns) / 1e6,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+class _NoopSpan:
+    """記録しない場合のスパン"""
+
+    def set_attribute(self, key: str, value):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class FileSpanExporter:
+    """スパンを1行1件のJSONとしてファイルに追記"""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        lines = ''.join(json.dumps(s.to_dict(), ensure_ascii=False, default=str) + '\n' for s in spans)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+class OTLPSpanExporter:
+    """スパンをOTLP/HTTP（JSON）でコレクターに送信"""
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT):
+        self.endpoint = endpoint
+
+    def export(self, spans: List[Span]):
+        otlp_spans = []
+        for s in spans:
+            otlp_span = {
+                'traceId': s.trace_id,
+                'spanId': s.span_id,
+                'name': s.name,
+                'kind': 1,  # SPAN_KIND_INTERNAL
+                'startTimeUnixNano': str(s.start_ns),
+                'endTimeUnixNano': str(s.end_ns),
+                'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()],
+                'status': {'code': 2, 'message': s.error} if s.error else {'code': 1},
+            }
+            if s.parent_id:
+                otlp_span['parentSpanId'] = s.parent_id
+            otlp_spans.append(otlp_span)
+        payload = {
+            'resourceSpans': [{
+                'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+                'scopeSpans': [{'scope': {'name': SERVICE_NAME}, 'spans': otlp_spans}],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload, default=str).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST',
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+class BatchSpanProcessor:
+    """
+    終了したスパンを溜めてバックグラウンドのスレッドでまとめて書き出す
+
+    書き出し（ファイル・ネットワーク）をリクエストの処理時間に含めないため。
+    スレッドはプロセスごとに最初のスパンで起動する（spawnのワーカープロセスでも動く）。
+    """
+
+    def __init__(self, exporter, interval: float = TRACE_EXPORT_INTERVAL,
+                 batch_size: int = TRACE_EXPORT_BATCH_SIZE):
+        self.exporter = exporter
+        self.interval = interval
+        self.batch_size = batch_size
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def on_end(self, span: Span):
+        with self._lock:
+            self._spans.append(span)
+            full = len(self._spans) >= self.batch_size
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='trace-export', daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """溜まっているスパンを書き出す（失敗した分は捨てる）"""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        try:
+            self.exporter.export(spans)
+        except Exception as e:
+            print(f"[トレース] {len(spans)}件のスパンの書き出しに失敗: {e}")
+
+_processor: Optional[BatchSpanProcessor] = None
+_processor_lock = threading.Lock()
+
+def get_span_processor() -> Optional[BatchSpanProcessor]:
+    """スパンの書き出し先を取得（TRACE_EXPORTER='none' の場合はNone）"""
+    global _processor
+    if TRACE_EXPORTER == 'none':
+        return None
+    with _processor_lock:
+        if _processor is None:
+            exporter = FileSpanExporter() if TRACE_EXPORTER == 'file' else OTLPSpanExporter()
+            _processor = BatchSpanProcessor(exporter)
+            atexit.register(_processor.flush)
+        return _processor
+
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+def _parse_traceparent(header: Optional[str]) -> Optional[TraceContext]:
+    """W3C Trace Context の traceparent ヘッダーを解析（不正な場合はNone）"""
+    match = _TRACEPARENT.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32:
+        return None
+    return TraceContext(match.group(1), match.group(2), bool(int(match.group(3), 16) & 1))
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    処理区間をスパンとして記録する（トレースの外、またはサンプリング対象外の場合は何もしない）
+
+    Yields:
+        Span: set_attribute で属性を追加できる
+    """
+    ctx = _context.get()
+    processor = get_span_processor()
+    if ctx is None or not ctx.sampled or processor is None:
+        yield _NOOP_SPAN
+        return
+
+    current = Span(name, ctx.trace_id, ctx.span_id, attributes)
+    token = _context.set(ctx._replace(span_id=current.span_id))
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _context.reset(token)
+        current.end_ns = time.time_ns()
+        processor.on_end(current)
+
+@contextmanager
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes):
+    """
+    新しいトレースを開始してルートスパンを記録する
+
+    Args:
+        traceparent: 呼び出し元の traceparent ヘッダー（指定した場合は同じトレースの続きとして記録）
+
+    Yields:
+        Span: ルートスパン
+    """
+    ctx = _parse_traceparent(traceparent)
+    if ctx is None:
+        ctx = TraceContext(os.urandom(16).hex(), None, random.random() < TRACE_SAMPLE_RATE)
+    token = _context.set(ctx)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _context.reset(token)
+
+def get_trace_context() -> Optional[TraceContext]:
+    """実行中のトレース（別スレッド・別プロセスに引き継ぐ場合に使う）"""
+    return _context.get()
+
+def get_trace_id() -> Optional[str]:
+    """実行中のトレースID（トレースの外の場合はNone）"""
+    ctx = _context.get()
+    return ctx.trace_id if ctx else None
+
+@contextmanager
+def use_trace_context(ctx: Optional[TraceContext]):
+    """別スレッド・別プロセスで、引き継いだトレースの続きとしてスパンを記録する"""
+    token = _context.set(ctx)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+def traced(name: Optional[str] = None) -> Callable:
+    """関数の呼び出しをスパンとして記録するデコレーター"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name or fn.__name__):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def log_event(event: str, sample_rate: float = LOG_SAMPLE_RATE, **fields):
+    """
+    構造化ログ（1行のJSON、トレースIDを含む）を sample_rate の割合で出力
+
+    Args:
+        event: イベント名
+        sample_rate: 出力する割合（1.0の場合は常に出力）
+    """
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    record = {
+        'ts': datetime.now().isoformat(),
+        'event': event,
+        'trace_id': get_trace_id(),
+        **fields,
+    }
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+class TraceMiddleware:
+    """
+    リクエストごとにトレースを開始し、トレースIDをレスポンスヘッダーで返すASGIミドルウェア
+
+    receive をそのまま渡すため、エンドポイントの request.is_disconnected() でクライアントの
+    切断を検知できる（Starletteの @app.middleware("http") では受信が置き換えられて検知できない）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get('headers') or [])
+        traceparent = headers.get(b'traceparent')
+        method, path = scope['method'], scope['path']
+        with start_trace(
+            f"{method} {path}",
+            traceparent=traceparent.decode('latin-1') if traceparent else None,
+            **{'http.method': method, 'http.target': path},
+        ) as root:
+            trace_id = get_trace_id()
+
+            async def send_with_trace_id(message):
+                if message['type'] == 'http.response.start':
+                    root.set_attribute('http.status_code', message['status'])
+                    message = {
+                        **message,
+                        'headers': [*message.get('headers', []), (TRACE_HEADER.lower().encode(), trace_id.encode())],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)
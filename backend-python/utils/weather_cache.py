@@ -0,0 +1,270 @@
+"""天気データの取得と地点ごとのキャッシュ"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from utils.database import fetch_frame
+
+# キャッシュ設定
+WEATHER_CACHE_LOCATIONS = int(os.getenv('WEATHER_CACHE_LOCATIONS', 256))  # 保持する地点の数
+WEATHER_CACHE_TTL = float(os.getenv('WEATHER_CACHE_TTL', 300))  # この秒数が過ぎたら更新された行を読み直す
+
+WEATHER_COLUMNS = ['temperature', 'humidity', 'precipitation', 'snow', 'windspeed', 'gust', 'pressure', 'feelslike']
+
+Location = Tuple[float, float]
+
+# fetch_frame で読み込む列の型
+_WEATHER_DTYPES = {**{col: 'float64' for col in WEATHER_COLUMNS}, 'weather': 'object'}
+
+def _weather_select() -> str:
+    """天気データを1日1行で取得するSELECT句（updated_at はUTCの日時）"""
+    columns = ["date"]
+    columns += [f"{col}::float8 AS {col}" for col in WEATHER_COLUMNS]
+    columns += ["COALESCE(weather, '') AS weather", "updated_at AT TIME ZONE 'UTC' AS updated_at"]
+    return ",\n            ".join(columns)
+
+def _empty_frame() -> pd.DataFrame:
+    frame = pd.DataFrame({col: pd.Series(dtype=np.float64) for col in WEATHER_COLUMNS})
+    frame['weather'] = pd.Series(dtype=object)
+    frame.index = pd.DatetimeIndex([], name='date')
+    return frame
+
+def _split_frame(rows: pd.DataFrame) -> Tuple[pd.DataFrame, Optional[object]]:
+    """fetch_frame の結果から日付をインデックスとするDataFrame（数値列はfloat64、欠損はNaN）と最新の updated_at を作成"""
+    if rows.empty:
+        return _empty_frame(), None
+    frame = rows[WEATHER_COLUMNS].copy()
+    frame['weather'] = rows['weather'].fillna('').to_numpy()
+    frame.index = pd.DatetimeIndex(rows['date'], name='date')
+    updated_at = rows['updated_at'].max()
+    return frame, (None if pd.isna(updated_at) else updated_at.tz_localize('UTC').to_pydatetime())
+
+def fetch_weather_range(
+    latitude: float, longitude: float, start_date: date, end_date: date, updated_since=None
+) -> Tuple[pd.DataFrame, Optional[object]]:
+    """
+    1地点の期間内の天気データを (latitude, longitude, date) のインデックスで範囲検索
+
+    Args:
+        updated_since: 指定した場合、この日時より後に更新された行だけを取得
+
+    Returns:
+        (日付をインデックスとするDataFrame, 取得した行の最新の updated_at)
+    """
+    query = f"""
+        SELECT
+            {_weather_select()}
+        FROM weather_data
+        WHERE latitude = %(latitude)s AND longitude = %(longitude)s
+        AND date BETWEEN %(start_date)s AND %(end_date)s
+    """
+    params = {
+        'latitude': float(latitude),
+        'longitude': float(longitude),
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+    if updated_since is not None:
+        query += " AND updated_at > %(updated_since)s"
+        params['updated_since'] = updated_since
+    query += " ORDER BY date"
+    rows = fetch_frame(query, params, dtypes=_WEATHER_DTYPES, parse_dates=['date', 'updated_at'])
+    return _split_frame(rows)
+
+def fetch_weather_range_bulk(
+    locations: List[Location], start_date: date, end_date: date
+) -> Dict[Location, Tuple[pd.DataFrame, Optional[object]]]:
+    """複数地点の期間内の天気データを1回のクエリで取得（地点ごとに fetch_weather_range と同じ形式）"""
+    results = {loc: (_empty_frame(), None) for loc in locations}
+    if not locations:
+        return results
+    query = f"""
+        SELECT
+            w.latitude::float8 AS latitude, w.longitude::float8 AS longitude,
+            {_weather_select()}
+        FROM weather_data w
+        JOIN unnest(%(latitudes)s::numeric[], %(longitudes)s::numeric[]) AS loc(latitude, longitude)
+          ON w.latitude = loc.latitude AND w.longitude = loc.longitude
+        WHERE w.date BETWEEN %(start_date)s AND %(end_date)s
+        ORDER BY w.latitude, w.longitude, w.date
+    """
+    rows = fetch_frame(query, {
+        'latitudes': [loc[0] for loc in locations],
+        'longitudes': [loc[1] for loc in locations],
+        'start_date': start_date,
+        'end_date': end_date,
+    }, dtypes={**_WEATHER_DTYPES, 'latitude': 'float64', 'longitude': 'float64'}, parse_dates=['date', 'updated_at'])
+    for (latitude, longitude), group in rows.groupby(['latitude', 'longitude'], sort=False):
+        results[(float(latitude), float(longitude))] = _split_frame(group)
+    return results
+
+def _merge(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """天気データを日付でマージ（同じ日付は後のものを優先）"""
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return _empty_frame()
+    if len(frames) == 1:
+        return frames[0]
+    merged = pd.concat(frames)
+    return merged[~merged.index.duplicated(keep='last')].sort_index()
+
+def _latest(*values):
+    present = [v for v in values if v is not None]
+    return max(present) if present else None
+
+def to_weather_frame(weather: pd.DataFrame) -> pd.DataFrame:
+    """キャッシュの形式（日付インデックス）から 'date' 列（datetime.date）を持つDataFrameに変換"""
+    frame = weather.reset_index()
+    frame['date'] = frame['date'].dt.date
+    return frame
+
+class WeatherCache:
+    """
+    地点（緯度, 経度）ごとの日次の天気データのキャッシュ
+
+    地点ごとに取得済みの期間を1つの連続した範囲として保持し、要求された期間が
+    はみ出した分だけをDBから範囲検索で取得して広げる。WEATHER_CACHE_TTL 秒ごとに
+    前回以降に更新された行（予報の更新など）だけを読み直してマージする。
+    同じ地点の店舗・リクエストの間で共有する。
+    """
+
+    def __init__(self, max_locations: int = WEATHER_CACHE_LOCATIONS, ttl: float = WEATHER_CACHE_TTL):
+        self.max_locations = max_locations
+        self.ttl = ttl
+        self._entries: "OrderedDict[Location, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        # メトリクス
+        self._hits = 0
+        self._misses = 0
+        self._extensions = 0
+        self._refreshes = 0
+        self._evictions = 0
+
+    def _lookup(self, key: Location) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: Location, entry: Dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_locations:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def _new_entry(self, frame: pd.DataFrame, updated_at, start_date: date, end_date: date,
+                   checked_at: Optional[float] = None) -> Dict:
+        return {
+            'frame': frame,
+            'start': start_date,
+            'end': end_date,
+            'updated_at': updated_at,
+            'checked_at': time.monotonic() if checked_at is None else checked_at,
+        }
+
+    def get(self, latitude: float, longitude: float, start_date: date, end_date: date) -> pd.DataFrame:
+        """
+        1地点の期間内の天気データを取得
+
+        Returns:
+            DataFrame: 日付（DatetimeIndex）ごとの WEATHER_COLUMNS（float64）と weather（文字列）
+        """
+        key = (float(latitude), float(longitude))
+        entry = self._lookup(key)
+
+        if entry is None:
+            frame, updated_at = fetch_weather_range(*key, start_date, end_date)
+            entry = self._new_entry(frame, updated_at, start_date, end_date)
+            with self._lock:
+                self._misses += 1
+        else:
+            frames = [entry['frame']]
+            updated_at = entry['updated_at']
+            new_start, new_end = entry['start'], entry['end']
+            refreshed = False
+            if start_date < entry['start']:
+                part, part_updated = fetch_weather_range(*key, start_date, entry['start'] - timedelta(days=1))
+                frames.insert(0, part)
+                updated_at = _latest(updated_at, part_updated)
+                new_start = start_date
+            if end_date > entry['end']:
+                part, part_updated = fetch_weather_range(*key, entry['end'] + timedelta(days=1), end_date)
+                frames.append(part)
+                updated_at = _latest(updated_at, part_updated)
+                new_end = end_date
+            if time.monotonic() - entry['checked_at'] > self.ttl:
+                part, part_updated = fetch_weather_range(
+                    *key, entry['start'], entry['end'], updated_since=entry['updated_at']
+                )
+                frames.append(part)
+                updated_at = _latest(updated_at, part_updated)
+                refreshed = True
+            extended = (new_start, new_end) != (entry['start'], entry['end'])
+            if extended or refreshed:
+                # 期間を広げただけの場合は、更新の確認時刻を引き継ぐ
+                entry = self._new_entry(
+                    _merge(frames), updated_at, new_start, new_end,
+                    checked_at=None if refreshed else entry['checked_at'],
+                )
+            with self._lock:
+                if extended:
+                    self._extensions += 1
+                if refreshed:
+                    self._refreshes += 1
+                if not extended and not refreshed:
+                    self._hits += 1
+
+        self._store(key, entry)
+        return entry['frame'].loc[pd.Timestamp(start_date):pd.Timestamp(end_date)]
+
+    def get_many(self, locations: List[Location], start_date: date, end_date: date) -> Dict[Location, pd.DataFrame]:
+        """
+        複数地点の期間内の天気データを取得（キャッシュにない地点は1回のクエリでまとめて取得）
+        """
+        keys = list(dict.fromkeys((float(lat), float(lon)) for lat, lon in locations))
+        with self._lock:
+            missing = [key for key in keys if key not in self._entries]
+        results = {}
+        if missing:
+            fetched = fetch_weather_range_bulk(missing, start_date, end_date)
+            for key, (frame, updated_at) in fetched.items():
+                self._store(key, self._new_entry(frame, updated_at, start_date, end_date))
+                results[key] = frame
+            with self._lock:
+                self._misses += len(missing)
+        # キャッシュにある地点は期間の拡張・更新の確認を含めて1地点ずつ取得する
+        for key in keys:
+            if key not in results:
+                results[key] = self.get(*key, start_date, end_date)
+        return results
+
+    def invalidate(self, location: Optional[Location] = None):
+        """地点のキャッシュを削除（Noneの場合はすべて）"""
+        with self._lock:
+            if location is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((float(location[0]), float(location[1])), None)
+
+    def stats(self) -> Dict:
+        """キャッシュのメトリクスを取得"""
+        with self._lock:
+            return {
+                'locations': len(self._entries),
+                'max_locations': self.max_locations,
+                'days': sum(len(entry['frame']) for entry in self._entries.values()),
+                'hits': self._hits,
+                'misses': self._misses,
+                'extensions': self._extensions,
+                'refreshes': self._refreshes,
+                'evictions': self._evictions,
+            }
+
+weather_cache = WeatherCache()
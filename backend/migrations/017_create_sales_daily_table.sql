@@ -0,0 +1,88 @@
+-- 日次売上テーブルの作成
+-- sales_data.daily_data（月ごとのJSONB）を1店舗1日1行に展開して保持する
+-- 予測サービスは (store_id, date) の範囲検索で数値項目を直接読み込む（JSONの展開が不要）
+-- sales_data の追加・更新・削除時にトリガーで同期する
+
+CREATE TABLE IF NOT EXISTS sales_daily (
+    store_id INTEGER NOT NULL REFERENCES stores(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    is_holiday BOOLEAN NOT NULL DEFAULT false,
+    weather TEXT,
+    -- 数値（number / boolean）の項目のキーと値（同じ順序、キーの昇順）
+    field_keys TEXT[] NOT NULL DEFAULT '{}',
+    field_values DOUBLE PRECISION[] NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (store_id, date)
+);
+
+-- 1か月分の sales_data を sales_daily に展開し直す
+-- 日付は make_date(年, 月, 1) + (日 - 1) で作り、月が変わる日（2/30など）は除外する
+CREATE OR REPLACE FUNCTION refresh_sales_daily_month(p_store_id INTEGER, p_year INTEGER, p_month INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM sales_daily
+    WHERE store_id = p_store_id
+    AND date >= make_date(p_year, p_month, 1)
+    AND date < make_date(p_year, p_month, 1) + INTERVAL '1 month';
+
+    INSERT INTO sales_daily (store_id, date, is_holiday, weather, field_keys, field_values, updated_at)
+    SELECT
+        s.store_id,
+        make_date(s.year, s.month, 1) + (dk.day_num - 1),
+        CASE WHEN jsonb_typeof(d.value -> 'isHoliday') = 'boolean'
+             THEN (d.value ->> 'isHoliday')::boolean ELSE false END,
+        d.value ->> 'weather',
+        COALESCE(f.keys, '{}'),
+        COALESCE(f.vals, '{}'),
+        s.updated_at
+    FROM sales_data s
+    CROSS JOIN LATERAL jsonb_each(
+        CASE WHEN jsonb_typeof(s.daily_data) = 'object' THEN s.daily_data ELSE '{}'::jsonb END
+    ) AS d
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN d.key ~ '^[1-9][0-9]?$' THEN d.key::int END AS day_num
+    ) AS dk
+    CROSS JOIN LATERAL (
+        SELECT
+            array_agg(v.key ORDER BY v.key) AS keys,
+            array_agg(
+                CASE WHEN jsonb_typeof(v.value) = 'number' THEN (v.value #>> '{}')::float8
+                     WHEN (v.value #>> '{}')::boolean THEN 1 ELSE 0 END
+                ORDER BY v.key
+            ) AS vals
+        FROM jsonb_each(d.value) AS v
+        WHERE jsonb_typeof(v.value) IN ('number', 'boolean')
+    ) AS f
+    WHERE s.store_id = p_store_id AND s.year = p_year AND s.month = p_month
+    AND jsonb_typeof(d.value) = 'object'
+    AND dk.day_num BETWEEN 1 AND 31
+    AND EXTRACT(MONTH FROM make_date(s.year, s.month, 1) + (dk.day_num - 1)) = s.month;
+END;
+$$ LANGUAGE plpgsql;
+
+-- sales_data の変更を sales_daily に反映するトリガー
+CREATE OR REPLACE FUNCTION sync_sales_daily()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM refresh_sales_daily_month(OLD.store_id, OLD.year, OLD.month);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM refresh_sales_daily_month(NEW.store_id, NEW.year, NEW.month);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_sync_sales_daily ON sales_data;
+CREATE TRIGGER trg_sync_sales_daily
+    AFTER INSERT OR UPDATE OR DELETE ON sales_data
+    FOR EACH ROW EXECUTE FUNCTION sync_sales_daily();
+
+-- 既存のデータを展開
+SELECT refresh_sales_daily_month(store_id, year, month) FROM sales_data;
+
+-- コメント
+COMMENT ON TABLE sales_daily IS '日次売上データ（sales_data.daily_data を1店舗1日1行に展開、トリガーで同期）';
+COMMENT ON COLUMN sales_daily.field_keys IS '数値項目のキー（field_values と同じ順序）';
+COMMENT ON COLUMN sales_daily.field_values IS '数値項目の値（booleanは1/0）';
@@ -0,0 +1,85 @@
+-- 事前計算した売上予測のテーブルの作成
+-- 予測サービス（precompute_forecasts.py / FORECAST_PRECOMPUTE_INTERVAL）が店舗ごとに
+-- 今日から N 日分の予測を書き込み、/predict は (store_id, start_date) の主キーの1回の検索で返す
+-- 店舗の売上・天気・位置が変わった行はトリガーで削除する（次の事前計算までその場で予測する）
+
+CREATE TABLE IF NOT EXISTS sales_forecasts (
+    store_id INTEGER NOT NULL REFERENCES stores(id) ON DELETE CASCADE,
+    start_date DATE NOT NULL,
+    predict_days INTEGER NOT NULL,
+    predictions JSONB NOT NULL,
+    metrics JSONB NOT NULL,
+    version TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    data_as_of TIMESTAMP WITH TIME ZONE NOT NULL,
+    computed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (store_id, start_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_sales_forecasts_start_date ON sales_forecasts(start_date);
+
+-- 売上データが変わった店舗の予測を削除するトリガー
+CREATE OR REPLACE FUNCTION delete_sales_forecasts_for_sales()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM sales_forecasts WHERE store_id = OLD.store_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        DELETE FROM sales_forecasts WHERE store_id = NEW.store_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_delete_sales_forecasts ON sales_data;
+CREATE TRIGGER trg_delete_sales_forecasts
+    AFTER INSERT OR UPDATE OR DELETE ON sales_data
+    FOR EACH ROW EXECUTE FUNCTION delete_sales_forecasts_for_sales();
+
+-- 天気データが変わった地点の店舗の予測を削除するトリガー
+CREATE OR REPLACE FUNCTION delete_sales_forecasts_for_weather()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM sales_forecasts WHERE store_id IN (
+            SELECT id FROM stores WHERE latitude = OLD.latitude AND longitude = OLD.longitude
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        DELETE FROM sales_forecasts WHERE store_id IN (
+            SELECT id FROM stores WHERE latitude = NEW.latitude AND longitude = NEW.longitude
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_delete_sales_forecasts ON weather_data;
+CREATE TRIGGER trg_delete_sales_forecasts
+    AFTER INSERT OR UPDATE OR DELETE ON weather_data
+    FOR EACH ROW EXECUTE FUNCTION delete_sales_forecasts_for_weather();
+
+-- 位置が変わった店舗の予測を削除するトリガー（天気の地点が変わる）
+CREATE OR REPLACE FUNCTION delete_sales_forecasts_for_store()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM sales_forecasts WHERE store_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_delete_sales_forecasts ON stores;
+CREATE TRIGGER trg_delete_sales_forecasts
+    AFTER UPDATE OF latitude, longitude ON stores
+    FOR EACH ROW
+    WHEN (OLD.latitude IS DISTINCT FROM NEW.latitude OR OLD.longitude IS DISTINCT FROM NEW.longitude)
+    EXECUTE FUNCTION delete_sales_forecasts_for_store();
+
+-- コメント
+COMMENT ON TABLE sales_forecasts IS '事前計算した売上予測（店舗・予測開始日ごと、売上・天気・位置の変更時はトリガーで削除）';
+COMMENT ON COLUMN sales_forecasts.predictions IS '日ごとの予測値（/predict の predictions と同じ形式）';
+COMMENT ON COLUMN sales_forecasts.metrics IS '売上項目ごとの評価指標（/predict の metrics と同じ形式）';
+COMMENT ON COLUMN sales_forecasts.version IS '予測に使ったデータのフィンガープリントとモデルファイルの版';
+COMMENT ON COLUMN sales_forecasts.model_version IS '予測に使ったモデルファイルの版（/predict の時点のモデルと違えば使わない）';
+COMMENT ON COLUMN sales_forecasts.data_as_of IS '予測に使ったデータを読み込む前の時刻（これ以降に売上・天気が更新された結果は保存しない）';